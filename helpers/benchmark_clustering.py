@@ -0,0 +1,326 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # Allow relative imports
+
+import numpy as np
+import tlsh
+from omegaconf import OmegaConf
+from sklearn.metrics import adjusted_rand_score
+
+from scanner.Detection.ClusteringBased.Clustering.ClusteringUtil import preprocess_data
+from scanner.Detection.ClusteringBased.Clustering.DBSCANClustering import DBSCANClustering
+from scanner.Detection.ClusteringBased.Clustering.DummyClustering import DummyClustering
+from scanner.Detection.ClusteringBased.Clustering.KMedoidsClustering import KMedoidsClustering
+from scanner.Detection.ClusteringBased.Clustering.OPTICSClustering import OPTICSClustering
+from scanner.Utilities.Distance import Distance
+from scanner.Utilities.Logging import get_logger
+from scanner.Utilities.Util import set_config
+
+logger = get_logger('Benchmark Clustering')
+
+repository_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+default_sizes = [25, 50, 100, 200, 400]
+default_distance_types = ['hash2vec', 'tlsh', 'levenshtein', 'levenshtein-bounded', 'hamming', 'jaro-winkler-inverted',
+                          'mlipns', 'damerau_levenshtein', 'minhash']
+default_algorithms = ['dbscan', 'kmedoids', 'optics', 'dummy']
+default_eps_strategies = ['sil', 'knee', 'kneed_lib', 'infinitesimal-fixed']
+
+# Distance types compared on the synthetic bodies instead of their TLSH hashes
+body_distance_types = ['levenshtein-bounded', 'minhash']
+
+# Characters of the synthetic bodies (HTML-like, so that TLSH sees a realistic byte distribution)
+body_alphabet = string.ascii_letters + string.digits + '<>/="  '
+
+
+def generate_dataset(size: int,
+                     cluster_count: int,
+                     duplicate_ratio: float,
+                     mutation_rate: float,
+                     body_length: int,
+                     seed: int) -> list:
+    """
+    Generates synthetic interactions with a known cluster structure: Every cluster has a random prototype body and its
+    samples are copies of the prototype with a share of mutated chars. A share of the samples are exact duplicates of
+    earlier samples (e.g. revisited pages).
+
+    :param size: Count of samples
+    :type size: int
+
+    :param cluster_count: Count of clusters (prototypes)
+    :type cluster_count: int
+
+    :param duplicate_ratio: Share of samples that duplicate an earlier sample
+    :type duplicate_ratio: float
+
+    :param mutation_rate: Share of mutated chars of a sample compared to its prototype
+    :type mutation_rate: float
+
+    :param body_length: Length of the bodies
+    :type body_length: int
+
+    :param seed: Seed of the generator
+    :type seed: int
+
+    :return: Dicts with '_id', 'data' (the body), 'hash' (TLSH of the body) and 'label' (the cluster)
+    :rtype: list
+    """
+
+    generator = random.Random(seed)
+    prototypes = [''.join(generator.choice(body_alphabet) for _ in range(body_length)) for _ in range(cluster_count)]
+
+    dataset = []
+    for idx in range(size):
+        if len(dataset) > 0 and generator.random() < duplicate_ratio:
+            duplicate = dict(generator.choice(dataset))
+            duplicate['_id'] = idx
+            dataset.append(duplicate)
+            continue
+
+        label = generator.randrange(cluster_count)
+        body = list(prototypes[label])
+        for position in generator.sample(range(body_length), int(body_length * mutation_rate)):
+            body[position] = generator.choice(body_alphabet)
+        body = ''.join(body)
+
+        dataset.append({'_id': idx, 'data': body, 'hash': tlsh.hash(body.encode()), 'label': label})
+
+    return dataset
+
+
+def get_configurations(distance_types: list, algorithms: list, eps_strategies: list) -> list:
+    """
+    :return: The benchmarked (distance type, algorithm, eps strategy) combinations (the eps strategy is None for the
+             algorithms without eps)
+    :rtype: list
+    """
+
+    configurations = []
+    for algorithm in algorithms:
+        if algorithm == 'dummy':
+            # The dummy clustering groups identical values and does not use a distance
+            configurations.append((None, algorithm, None))
+            continue
+        for distance_type in distance_types:
+            if algorithm == 'dbscan':
+                configurations.extend((distance_type, algorithm, eps) for eps in eps_strategies)
+            else:
+                configurations.append((distance_type, algorithm, None))
+    return configurations
+
+
+def run_clustering(dataset: list, distance_type: str, algorithm: str, eps) -> tuple:
+    field_for_distance = 'data' if distance_type in body_distance_types else 'hash'
+
+    if algorithm == 'dbscan':
+        return DBSCANClustering().cluster(data=dataset, distance_type=distance_type, eps=eps,
+                                          field_for_distance=field_for_distance)
+    if algorithm == 'kmedoids':
+        return KMedoidsClustering().cluster(data=dataset, distance_type=distance_type,
+                                            field_for_distance=field_for_distance)
+    if algorithm == 'optics':
+        return OPTICSClustering().cluster(data=dataset, distance_type=distance_type,
+                                          field_for_distance=field_for_distance)
+    if algorithm == 'dummy':
+        return DummyClustering().cluster(data=dataset, field_for_distance='hash')
+
+    raise ValueError(f'Unknown algorithm {algorithm}. Please select one of the following: {", ".join(default_algorithms)}')
+
+
+def measure(function, repeats: int) -> tuple:
+    """
+    Runs a function repeatedly and measures the median wall time, then runs it once more with tracemalloc to measure
+    the peak memory (the timed runs are not traced, as tracing slows down every allocation)
+
+    :return: The result of the last timed run, the median seconds and the peak memory in bytes
+    :rtype: tuple
+    """
+
+    durations = []
+    result = None
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - started_at)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return result, statistics.median(durations), peak_memory
+
+
+def get_scaling_exponent(sizes: list, seconds: list):
+    """
+    :return: The slope of the log-log fit of the durations (e.g. about 2 for a quadratic cost), None for less than two
+             measured sizes
+    :rtype: float
+    """
+
+    measured = [(size, duration) for size, duration in zip(sizes, seconds) if duration > 0]
+    if len(measured) < 2:
+        return None
+    log_sizes, log_seconds = np.log([size for size, _ in measured]), np.log([duration for _, duration in measured])
+    return float(np.polyfit(log_sizes, log_seconds, 1)[0])
+
+
+def benchmark(sizes: list,
+              distance_types: list,
+              algorithms: list,
+              eps_strategies: list,
+              cluster_count: int = 5,
+              duplicate_ratio: float = 0.2,
+              mutation_rate: float = 0.05,
+              body_length: int = 512,
+              repeats: int = 1,
+              max_seconds: float = 60,
+              seed: int = 3) -> dict:
+    """
+    Times the distance matrix, the preprocessing and the clustering of every configuration on datasets of growing size.
+    Once a configuration takes longer than max_seconds, its larger sizes are skipped.
+
+    :return: The environment, the dataset parameters and one result per configuration with a measurement per size
+    :rtype: dict
+    """
+
+    datasets = {size: generate_dataset(size, cluster_count, duplicate_ratio, mutation_rate, body_length, seed)
+                for size in sizes}
+
+    results = []
+    for distance_type, algorithm, eps in get_configurations(distance_types, algorithms, eps_strategies):
+        configuration_name = '/'.join(str(part) for part in (distance_type, algorithm, eps) if part is not None)
+        measurements = []
+        for size in sizes:
+            dataset = datasets[size]
+            ground_truth = [entry['label'] for entry in dataset]
+            field_for_distance = 'data' if distance_type in body_distance_types else 'hash'
+            measurement = {'n': size, 'pairs': size * (size - 1) // 2}
+
+            try:
+                if distance_type is not None:
+                    if distance_type != 'hash2vec':
+                        _, distance_seconds, distance_memory = measure(
+                            lambda: Distance.generate_distance_matrix(dataset, distance_type,
+                                                                      field_for_distance=field_for_distance,
+                                                                      output='condensed'), repeats)
+                        measurement['distance_seconds'] = distance_seconds
+                        measurement['distance_peak_memory_bytes'] = distance_memory
+                        if distance_seconds > 0:
+                            measurement['pairs_per_second'] = measurement['pairs'] / distance_seconds
+
+                    _, preprocess_seconds, preprocess_memory = measure(
+                        lambda: preprocess_data(distance_type, dataset, None, '_id', field_for_distance), repeats)
+                    measurement['preprocess_seconds'] = preprocess_seconds
+                    measurement['preprocess_peak_memory_bytes'] = preprocess_memory
+
+                (cluster_count_found, labels), cluster_seconds, cluster_memory = measure(
+                    lambda: run_clustering(dataset, distance_type, algorithm, eps), repeats)
+            except Exception as exception:
+                logger.warning(f'{configuration_name} failed for n={size}: {exception}')
+                measurement['error'] = repr(exception)
+                measurements.append(measurement)
+                break
+
+            measurement['cluster_seconds'] = cluster_seconds
+            measurement['cluster_peak_memory_bytes'] = cluster_memory
+            if cluster_seconds > 0:
+                measurement['samples_per_second'] = size / cluster_seconds
+            measurement['clusters'] = int(cluster_count_found)
+            measurement['adjusted_rand_index'] = float(adjusted_rand_score(ground_truth, list(labels)))
+            measurements.append(measurement)
+            logger.info(f'{configuration_name} n={size}: {cluster_seconds:.3f}s, {cluster_count_found} clusters')
+
+            if cluster_seconds > max_seconds:
+                logger.info(f'{configuration_name} exceeded {max_seconds}s, skipping the larger sizes')
+                break
+
+        timed = [measurement for measurement in measurements if 'cluster_seconds' in measurement]
+        results.append({'distance_type': distance_type,
+                        'algorithm': algorithm,
+                        'eps': eps,
+                        'measurements': measurements,
+                        'scaling_exponent': get_scaling_exponent([measurement['n'] for measurement in timed],
+                                                                 [measurement['cluster_seconds'] for measurement in timed])})
+
+    return {'environment': {'python': platform.python_version(),
+                            'platform': platform.platform(),
+                            'cpu_count': os.cpu_count(),
+                            'numpy': np.__version__},
+            'dataset': {'sizes': sizes,
+                        'cluster_count': cluster_count,
+                        'duplicate_ratio': duplicate_ratio,
+                        'mutation_rate': mutation_rate,
+                        'body_length': body_length,
+                        'seed': seed},
+            'repeats': repeats,
+            'results': results}
+
+
+def load_benchmark_config(replace: list = None, use_distance_cache: bool = False):
+    """
+    :return: The config.yaml of the repository with the replacements (the distance cache is disabled unless requested,
+             so that repeated runs measure the calculation and not the cache)
+    """
+
+    config = OmegaConf.load(os.path.join(repository_root, 'config.yaml'))
+    if not use_distance_cache:
+        config.merge_with(OmegaConf.create({'distance_cache': {'enabled': False}}))
+    if replace:
+        config.merge_with(OmegaConf.from_dotlist(replace))
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the distance types and clustering algorithms on synthetic data')
+    parser.add_argument('--output', default='benchmark_clustering.json', help='Path of the JSON report')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes, help='Sample counts of the datasets')
+    parser.add_argument('--distance-types', nargs='+', default=default_distance_types)
+    parser.add_argument('--algorithms', nargs='+', default=default_algorithms, choices=default_algorithms)
+    parser.add_argument('--eps', nargs='+', default=default_eps_strategies,
+                        help='DBSCAN eps strategies (sil, knee, kneed_lib, infinitesimal-fixed or a number)')
+    parser.add_argument('--clusters', type=int, default=5, help='Count of clusters of the datasets')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2, help='Share of duplicated samples')
+    parser.add_argument('--mutation-rate', type=float, default=0.05, help='Share of mutated chars within a cluster')
+    parser.add_argument('--body-length', type=int, default=512, help='Length of the synthetic bodies')
+    parser.add_argument('--repeats', type=int, default=1, help='Runs per measurement (the median is reported)')
+    parser.add_argument('--max-seconds', type=float, default=60,
+                        help='Skip the larger sizes of a configuration after a clustering took longer')
+    parser.add_argument('--seed', type=int, default=3)
+    parser.add_argument('--use-distance-cache', action='store_true', help='Keep the distance cache enabled')
+    parser.add_argument('--replace', required=False, nargs='+',
+                        help='Config replacements (e.g. distance.parallel_min_samples=100)')
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output)
+    # The modules read config.yaml relative to the working dir
+    os.chdir(repository_root)
+    set_config(load_benchmark_config(args.replace, args.use_distance_cache))
+
+    eps_strategies = [float(eps) if eps.replace('.', '', 1).isdigit() else eps for eps in args.eps]
+    report = benchmark(sizes=sorted(args.sizes),
+                       distance_types=args.distance_types,
+                       algorithms=args.algorithms,
+                       eps_strategies=eps_strategies,
+                       cluster_count=args.clusters,
+                       duplicate_ratio=args.duplicate_ratio,
+                       mutation_rate=args.mutation_rate,
+                       body_length=args.body_length,
+                       repeats=args.repeats,
+                       max_seconds=args.max_seconds,
+                       seed=args.seed)
+
+    with open(output_path, 'w') as file:
+        json.dump(report, file, indent=2)
+    logger.info(f'Report written to {output_path}')
@@ -1,9 +1,25 @@
-from configparser import ConfigParser
+import argparse
+import gzip
+import io
+import json
+import os
 import shutil
-from bson.json_util import dumps, loads
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from bson.json_util import dumps
 from pymongo import MongoClient
-import os
-import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # Allow relative imports
+
+from scanner.Utilities.ResponseBodyStore import ResponseBodyStore
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
  ##### Parse config ######
 host = "mongo.docker"
@@ -15,54 +31,314 @@ interactions_db_name = 'interactions'
 states_db_name = 'states'
 endpoint_clustering_db_name = 'endpoint_clustering'
 interaction_clustering_db_name = 'interaction_clustering'
+cursors_db_name = 'cursors'
+response_bodies_db_name = 'response_bodies'
+incremental_clustering_db_name = 'incremental_clustering'
+
+output_folder = 'mongo_data'
+manifest_file_name = 'export_manifest.json'
+
+# Documents fetched per round trip, which bounds the memory used by one exported collection
+cursor_batch_size = 500
+
+# Extensions of the exported files mapped by (format, compression). The legacy JSON format (one array per collection,
+# read by the notebooks) is not compressed.
+file_extensions = {('json', None): '.json',
+                   ('ndjson', None): '.ndjson',
+                   ('ndjson', 'gzip'): '.ndjson.gz',
+                   ('ndjson', 'zstd'): '.ndjson.zst'}
 
 ####### Export data ######
-client = MongoClient(host=host,port=port)
-# Check server connection
-try:
-    client.server_info()
-except:
-    raise ConnectionError("Something went wrong when trying to connect to mongo host")
+_client = None
+_client_lock = Lock()
 
 
-def export_whole_db(root_dir):
-    all_batches = client['experiments'].list_collection_names()
+def get_client() -> MongoClient:
+    """
+    :return: The client of the exported DB (connected on first use)
+    :rtype: MongoClient
+
+    :raises ConnectionError: When the connection fails because of bad host setup
+    """
+
+    global _client
+    with _client_lock:
+        if _client is None:
+            client = MongoClient(host=host, port=port)
+            # Check server connection
+            try:
+                client.server_info()
+            except:
+                raise ConnectionError("Something went wrong when trying to connect to mongo host")
+            _client = client
+    return _client
+
+
+def open_export_file(path: str, compression: str = None):
+    """
+    :param path: Path of the exported file
+    :type path: str
+
+    :param compression: None, 'gzip' or 'zstd'
+    :type compression: str
+
+    :return: A text file object writing to the path with the given compression
+    """
+
+    if compression is None:
+        return open(path, 'w', encoding='utf-8')
+    if compression == 'gzip':
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError("The zstd compression requires the zstandard package (pip install zstandard)")
+        raw_file = open(path, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(raw_file), encoding='utf-8')
+
+    raise ValueError(f'Unknown compression {compression}. Please select one of the following: gzip, zstd')
+
+
+def inline_response_bodies(interaction_documents: list, response_bodies_collection) -> list:
+    """
+    Loads the response bodies referenced by digest (see ResponseBodyStore) into the 'response.data' of the given
+    interactions, so that the exported interactions contain their bodies as if the body store was disabled
+
+    :param interaction_documents: Interactions of a batch
+    :type interaction_documents: list
+
+    :param response_bodies_collection: The response bodies collection of the batch
+    :type response_bodies_collection: Collection
+
+    :return: The same interactions with their bodies filled in
+    :rtype: list
+    """
+
+    unresolved_responses = [document['response'] for document in interaction_documents
+                            if isinstance(document.get('response'), dict)
+                            and document['response'].get('body_digest') is not None
+                            and document['response'].get('data') is None]
+    if len(unresolved_responses) == 0:
+        return interaction_documents
+
+    bodies = ResponseBodyStore(response_bodies_collection).get_many([response['body_digest']
+                                                                     for response in unresolved_responses])
+    for response in unresolved_responses:
+        response['data'] = bodies.get(response['body_digest'], '')
+    return interaction_documents
+
+
+def iterate_documents(collection, response_bodies_collection=None):
+    """
+    Yields the documents of a collection (in chunks of the cursor batch size, with the response bodies inlined if a
+    response bodies collection is given)
+    """
+
+    chunk = []
+    for document in collection.find({}).batch_size(cursor_batch_size):
+        chunk.append(document)
+        if len(chunk) >= cursor_batch_size:
+            yield from (chunk if response_bodies_collection is None
+                        else inline_response_bodies(chunk, response_bodies_collection))
+            chunk = []
+    yield from (chunk if response_bodies_collection is None
+                else inline_response_bodies(chunk, response_bodies_collection))
+
+
+def export_collection(collection, export_path: str, compression: str = None, export_format: str = 'json',
+                      response_bodies_collection=None) -> int:
+    """
+    Streams a collection to a JSON file (one array of extended JSON documents) or a NDJSON file (one extended JSON
+    document per line). The documents are written to a temporary file that is renamed when the export is complete, so
+    that an interrupted export leaves no partial file.
+
+    :param collection: The exported collection
+    :type collection: Collection
 
+    :param export_path: Path of the exported file
+    :type export_path: str
+
+    :param compression: None, 'gzip' or 'zstd'
+    :type compression: str
+
+    :param export_format: 'json' or 'ndjson'
+    :type export_format: str
+
+    :param response_bodies_collection: The response bodies collection of the batch, if the exported collection holds
+                                       interactions whose bodies are inlined
+    :type response_bodies_collection: Collection
+
+    :return: The count of exported documents
+    :rtype: int
+    """
+
+    temporary_path = f'{export_path}.part'
+    document_count = 0
+
+    with open_export_file(temporary_path, compression) as file:
+        if export_format == 'json':
+            file.write('[')
+        for document in iterate_documents(collection, response_bodies_collection):
+            if export_format == 'json':
+                if document_count > 0:
+                    file.write(', ')
+                file.write(dumps(document))
+            else:
+                file.write(dumps(document))
+                file.write('\n')
+            document_count += 1
+        if export_format == 'json':
+            file.write(']')
+
+    os.replace(temporary_path, export_path)
+    return document_count
+
+
+def get_collections_to_export(client: MongoClient, batch_name: str) -> dict:
+    """
+    :return: The collections of a batch mapped by the name of their export file
+    :rtype: dict
+    """
+
+    collections_to_export = dict()
+    collections_to_export["endpoints"] = client[endpoints_db_name][batch_name]
+    collections_to_export["interactions"] = client[interactions_db_name][batch_name]
+    collections_to_export["states"] = client[states_db_name][batch_name]
+    collections_to_export["endpoint_clustering"] = client[endpoint_clustering_db_name][batch_name]
+    collections_to_export["interaction_clustering"] = client[interaction_clustering_db_name][batch_name]
+    collections_to_export["incremental_clustering"] = client[incremental_clustering_db_name][batch_name]
+    collections_to_export["cursors"] = client[cursors_db_name][batch_name]
+    collections_to_export["response_bodies"] = client[response_bodies_db_name][batch_name]
+    collections_to_export["experiments"] = client['experiments'][batch_name]
+    return collections_to_export
+
+
+def read_manifest(root_dir: str) -> dict:
+    """
+    :return: The manifest of the previous exports into the root dir (with no batches if there is none)
+    :rtype: dict
+    """
+
+    manifest_path = os.path.join(root_dir, manifest_file_name)
+    if not os.path.exists(manifest_path):
+        return {'batches': dict()}
+
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def write_manifest(root_dir: str, manifest: dict):
+    manifest_path = os.path.join(root_dir, manifest_file_name)
+    temporary_path = f'{manifest_path}.part'
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temporary_path, manifest_path)
+
+
+def export_whole_db(root_dir, compression=None, incremental=False, max_workers=4, client=None, export_format='json'):
+    """
+    Exports every batch listed in the experiments DB to '<root_dir>/<batch>/mongo_data/<collection>.json' (or
+    '<collection>.ndjson' with the ndjson format). The collections of all batches are streamed concurrently and the
+    exported batches are recorded in a manifest in the root dir.
+
+    :param root_dir: The dir where the data is going to be saved
+    :type root_dir: str
+
+    :param compression: None, 'gzip' or 'zstd' (only for the ndjson format)
+    :type compression: str
+
+    :param incremental: Export only the batches that are not in the manifest of a previous export into the root dir
+    :type incremental: bool
+
+    :param max_workers: Number of collections exported at the same time
+    :type max_workers: int
+
+    :param client: The client of the exported DB (the Mongo host of this script if None)
+    :type client: MongoClient
+
+    :param export_format: 'json' (one array per collection, as read by the notebooks) or 'ndjson' (one document per
+                          line, streamed by import_and_redetect.py)
+    :type export_format: str
+
+    :return: The manifest of the export
+    :rtype: dict
+    """
+
+    if export_format not in ('json', 'ndjson'):
+        raise ValueError(f'Unknown format {export_format}. Please select one of the following: json, ndjson')
+    if (export_format, compression) not in file_extensions:
+        if export_format == 'json' and compression is not None:
+            raise ValueError('Compressed exports require the ndjson format')
+        raise ValueError(f'Unknown compression {compression}. Please select one of the following: gzip, zstd')
+
+    if client is None:
+        client = get_client()
+
+    root_dir = os.path.abspath(root_dir)
     os.makedirs(root_dir, exist_ok=True)
-    os.chdir(root_dir)
-
-    for batch_name in all_batches:
-        os.makedirs(batch_name)
-        os.chdir(batch_name)
-        collections_to_export = dict()
-        collections_to_export["endpoints"] = client[endpoints_db_name][batch_name]
-        collections_to_export["interactions"] = client[interactions_db_name][batch_name]
-        collections_to_export["states"] = client[states_db_name][batch_name]
-        collections_to_export["endpoint_clustering"] = client[endpoint_clustering_db_name][batch_name]
-        collections_to_export["interaction_clustering"] = client[interaction_clustering_db_name][batch_name]
-        collections_to_export["experiments"] = client['experiments'][batch_name]
-
-        output_folder = 'mongo_data'
-        path = os.path.join(os.getcwd(), output_folder)
-
-        if os.path.exists(path):
-            if input(f"There is a folder called {output_folder}. Do you want to replace it's content? (y/n)") != "y":
-                print("Operation canceled")
-                exit()
+
+    manifest = read_manifest(root_dir)
+    all_batches = client['experiments'].list_collection_names()
+    if incremental:
+        batches_to_export = [batch_name for batch_name in all_batches if batch_name not in manifest['batches']]
+    else:
+        batches_to_export = all_batches
+
+    # Ask once before the concurrent export starts
+    existing_paths = [os.path.join(root_dir, batch_name, output_folder) for batch_name in batches_to_export
+                      if os.path.exists(os.path.join(root_dir, batch_name, output_folder))]
+    if len(existing_paths) > 0:
+        if input(f"There are {len(existing_paths)} folders called {output_folder}. Do you want to replace their content? (y/n)") != "y":
+            print("Operation canceled")
+            exit()
+        for path in existing_paths:
             shutil.rmtree(path)
 
-        os.makedirs(path)
+    for batch_name in batches_to_export:
+        os.makedirs(os.path.join(root_dir, batch_name, output_folder))
 
-        for db_name, collection in collections_to_export.items():
-            cursor = collection.find({})
-            export_path = os.path.join(os.getcwd(), output_folder, f'{db_name}.json')
-            with open(export_path, 'w') as file:
-                data = json.loads(dumps(cursor))
-                json.dump(data, file)
+    extension = file_extensions[(export_format, compression)]
+    tasks = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch_name in batches_to_export:
+            collections_to_export = get_collections_to_export(client, batch_name)
+            for collection_name, collection in collections_to_export.items():
+                export_path = os.path.join(root_dir, batch_name, output_folder, f'{collection_name}{extension}')
+                # Interactions are exported with their bodies, also if the body store is enabled
+                response_bodies_collection = (collections_to_export['response_bodies']
+                                              if collection_name == 'interactions' else None)
+                future = executor.submit(export_collection, collection, export_path, compression, export_format,
+                                         response_bodies_collection)
+                tasks.append((batch_name, collection_name, future))
+
+        exported_counts = dict()
+        for batch_name, collection_name, future in tasks:
+            exported_counts.setdefault(batch_name, dict())[collection_name] = future.result()
+
+    exported_at = int(round(time.time() * 1000))
+    for batch_name in batches_to_export:
+        manifest['batches'][batch_name] = {'exported_at': exported_at,
+                                           'format': export_format,
+                                           'compression': compression,
+                                           'document_counts': exported_counts[batch_name]}
+        print(f'Exported {batch_name}: {exported_counts[batch_name]}')
+
+    write_manifest(root_dir, manifest)
+    return manifest
 
-        os.chdir('..')
-    os.chdir('../..')
 
 if __name__ == '__main__':
-    root_dir = input("Give a name of the root dir where data is going to be saved: ")
-    export_whole_db(root_dir)
+    parser = argparse.ArgumentParser(description='Export all batches of the DB as JSON or NDJSON files')
+    parser.add_argument('root_dir', nargs='?', help='Root dir where data is going to be saved')
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='json',
+                        help='json: one array per collection (default), ndjson: one document per line')
+    parser.add_argument('--compression', choices=['gzip', 'zstd'], default=None, help='Only for the ndjson format')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Export only the batches created since the last export into the root dir')
+    parser.add_argument('--max-workers', type=int, default=4, help='Number of collections exported at the same time')
+    args = parser.parse_args()
+
+    root_dir = args.root_dir
+    if root_dir is None:
+        root_dir = input("Give a name of the root dir where data is going to be saved: ")
+    export_whole_db(root_dir, compression=args.compression, incremental=args.incremental, max_workers=args.max_workers,
+                    export_format=args.format)
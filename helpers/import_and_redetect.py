@@ -0,0 +1,294 @@
+import argparse
+import ast
+import gzip
+import importlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))  # Allow relative imports
+
+from bson.json_util import loads
+from omegaconf import OmegaConf
+
+from scanner.Utilities.Logging import get_logger
+from scanner.Utilities.MongoHelper import MongoHelper
+from scanner.Utilities.Util import get_hash_padding, set_config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = get_logger('Import and Redetect')
+
+# Sections of the exported experiment config that describe the infrastructure of the exporting run (not the
+# detection) and are therefore taken from the local config.yaml
+infrastructure_sections = ['mongo_db_credentials', 'mongo_db_names', 'mongo_db_connection_pool', 'mongo_write_buffer',
+                           'storage', 'hash_padding', '_id']
+
+# Documents inserted per round trip
+insert_chunk_size = 1000
+
+# Upper bound for the detection rounds, in case the detectors keep producing work for each other
+max_detection_rounds = 100
+
+
+def find_export_file(data_dir: str, collection_name: str) -> str:
+    """
+    :return: The export file of a collection in any of the layouts of export_mongo_db_whole.py (None if missing)
+    :rtype: str
+    """
+
+    for extension in ['.ndjson', '.ndjson.gz', '.ndjson.zst', '.json']:
+        path = os.path.join(data_dir, f'{collection_name}{extension}')
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def read_export_file(path: str):
+    """
+    Yields the documents of an exported collection. NDJSON files are streamed line by line, legacy JSON files
+    (one array per collection) are loaded at once.
+
+    :param path: Path of the exported file
+    :type path: str
+    """
+
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as file:
+            for document in loads(file.read()):
+                yield document
+        return
+
+    if path.endswith('.gz'):
+        file = gzip.open(path, 'rt', encoding='utf-8')
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Reading zstd exports requires the zstandard package (pip install zstandard)")
+        file = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+    else:
+        file = open(path, 'r', encoding='utf-8')
+
+    with file:
+        for line in file:
+            if line.strip() != '':
+                yield loads(line)
+
+
+def load_experiment_config(data_dir: str, replace: list = None):
+    """
+    Builds the config of the replay: the local config.yaml, overridden by the detection settings of the exported
+    experiment and by the command line replacements
+
+    :param data_dir: The 'mongo_data' dir of the exported batch
+    :type data_dir: str
+
+    :param replace: Dotlist of config replacements (e.g. ['storage.backend=embedded'])
+    :type replace: list
+    """
+
+    config = OmegaConf.load('config.yaml')
+
+    experiment_path = find_export_file(data_dir, 'experiments')
+    experiment_configs = [] if experiment_path is None else list(read_export_file(experiment_path))
+    if len(experiment_configs) == 0:
+        logger.warning('The export has no experiment config, the local config is used for the detection')
+    else:
+        experiment_config = {key: value for key, value in experiment_configs[0].items()
+                             if key not in infrastructure_sections}
+
+        # MongoHelper.add_params stringifies the field for distance, because bson can't store a ListConfig
+        field_for_distance = experiment_config.get('state_change_detector', dict()).get('field_for_distance')
+        if isinstance(field_for_distance, str) and field_for_distance.startswith('['):
+            experiment_config['state_change_detector']['field_for_distance'] = ast.literal_eval(field_for_distance)
+
+        config = OmegaConf.merge(config, OmegaConf.create(experiment_config))
+
+    if replace is not None:
+        config.merge_with(OmegaConf.from_dotlist(replace))
+
+    return config
+
+
+def import_batch(mongo_helper: MongoHelper, data_dir: str) -> dict:
+    """
+    Bulk loads the exported collections into the batch of the helper
+
+    :return: The count of imported documents mapped by collection name
+    :rtype: dict
+    """
+
+    collections_to_import = {'endpoints': mongo_helper.get_endpoints_collection(),
+                             'interactions': mongo_helper.get_interactions_collection(),
+                             'states': mongo_helper.get_states_collection(),
+                             'cursors': mongo_helper.get_cursors_collection(),
+                             'response_bodies': mongo_helper.get_response_bodies_collection()}
+
+    imported_counts = dict()
+    for collection_name, collection in collections_to_import.items():
+        path = find_export_file(data_dir, collection_name)
+        imported_counts[collection_name] = 0
+        if path is None:
+            continue
+
+        chunk = []
+        for document in read_export_file(path):
+            chunk.append(document)
+            if len(chunk) >= insert_chunk_size:
+                collection.insert_many(chunk, ordered=False)
+                imported_counts[collection_name] += len(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            collection.insert_many(chunk, ordered=False)
+            imported_counts[collection_name] += len(chunk)
+
+    return imported_counts
+
+
+def reset_detection(mongo_helper: MongoHelper, flatten_states: bool):
+    """
+    Resets the results of the detection modules, so that the detectors process the imported data from scratch
+
+    :param flatten_states: Move all interactions and endpoints to the initial state and drop the detected states
+    :type flatten_states: bool
+    """
+
+    endpoints_collection = mongo_helper.get_endpoints_collection()
+    interactions_collection = mongo_helper.get_interactions_collection()
+    states_collection = mongo_helper.get_states_collection()
+
+    # The cluster infos are rebuilt by the detectors
+    mongo_helper.get_endpoint_clustering_collection().drop()
+    mongo_helper.get_interaction_clustering_collection().drop()
+    mongo_helper.get_incremental_clustering_collection().drop()
+
+    endpoints_collection.update_many({}, {'$set': {'clustering_processed': False}})
+    endpoints_collection.update_many({'from_interaction_id': {'$ne': 'User defined'}}, {'$set': {'clean': False}})
+    interactions_collection.update_many({}, {'$set': {'clustering_processed': False}})
+
+    if flatten_states:
+        initial_state_id = mongo_helper.get_initial_state_id()
+        interactions_collection.update_many({}, {'$set': {'state_id': initial_state_id}})
+        endpoints_collection.update_many({}, {'$set': {'state_id': initial_state_id}})
+        states_collection.delete_many({'initial': {'$ne': True}})
+        mongo_helper.invalidate_state_children_cache()
+        states_collection.update_many({}, {'$set': {'collapsed': False, 'reachable_from': []}})
+        mongo_helper.update_current_state(initial_state_id)
+
+
+def get_pending_work_count(mongo_helper: MongoHelper, config) -> int:
+    """
+    :return: The count of endpoints and interactions that are not processed by the detectors
+    :rtype: int
+    """
+
+    endpoints_collection = mongo_helper.get_endpoints_collection()
+    interactions_collection = mongo_helper.get_interactions_collection()
+    states_collection = mongo_helper.get_states_collection()
+
+    state_ids = [str(state_query['_id']) for state_query in states_collection.find({'collapsed': False}, {'_id': 1})]
+    made_by_fuzzer = config['state_change_detector']['only_interactions_from_fuzzer']
+
+    pending_endpoints_count = endpoints_collection.count_documents({'clustering_processed': False})
+    pending_interactions_count = interactions_collection.count_documents({'state_id': {'$in': state_ids},
+                                                                          'clustering_processed': False,
+                                                                          'made_by_fuzzer': made_by_fuzzer})
+    return pending_endpoints_count + pending_interactions_count
+
+
+def redetect(source_dir: str, batch_name: str = None, flatten_states: bool = False, replace: list = None) -> str:
+    """
+    Imports an exported batch into a new batch and runs only the detection modules over it
+
+    :param source_dir: The dir of the exported batch (containing the 'mongo_data' dir) or the 'mongo_data' dir itself
+    :type source_dir: str
+
+    :param batch_name: Name of the new batch (timestamp if None)
+    :type batch_name: str
+
+    :param flatten_states: Move all interactions and endpoints to the initial state and drop the detected states
+    :type flatten_states: bool
+
+    :param replace: Dotlist of config replacements (e.g. ['storage.backend=embedded'])
+    :type replace: list
+
+    :return: The name of the new batch
+    :rtype: str
+    """
+
+    data_dir = os.path.abspath(source_dir)
+    if os.path.isdir(os.path.join(data_dir, 'mongo_data')):
+        data_dir = os.path.join(data_dir, 'mongo_data')
+
+    # Navigate to the upper directory (needed for reading the config file)
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+    if batch_name is None:
+        batch_name = str(int(time.time()))
+
+    config = load_experiment_config(data_dir, replace)
+    set_config(dict(config))
+    workers_config = config['workers']
+
+    mongo_helper = MongoHelper(batch_name, for_module='Import and Redetect')
+    mongo_helper.ensure_indexes()
+
+    export_config = dict(config)
+    export_config['hash_padding'] = get_hash_padding(export_config['random_seed'])
+    export_config['imported_from'] = data_dir
+    mongo_helper.add_params(export_config)
+
+    imported_counts = import_batch(mongo_helper, data_dir)
+    logger.info(f'Imported {imported_counts} into batch {batch_name}')
+
+    reset_detection(mongo_helper, flatten_states)
+
+    detectors = []
+    for module_config_key, class_name in [('endpoint_detector_module', 'EndpointDetector'),
+                                          ('state_change_detector_module', 'StateChangeDetector'),
+                                          ('state_detector_module', 'StateDetector')]:
+        module = importlib.import_module(workers_config[module_config_key])
+        detectors.append(getattr(module, class_name)(for_batch=batch_name, config=config))
+
+    states_collection = mongo_helper.get_states_collection()
+    progress = None
+    for detection_round in range(max_detection_rounds):
+        # The crawl is already done, so every state is treated as explored
+        states_collection.update_many({'collapsed': False}, {'$set': {'explored': True}})
+
+        for detector in detectors:
+            detector.run()
+
+        pending_work_count = get_pending_work_count(mongo_helper, config)
+        state_count = states_collection.count_documents({'collapsed': False})
+        logger.info(f'Detection round {detection_round + 1}: {pending_work_count} endpoints and interactions pending, '
+                    f'{state_count} states')
+
+        # Stop when all work is done or when a round changed nothing
+        previous_progress = progress
+        progress = (pending_work_count, state_count)
+        if pending_work_count == 0 or progress == previous_progress:
+            break
+
+    state_count = states_collection.count_documents({'collapsed': False})
+    logger.info(f'Detection finished for batch {batch_name} with {state_count} states')
+    return batch_name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import an exported batch and run only the detection modules over it')
+    parser.add_argument('source_dir', help='Dir of the exported batch (containing the mongo_data dir)')
+    parser.add_argument('--batch-name', required=False, help='Name of the new batch (timestamp if not set)')
+    parser.add_argument('--flatten-states', action='store_true',
+                        help='Move all interactions and endpoints to the initial state before the detection')
+    parser.add_argument('--replace', required=False, nargs='+',
+                        help='Config replacements (e.g. storage.backend=embedded state_detector.distance_type=tlsh)')
+    args = parser.parse_args()
+
+    redetect(source_dir=args.source_dir,
+             batch_name=args.batch_name,
+             flatten_states=args.flatten_states,
+             replace=args.replace)
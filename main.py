@@ -8,6 +8,7 @@ from scanner.Dataclasses.Endpoint import Endpoint
 from scanner.Dataclasses.State import State
 from scanner.Utilities.DockerizedWebapp import DockerizedWebapp
 from scanner.Utilities.Logging import get_logger
+from scanner.Utilities.MongoConnectionRegistry import MongoConnectionRegistry
 from scanner.Utilities.MongoHelper import MongoHelper
 from scanner.Utilities.Util import get_hash_padding, set_config
 from scanner.Work.WorkManager import WorkManager
@@ -16,7 +17,11 @@ ignore_endpoints = []
 
 
 def init_evaluation_framework(batch_name, config):
-    mongo_helper = MongoHelper(batch_name)
+    mongo_helper = MongoHelper(batch_name, for_module='Main')
+
+    # Report batches from previous runs that lack the indexes of the hot queries and index the new batch
+    mongo_helper.report_missing_indexes()
+    mongo_helper.ensure_indexes()
 
     export_config = dict(config)
     export_config['hash_padding'] = get_hash_padding(export_config['random_seed'])
@@ -126,6 +131,7 @@ def run(batch_name):
                         config=config)
 
     manager.get_work_done()
+    logger.info(f'Mongo connection usage per module: {MongoConnectionRegistry.get_usage_counts()}')
     logger.info('Stopping app container')
     app.stop()
 
@@ -0,0 +1,32 @@
+from abc import ABC, abstractmethod
+
+
+class BaseStorageBackend(ABC):
+    """
+    An abstract representation of the storage used by :class:`MongoHelper`. A backend creates a client that exposes
+    the pymongo client API (databases and collections accessed by name) used by the scanner modules.
+    """
+
+    @abstractmethod
+    def create_client(self, host: str, port: int, username: str = None, password: str = None, **pool_options):
+        """
+        Creates a new client for the storage
+
+        :param host: Storage host (ignored by in-process backends)
+        :type host: str
+
+        :param port: Storage port (ignored by in-process backends)
+        :type port: int
+
+        :param username: Storage username (ignored by in-process backends)
+        :type username: str
+
+        :param password: Storage password (ignored by in-process backends)
+        :type password: str
+
+        :param pool_options: Connection pool options (ignored by in-process backends)
+        :type pool_options: dict
+
+        :raises ConnectionError: When the connection to the storage fails
+        """
+        pass
@@ -25,7 +25,7 @@ class SimpleCrawler(BaseCrawler):
         :param config: Custom configuration settings
         :type config: dict
         """
-        self._mongo_helper = MongoHelper(for_batch)
+        self._mongo_helper = MongoHelper(for_batch, for_module='Crawler')
         self._interaction_handler = SimpleInteractionHandler(for_batch=for_batch, config=config)
         self._state_navigator = SimpleStateNavigator(for_batch=for_batch, config=config)
         self._logger = get_logger("Crawler")
@@ -28,7 +28,8 @@ class SimpleInteractionHandler(BaseInteractionHandler):
     unseen endpoints by taking in consideration the current state of the web app.
     """
 
-    def __init__(self, for_batch: str, name: str = "Interaction Handler", with_logger: bool = True, config=None):
+    def __init__(self, for_batch: str, name: str = "Interaction Handler", with_logger: bool = True, config=None,
+                 bulk_ingest: bool = False):
         """
         :param for_batch: Name of the batch containing information about the current app scan in the DB
         :type for_batch: str
@@ -41,8 +42,11 @@ class SimpleInteractionHandler(BaseInteractionHandler):
 
         :param config: Custom configuration settings
         :type config: dict
+
+        :param bulk_ingest: Write the interactions with the bulk ingest write concern (used by fuzzers)
+        :type bulk_ingest: bool
         """
-        self._mongo_helper = MongoHelper(for_batch)
+        self._mongo_helper = MongoHelper(for_batch, for_module=name, bulk_ingest=bulk_ingest)
         self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
         self._states_collection = self._mongo_helper.get_states_collection()
         self._with_logger = with_logger
@@ -57,6 +61,9 @@ class SimpleInteractionHandler(BaseInteractionHandler):
         :return: A Request to a previously unseen endpoint in the current state of the web app.
         :rtype: Request
         """
+        # Write barrier: make sure the buffered endpoints of the other modules are visible
+        self._mongo_helper.flush_writes()
+
         current_state_id = self._mongo_helper.get_current_state_id()
 
         # Get the first entry that matches the query
@@ -35,7 +35,7 @@ class SimpleStateNavigator(BaseModule):
         :type config: dict
         """
 
-        self._mongo_helper = MongoHelper(for_batch)
+        self._mongo_helper = MongoHelper(for_batch, for_module='State Navigator')
         self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
         self._interactions_collection = self._mongo_helper.get_interactions_collection()
         self._states_collection = self._mongo_helper.get_states_collection()
@@ -66,6 +66,9 @@ class SimpleStateNavigator(BaseModule):
         :return: Queue containing all requests needed to put the app in the corresponding state
         :rtype: LifoQueue
         """
+        # Write barrier: make sure the buffered writes of the other modules are visible
+        self._mongo_helper.flush_writes()
+
         self._mongo_helper.update_states_explored_status()
 
         current_state_id = self._mongo_helper.get_current_state_id()
@@ -132,12 +135,11 @@ class SimpleStateNavigator(BaseModule):
             request_queue.put(app_reset_request)
             return request_queue
 
-        # Get the interaction data that led to the goal state
-        causing_interaction_query = self._interactions_collection.find_one({"_id": causing_interaction_id})
-        causing_interaction = Interaction.from_dict(causing_interaction_query)
+        # Get the request that led to the goal state (the response is not needed for the navigation)
+        causing_request = self._mongo_helper.get_interaction_request(str(causing_interaction_id))
 
         # Enqueue the request
-        request_queue.put(causing_interaction.request)
+        request_queue.put(causing_request)
 
         # Redo the operations till the root state is reached
         state = goal_state
@@ -146,10 +148,8 @@ class SimpleStateNavigator(BaseModule):
             state = State.from_dict(state_query)
 
             if not state.initial:
-                interaction_query = self._interactions_collection.find_one(
-                    {"_id": ObjectId(state.caused_by_interaction_id)})
-                interaction = Interaction.from_dict(interaction_query)
-                request_queue.put(interaction.request)
+                request = self._mongo_helper.get_interaction_request(state.caused_by_interaction_id)
+                request_queue.put(request)
             else:
                 break
 
@@ -7,8 +7,13 @@ from dataclasses_json import dataclass_json
 class Response:
     """
     A Response stores the raw data received upon a Request, along with the given response code.
+
+    Stored responses can reference their data in the response body store by digest instead of containing it
+    (see :meth:`MongoHelper.resolve_response_bodies`). If enabled, stored responses also contain the MinHash signature
+    of their data under 'minhash' (see :class:`MinHasher`).
     """
 
     code: int
     data: Any
     headers: dict = field(default_factory=dict)
+    body_digest: str = None
@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+from typing import ClassVar
+
+from scanner.Dataclasses.Request import Request
+
+
+@dataclass
+class HashView:
+    """
+    A lightweight view of an :class:`Interaction`, :class:`Endpoint` or :class:`State` containing only its hash.
+
+    The projection also loads the stored hash2vec vector, which is used by the hash2vec clustering.
+    """
+    PROJECTION: ClassVar[dict] = {'_id': 1, 'hash': 1, 'hash2vec': 1, 'created_at': 1}
+
+    id: str
+    hash: str
+    created_at: int
+
+    @staticmethod
+    def from_query(query: dict) -> 'HashView':
+        """
+        :param query: A DB query result projected with :attr:`HashView.PROJECTION`
+        :type query: dict
+
+        :return: The hash view of the query result
+        :rtype: HashView
+        """
+        return HashView(id=str(query['_id']),
+                        hash=query['hash'],
+                        created_at=query['created_at'])
+
+
+@dataclass
+class RequestView:
+    """
+    A lightweight view of an :class:`Interaction` containing only its request (i.e. without the response body).
+    """
+    PROJECTION: ClassVar[dict] = {'_id': 1, 'request': 1}
+
+    id: str
+    request: Request
+
+    @staticmethod
+    def from_query(query: dict) -> 'RequestView':
+        """
+        :param query: A DB query result projected with :attr:`RequestView.PROJECTION`
+        :type query: dict
+
+        :return: The request view of the query result
+        :rtype: RequestView
+        """
+        return RequestView(id=str(query['_id']),
+                           request=Request.from_dict(query['request']))
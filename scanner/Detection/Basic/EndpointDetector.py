@@ -17,7 +17,7 @@ class EndpointDetector(BaseDetector):
                  delete_dirty: bool = False,
                  config=None):
         # MongoDB Stuff
-        self._mongo_helper = MongoHelper(for_batch=for_batch)
+        self._mongo_helper = MongoHelper(for_batch=for_batch, for_module='Endpoint Detector')
         self._interactions_collection = self._mongo_helper.get_interactions_collection()
         self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
 
@@ -42,6 +42,9 @@ class EndpointDetector(BaseDetector):
         self._logger.info(f'Delete dirty endpoints: {delete_dirty}')
 
     def detect(self):
+        # Write barrier: make sure the buffered writes of the other modules are visible
+        self._mongo_helper.flush_writes()
+
         endpoints_query = self._endpoints_collection.find({'clustering_processed': False})
 
         for endpoint_query in endpoints_query:
@@ -43,7 +43,7 @@ class EndpointExtractor(BaseDetector):
         self._logger = get_logger("Endpoint Extractor")
 
         # MongoDB Stuff
-        self._mongo_helper = MongoHelper(self._for_batch)
+        self._mongo_helper = MongoHelper(self._for_batch, for_module='Endpoint Extractor')
         self._interactions_collection = self._mongo_helper.get_interactions_collection()
         self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
 
@@ -63,6 +63,9 @@ class EndpointExtractor(BaseDetector):
         forms and redirects
         """
 
+        # Write barrier: make sure the buffered writes of the other modules are visible
+        self._mongo_helper.flush_writes()
+
         # Query unprocessed interactions
         unprocessed_interactions_query = self._interactions_collection.find({'endpoints_processed': False})
 
@@ -82,10 +85,10 @@ class EndpointExtractor(BaseDetector):
                         extracted_endpoints.remove(endpoint_found)
 
             # Mark interaction as processed
-            self._interactions_collection.find_one_and_update(unprocessed_interaction_query,
+            self._interactions_collection.find_one_and_update({'_id': unprocessed_interaction_query['_id']},
                                                               {'$set': {'endpoints_processed': True}})
 
-            self._endpoints_collection.insert_many(extracted_endpoints)
+            self._mongo_helper.add_endpoints(extracted_endpoints)
 
             self._logger.info(f'Processed interaction {unprocessed_interaction_query["_id"]}')
             self._logger.info(f'Added {len(extracted_endpoints)} endpoints')
@@ -101,6 +104,9 @@ class EndpointExtractor(BaseDetector):
         :rtype: List[dict] (dict is a non cast :class:`Interaction`)
         """
 
+        # Load the response body from the body store (if it is referenced by digest)
+        self._mongo_helper.resolve_response_bodies([interaction_query])
+
         request = Request.from_dict(interaction_query['request'])
         response = Response.from_dict(interaction_query['response'])
         in_state_id = interaction_query['state_id']
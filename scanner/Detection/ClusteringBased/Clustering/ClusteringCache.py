@@ -0,0 +1,155 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from typing import List
+
+import numpy as np
+from omegaconf import ListConfig
+
+from scanner.Utilities.Distance import Distance
+from scanner.Utilities.DistanceCache import DistanceCache
+from scanner.Utilities.Util import get_config
+
+
+class ClusteringCache:
+    """
+    Wraps a clustering (e.g. :class:`DBSCANClustering`) and returns the cached result if the same inputs were clustered
+    before with the same algorithm and parameters. The inputs are identified by the sorted digests of their field
+    values, so a permutation of earlier inputs is a hit as well: the cached labels are mapped to the order of the
+    caller and renumbered by first occurrence (noise stays -1).
+
+    The results are kept in a process-wide LRU shared by all wrapped clusterings.
+    """
+
+    _entries = OrderedDict()
+    _lock = Lock()
+    hits = 0
+    misses = 0
+
+    def __init__(self, clustering, max_entries: int = 256):
+        """
+        :param clustering: The wrapped clustering
+        :type clustering: Any clustering with a cluster(data, **parameters) method
+
+        :param max_entries: Maximum count of cached results (of all wrapped clusterings)
+        :type max_entries: int
+        """
+
+        self._clustering = clustering
+        self._max_entries = max_entries
+
+    @staticmethod
+    def wrap(clustering):
+        """
+        :param clustering: A clustering
+        :type clustering: Any clustering with a cluster(data, **parameters) method
+
+        :return: The clustering wrapped as configured in the 'clustering_cache' config section (the clustering itself if
+                 the cache is disabled)
+        """
+
+        config = get_config()
+        cache_section = (config.get('clustering_cache') if config is not None else None) or dict()
+        if not cache_section.get('enabled', True):
+            return clustering
+        return ClusteringCache(clustering, max_entries=int(cache_section.get('max_entries') or 256))
+
+    def cluster(self, data, **parameters):
+        """
+        Same as the cluster method of the wrapped clustering
+
+        :return: Cluster count and labels
+        :rtype: tuple
+        """
+
+        digests = self._get_digests(data, parameters)
+        if digests is None:
+            return self._clustering.cluster(data=data, **parameters)
+
+        # Position of every input in the digest order
+        digest_order = np.argsort(np.array(digests), kind='stable')
+        key = self._get_key(parameters, [digests[idx] for idx in digest_order])
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                ClusteringCache.hits += 1
+            else:
+                ClusteringCache.misses += 1
+
+        if entry is not None:
+            cluster_count, sorted_labels, labels_as_list = entry
+            labels = np.empty(len(digests), dtype=sorted_labels.dtype)
+            labels[digest_order] = sorted_labels
+            labels = self._renumber_by_first_occurrence(labels)
+            return cluster_count, labels.tolist() if labels_as_list else labels
+
+        cluster_count, labels = self._clustering.cluster(data=data, **parameters)
+
+        sorted_labels = np.asarray(labels)[digest_order].copy()
+        with self._lock:
+            self._entries[key] = (cluster_count, sorted_labels, isinstance(labels, list))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+        return cluster_count, labels
+
+    @staticmethod
+    def _get_digests(data, parameters: dict) -> List[str]:
+        """
+        :return: The digests of the clustered field values (None if the data can not be cached, e.g. a precomputed
+                 distance matrix)
+        """
+
+        distance_type = parameters.get('distance_type')
+        if distance_type == 'precomputed' or not isinstance(data, list):
+            return None
+
+        # hash2vec always clusters the hashes
+        field_for_distance = 'hash' if distance_type == 'hash2vec' else parameters.get('field_for_distance', 'hash')
+        try:
+            values = Distance.extract_field_values(data, field_for_distance)
+        except (KeyError, TypeError):
+            return None
+        return [DistanceCache.get_digest(value) for value in values]
+
+    def _get_key(self, parameters: dict, sorted_digests: List[str]) -> tuple:
+        normalized_parameters = []
+        for name, value in sorted(parameters.items()):
+            if isinstance(value, ListConfig):
+                value = list(value)
+            if isinstance(value, list):
+                value = tuple(value)
+            normalized_parameters.append((name, value))
+
+        inputs_digest = hashlib.blake2b(''.join(sorted_digests).encode('ascii'), digest_size=16).hexdigest()
+        return type(self._clustering).__name__, tuple(normalized_parameters), len(sorted_digests), inputs_digest
+
+    @staticmethod
+    def _renumber_by_first_occurrence(labels: np.ndarray) -> np.ndarray:
+        renumbered = np.full(len(labels), -1, dtype=labels.dtype)
+        new_labels = dict()
+        for idx, label in enumerate(labels):
+            if label == -1:
+                continue
+            if label not in new_labels:
+                new_labels[label] = len(new_labels)
+            renumbered[idx] = new_labels[label]
+        return renumbered
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """
+        :return: The hit and miss counters and the count of cached results
+        :rtype: dict
+        """
+
+        with cls._lock:
+            return {'hits': cls.hits, 'misses': cls.misses, 'entries': len(cls._entries)}
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._entries.clear()
@@ -1,17 +1,39 @@
+import os
+
 from sklearn.preprocessing import MinMaxScaler
 
 from scanner.Utilities.Distance import Distance
-from scanner.Utilities.Util import extract_hashes, generate_hash2vec_dataset
+from scanner.Utilities.Hash2Vec import hash2vec_rows
 
 
 class NoDistanceTypeConfiguration(Exception):
     pass
 
 
-def shorten_range(x):
-    if x >= 58:
-        x = x - 7
-    return x
+def get_worker_count(n_jobs) -> int:
+    """
+    :param n_jobs: The n_jobs of a detector (sklearn semantics: None is 1, -1 all cores, -2 all cores but one, ...)
+    :type n_jobs: int
+
+    :return: The count of workers for the n_jobs
+    :rtype: int
+    """
+
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return max(1, n_jobs)
+
+
+def use_parallel_search(n_samples: int, n_jobs, parallel_min_samples: int) -> bool:
+    """
+    :return: True if the candidates of a parameter search (eps values, cluster counts) should be evaluated in a pool.
+             Small inputs stay serial, as the pool overhead outweighs the search.
+    :rtype: bool
+    """
+
+    return get_worker_count(n_jobs) > 1 and n_samples >= parallel_min_samples
 
 
 def preprocess_data(distance_type, data, dbscan_additional_metric, field_for_index, field_for_distance):
@@ -21,12 +43,8 @@ def preprocess_data(distance_type, data, dbscan_additional_metric, field_for_ind
             clustering_metric = "euclidean"
         else:
             clustering_metric = dbscan_additional_metric
-        hashes = extract_hashes(data)
-        preprocessed_data = generate_hash2vec_dataset(hashes)
-
-        # Normalize the dataframe
-        preprocessed_data = preprocessed_data.applymap(shorten_range)
-        preprocessed_data = (preprocessed_data - 48) / (83 - 48)
+        # The normalized vectors stored with the hashes (or calculated from the hashes of older entries)
+        preprocessed_data = hash2vec_rows(data)
 
     # Option for precomputed pair-wise distances (for example when using the datasets from other papers)
     elif distance_type == "precomputed":
@@ -41,11 +59,12 @@ def preprocess_data(distance_type, data, dbscan_additional_metric, field_for_ind
     # Distance Matrix with self selected approach
     else:
         clustering_metric = "precomputed"
-        # Create a distance matrix
+        # Create a distance matrix (the index is not needed, as the scaler works on the plain array)
         distance_matrix = Distance().generate_distance_matrix(data_query=data,
                                                               distance_type=distance_type,
                                                               field_for_index=field_for_index,
-                                                              field_for_distance=field_for_distance)
+                                                              field_for_distance=field_for_distance,
+                                                              output='ndarray')
 
         # Scale the data between 0 and 1 (needed for silhouette_score)
         scaler = MinMaxScaler()
@@ -1,10 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from kneed import KneeLocator
 from sklearn.cluster import DBSCAN
-from sklearn.metrics import silhouette_score
 from sklearn.neighbors import NearestNeighbors
 
-from scanner.Detection.ClusteringBased.Clustering.ClusteringUtil import preprocess_data
+from scanner.Detection.ClusteringBased.Clustering.ClusteringUtil import (get_worker_count, preprocess_data,
+                                                                         use_parallel_search)
+from scanner.Detection.ClusteringBased.Clustering.EpsSweep import EpsSweep
 
 
 class DBSCANClustering:
@@ -15,7 +18,9 @@ class DBSCANClustering:
                 eps='sil',
                 min_samples: int = 1,
                 field_for_index: str = '_id',
-                field_for_distance: str = 'hash'):
+                field_for_distance: str = 'hash',
+                n_jobs: int = None,
+                parallel_min_samples: int = 100):
 
         clustering_metric, preprocessed_data = preprocess_data(data=data,
                                                                distance_type=distance_type,
@@ -24,58 +29,66 @@ class DBSCANClustering:
                                                                field_for_distance=field_for_distance)
 
         # Different methods for optimal cluster count detection
+        labels = None
         if eps == 'kneed_lib':
-            optimal_eps = self._optimal_eps_kneedlib(preprocessed_data, clustering_metric)
+            optimal_eps = self._optimal_eps_kneedlib(preprocessed_data, clustering_metric, n_jobs=n_jobs)
         elif eps == 'knee':
-            optimal_eps = self._optimal_eps_knee(preprocessed_data, clustering_metric)
+            optimal_eps = self._optimal_eps_knee(preprocessed_data, clustering_metric, n_jobs=n_jobs)
         elif eps == 'sil':
-            optimal_eps = self._optimal_eps_silhouette_score(preprocessed_data, clustering_metric, min_samples)
+            # The sweep already clustered the data with the optimal eps
+            optimal_eps, labels = self._optimal_eps_silhouette_score(preprocessed_data, clustering_metric, min_samples,
+                                                                     n_jobs, parallel_min_samples)
         elif eps == 'infinitesimal-fixed':
             optimal_eps = 10**(-9)
         else:
             optimal_eps = eps
 
-        db = DBSCAN(eps=optimal_eps, min_samples=min_samples, metric=clustering_metric).fit(preprocessed_data)
-
-        labels = db.labels_
+        if labels is None:
+            db = DBSCAN(eps=optimal_eps, min_samples=min_samples, metric=clustering_metric,
+                        n_jobs=n_jobs).fit(preprocessed_data)
+            labels = db.labels_
 
         # Number of clusters
         n_clusters_ = len(set(labels)) - (1 if -1 in labels else 0)
 
         return n_clusters_, labels
 
-    def _optimal_eps_silhouette_score(self, data, metric, min_samples):
-        sil = []
-        eps_data = []
+    def _optimal_eps_silhouette_score(self, data, metric, min_samples, n_jobs=None, parallel_min_samples=100):
         n_samples = data.shape[0]
 
+        # All eps share the labels of each eps and one distance matrix for the silhouette scores
+        eps_sweep = EpsSweep(data, metric, min_samples, n_jobs=n_jobs)
+
+        def score(calc_eps):
+            labels = eps_sweep.get_labels(calc_eps)
+            unique_labels = set(labels)
+
+            if len(unique_labels) > 1 and n_samples > len(unique_labels):
+                return eps_sweep.get_silhouette_score(calc_eps)
+            return 0
+
         # Idea: We start increasing the epsilon stepwise from 0.1 till 1 and check the silhouette score
         # The distance matrix is scaled so the distances are between 0 and 1
         # This means that the optimal eps should also be between 0 and 1
         # We select the eps for which the highest silhouette score was calculated
         # Note: The calculation can more granular. For testing purposes the step was selected as 0.1
-        for multiplier in range(2, 10):
-            calc_eps = 0.1 * multiplier
-            db = DBSCAN(eps=calc_eps, min_samples=min_samples, metric=metric).fit(data)
-            labels = db.labels_
-            unique_labels = set(labels)
+        eps_data = [0.1 * multiplier for multiplier in range(2, 10)]
 
-            if len(unique_labels) > 1 and n_samples > len(labels):
-                sil_score = silhouette_score(data, labels, metric=metric)
-            else:
-                sil_score = 0
-
-            sil.append(sil_score)
-            eps_data.append(calc_eps)
+        # The eps values are independent, so large inputs evaluate them concurrently
+        if use_parallel_search(n_samples, n_jobs, parallel_min_samples):
+            with ThreadPoolExecutor(max_workers=get_worker_count(n_jobs)) as executor:
+                sil = list(executor.map(score, eps_data))
+        else:
+            sil = [score(calc_eps) for calc_eps in eps_data]
 
         eps_optimal = eps_data[np.argmax(sil)]
-        return eps_optimal
+        return eps_optimal, eps_sweep.get_labels(eps_optimal)
 
-    def _optimal_eps_knee(self, data, metric):
+    def _optimal_eps_knee(self, data, metric, n_jobs=None):
         if data.shape == (1, 1):
             return 0.01
 
-        nearest_neighbors = NearestNeighbors(n_neighbors=2, metric=metric)
+        nearest_neighbors = NearestNeighbors(n_neighbors=2, metric=metric, n_jobs=n_jobs)
         neighbors = nearest_neighbors.fit(data)
         distances, indices = neighbors.kneighbors(data)
         distances = np.sort(distances[:, 1], axis=0)
@@ -100,11 +113,11 @@ class DBSCANClustering:
 
         return eps
 
-    def _optimal_eps_kneedlib(self, data, metric, S=1):
+    def _optimal_eps_kneedlib(self, data, metric, S=1, n_jobs=None):
         if data.shape == (1, 1):
             return 0.01
 
-        nearest_neighbors = NearestNeighbors(n_neighbors=2, metric=metric)
+        nearest_neighbors = NearestNeighbors(n_neighbors=2, metric=metric, n_jobs=n_jobs)
         neighbors = nearest_neighbors.fit(data)
         distances, indices = neighbors.kneighbors(data)
         distances = np.sort(distances[:, 1], axis=0)
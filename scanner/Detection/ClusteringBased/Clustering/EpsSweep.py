@@ -0,0 +1,74 @@
+from threading import Lock
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+from sklearn.metrics import pairwise_distances, silhouette_score
+
+
+class EpsSweep:
+    """
+    Runs DBSCAN for multiple eps values on the same data. The labels of every eps are calculated on first use, and the
+    silhouette scores of all eps share one distance matrix (the data itself for precomputed distances).
+
+    Note: Every eps runs its own DBSCAN. The swept eps reach 0.9 of the scaled distances, so a radius neighbour graph
+    shared by all eps would hold almost every pair, and filtering it per eps is slower than a new neighbour search.
+    """
+
+    def __init__(self, data, metric: str, min_samples: int, n_jobs: int = None):
+        """
+        :param data: The preprocessed data (see :func:`preprocess_data`)
+        :type data: numpy.ndarray
+
+        :param metric: The clustering metric of the data ('precomputed' for distance matrices)
+        :type metric: str
+
+        :param min_samples: The DBSCAN min_samples
+        :type min_samples: int
+
+        :param n_jobs: The n_jobs of the sklearn neighbour search
+        :type n_jobs: int
+        """
+
+        self._data = data
+        self._metric = metric
+        self._min_samples = min_samples
+        self._n_jobs = n_jobs
+        self.n_samples = data.shape[0]
+
+        # The labels of different eps can be calculated concurrently (see DBSCANClustering)
+        self._labels = dict()
+        self._distance_matrix = None
+        self._distance_matrix_lock = Lock()
+
+    def get_labels(self, eps: float) -> np.ndarray:
+        """
+        :param eps: The DBSCAN eps
+        :type eps: float
+
+        :return: The DBSCAN labels of the data for the eps
+        :rtype: numpy.ndarray
+        """
+
+        labels = self._labels.get(eps)
+        if labels is None:
+            labels = DBSCAN(eps=eps, min_samples=self._min_samples, metric=self._metric,
+                            n_jobs=self._n_jobs).fit(self._data).labels_
+            self._labels[eps] = labels
+        return labels
+
+    def get_silhouette_score(self, eps: float) -> float:
+        """
+        :param eps: The DBSCAN eps
+        :type eps: float
+
+        :return: The silhouette score of the labels of the eps (the distance matrix is shared by all eps)
+        :rtype: float
+        """
+
+        if self._metric == 'precomputed':
+            return silhouette_score(self._data, self.get_labels(eps), metric='precomputed')
+
+        with self._distance_matrix_lock:
+            if self._distance_matrix is None:
+                self._distance_matrix = pairwise_distances(self._data, metric=self._metric)
+        return silhouette_score(self._distance_matrix, self.get_labels(eps), metric='precomputed')
@@ -0,0 +1,248 @@
+from typing import Any, Callable, List, Tuple
+
+from scanner.Detection.ClusteringBased.Clustering.MetricIndex import BKTree
+from scanner.Utilities.Distance import Distance
+
+
+class IncrementalDBSCAN:
+    """
+    DBSCAN with a fixed eps that is updated one point at a time (insertions only). Every point keeps the count of its
+    eps neighbours (including itself, as in sklearn), and the clusters are the connected components of the core points,
+    kept in a union-find structure. Adding a point only queries the neighbourhoods of the point and of the points that
+    became core points through it, and then
+
+    - joins an existing cluster (a new core point connected to one cluster or a border point),
+    - merges clusters (a new core point connected to multiple clusters) or
+    - starts a new cluster (a new core point without core neighbours).
+
+    The cluster count is always the one of a full DBSCAN run with the same eps and min_samples on all added points, as
+    the core points and their connections do not depend on the insertion order.
+
+    The neighbourhood queries use a :class:`BKTree`, so the distance type must be a metric on the clustered values. The
+    state (see :meth:`to_dict`) holds one entry per point, including its place in the index, so that the index is
+    restored without calculating distances. It does not contain the values themselves, they are passed again when it
+    is restored. The points added or changed by the last insertions are returned by :meth:`pop_changed_points`, so that
+    a stored state can be updated per point.
+    """
+
+    def __init__(self, distance_function: Callable[[Any, Any], float], eps: float, min_samples: int = 1):
+        """
+        :param distance_function: The metric of the clustered values
+        :type distance_function: Callable[[Any, Any], float]
+
+        :param eps: Absolute neighbourhood radius in distance units
+        :type eps: float
+
+        :param min_samples: Neighbours (including the point itself) needed for a core point
+        :type min_samples: int
+        """
+
+        self.eps = eps
+        self.min_samples = min_samples
+        self.cluster_count = 0
+
+        self._index = BKTree(distance_function)
+        self._item_ids = []
+        self._positions = dict()
+        self._values = []
+        self._neighbour_counts = []
+        # Union-find parents of the points (only the sets of core points are clusters)
+        self._parents = []
+        # Place of every point in the index: (position of the parent node, distance to it)
+        self._index_placements = []
+
+        # Points added or changed since the last call of pop_changed_points
+        self._new_positions = []
+        self._changed_positions = set()
+
+    @staticmethod
+    def for_distance_type(distance_type: str, eps: float, min_samples: int = 1) -> 'IncrementalDBSCAN':
+        """
+        :param distance_type: Name of a distance type of :class:`Distance`
+        :type distance_type: str
+
+        :return: An empty clustering using the distance type as metric
+        :rtype: IncrementalDBSCAN
+        """
+
+        return IncrementalDBSCAN(Distance.get_distance_function(distance_type), eps=eps, min_samples=min_samples)
+
+    def __len__(self):
+        return len(self._item_ids)
+
+    def __contains__(self, item_id):
+        return item_id in self._positions
+
+    def add(self, item_id, value) -> int:
+        """
+        :param item_id: Id of the point (points which were already added are ignored)
+        :type item_id: Any
+
+        :param value: The value compared with the metric
+        :type value: Any
+
+        :return: The cluster count after adding the point
+        :rtype: int
+        """
+
+        if item_id in self._positions:
+            return self.cluster_count
+
+        neighbours = [position for position, _ in self._index.radius_query(value, self.eps)]
+
+        position = len(self._item_ids)
+        self._item_ids.append(item_id)
+        self._positions[item_id] = position
+        self._values.append(value)
+        self._neighbour_counts.append(len(neighbours) + 1)
+        self._parents.append(position)
+        self._index_placements.append(self._index.insert(position, value))
+        self._new_positions.append(position)
+
+        new_core_points = [position] if self._is_core(position) else []
+        for neighbour in neighbours:
+            self._neighbour_counts[neighbour] += 1
+            self._changed_positions.add(neighbour)
+            if self._neighbour_counts[neighbour] == self.min_samples:
+                new_core_points.append(neighbour)
+
+        # Every new core point starts a cluster, which is merged into the clusters of its core neighbours. The count of
+        # the clusters is the count of core points minus the count of successful unions.
+        for core_point in new_core_points:
+            self.cluster_count += 1
+            if core_point == position:
+                core_point_neighbours = neighbours
+            else:
+                core_point_neighbours = [neighbour for neighbour, _ in
+                                         self._index.radius_query(self._values[core_point], self.eps)
+                                         if neighbour != core_point]
+
+            for neighbour in core_point_neighbours:
+                if self._is_core(neighbour) and self._union(core_point, neighbour):
+                    self.cluster_count -= 1
+
+        return self.cluster_count
+
+    def get_labels(self) -> List[int]:
+        """
+        :return: The labels of the points in the order they were added (border points are labeled with the cluster of
+                 their first found core neighbour, noise is -1)
+        :rtype: List[int]
+        """
+
+        cluster_labels = dict()
+        labels = []
+        for position in range(len(self._item_ids)):
+            if self._is_core(position):
+                core_point = position
+            else:
+                core_point = next((neighbour for neighbour, _ in
+                                   self._index.radius_query(self._values[position], self.eps)
+                                   if self._is_core(neighbour)), None)
+
+            if core_point is None:
+                labels.append(-1)
+            else:
+                labels.append(cluster_labels.setdefault(self._find(core_point), len(cluster_labels)))
+        return labels
+
+    def _is_core(self, position: int) -> bool:
+        return self._neighbour_counts[position] >= self.min_samples
+
+    def _find(self, position: int) -> int:
+        root = position
+        while self._parents[root] != root:
+            root = self._parents[root]
+
+        # Path compression
+        while self._parents[position] != root:
+            self._changed_positions.add(position)
+            self._parents[position], position = root, self._parents[position]
+        return root
+
+    def _union(self, first: int, second: int) -> bool:
+        """
+        :return: True if the points were in different sets
+        :rtype: bool
+        """
+
+        first_root = self._find(first)
+        second_root = self._find(second)
+        if first_root == second_root:
+            return False
+        self._parents[max(first_root, second_root)] = min(first_root, second_root)
+        self._changed_positions.add(max(first_root, second_root))
+        return True
+
+    def _get_point(self, position: int) -> dict:
+        index_parent, index_distance = self._index_placements[position]
+        return {'position': position,
+                'item_id': self._item_ids[position],
+                'neighbour_count': self._neighbour_counts[position],
+                'parent': self._parents[position],
+                'index_parent': index_parent,
+                'index_distance': index_distance}
+
+    def pop_changed_points(self) -> Tuple[List[dict], List[dict]]:
+        """
+        :return: The points added since the last call and the earlier points whose neighbour count or parent changed
+                 since then (in the format of the points of :meth:`to_dict`)
+        :rtype: Tuple[List[dict], List[dict]]
+        """
+
+        new_positions = set(self._new_positions)
+        new_points = [self._get_point(position) for position in self._new_positions]
+        changed_points = [self._get_point(position) for position in sorted(self._changed_positions)
+                          if position not in new_positions]
+
+        self._new_positions = []
+        self._changed_positions = set()
+        return new_points, changed_points
+
+    def to_dict(self) -> dict:
+        """
+        :return: The state of the clustering without the values of the points
+        :rtype: dict
+        """
+
+        return {'eps': self.eps,
+                'min_samples': self.min_samples,
+                'cluster_count': self.cluster_count,
+                'points': [self._get_point(position) for position in range(len(self._item_ids))]}
+
+    @staticmethod
+    def from_dict(state: dict, values: dict, distance_function: Callable[[Any, Any], float]) -> 'IncrementalDBSCAN':
+        """
+        :param state: A state created by :meth:`to_dict` (the points may be in any order)
+        :type state: dict
+
+        :param values: The values of the points mapped by their ids
+        :type values: dict
+
+        :param distance_function: The metric of the clustered values (the same as for the state)
+        :type distance_function: Callable[[Any, Any], float]
+
+        :return: The restored clustering (without changed points)
+        :rtype: IncrementalDBSCAN
+
+        :raises KeyError: If a value of a point of the state is missing
+        """
+
+        clustering = IncrementalDBSCAN(distance_function, eps=state['eps'], min_samples=state['min_samples'])
+        clustering.cluster_count = state['cluster_count']
+
+        points = sorted(state['points'], key=lambda point: point['position'])
+        for position, point in enumerate(points):
+            clustering._item_ids.append(point['item_id'])
+            clustering._positions[point['item_id']] = position
+            clustering._values.append(values[point['item_id']])
+            clustering._neighbour_counts.append(point['neighbour_count'])
+            clustering._parents.append(point['parent'])
+            clustering._index_placements.append((point['index_parent'], point['index_distance']))
+
+        clustering._index = BKTree.from_placements(distance_function,
+                                                   [(position, clustering._values[position], index_parent,
+                                                     index_distance)
+                                                    for position, (index_parent, index_distance)
+                                                    in enumerate(clustering._index_placements)])
+        return clustering
@@ -1,8 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from sklearn_extra.cluster import KMedoids
 from sklearn.metrics import silhouette_score
 
-from scanner.Detection.ClusteringBased.Clustering.ClusteringUtil import preprocess_data
+from scanner.Detection.ClusteringBased.Clustering.ClusteringUtil import (get_worker_count, preprocess_data,
+                                                                         use_parallel_search)
 from scanner.Utilities.Util import generate_hash2vec_dataset, extract_hashes
 from scanner.Utilities.Distance import Distance
 
@@ -13,7 +16,9 @@ class KMedoidsClustering:
                 data,
                 distance_type: str = 'tlsh',
                 field_for_index: str = '_id',
-                field_for_distance: str = 'hash'):
+                field_for_distance: str = 'hash',
+                n_jobs: int = None,
+                parallel_min_samples: int = 100):
 
         clustering_metric, preprocessed_data = preprocess_data(data=data,
                                                                distance_type=distance_type,
@@ -26,21 +31,23 @@ class KMedoidsClustering:
         if max_clusters > 30:
             max_clusters = int(max_clusters / 2)
 
-        sil = []
-        cluster_counts = []
-
-        for n_clusters in range(1, max_clusters):
+        def score(n_clusters):
             kmedoids = KMedoids(n_clusters=n_clusters, metric=clustering_metric).fit(preprocessed_data)
             labels = kmedoids.labels_
 
             uniquie_labels = np.unique(np.asarray(labels))
             if len(uniquie_labels) > 1:
-                sil_score = silhouette_score(preprocessed_data, labels, metric=clustering_metric)
-            else:
-                sil_score = 0
+                return silhouette_score(preprocessed_data, labels, metric=clustering_metric)
+            return 0
 
-            sil.append(sil_score)
-            cluster_counts.append(n_clusters)
+        cluster_counts = list(range(1, max_clusters))
+
+        # The cluster counts are independent, so large inputs evaluate them concurrently
+        if use_parallel_search(preprocessed_data.shape[0], n_jobs, parallel_min_samples):
+            with ThreadPoolExecutor(max_workers=get_worker_count(n_jobs)) as executor:
+                sil = list(executor.map(score, cluster_counts))
+        else:
+            sil = [score(n_clusters) for n_clusters in cluster_counts]
 
         if len(sil) > 0:
             optimal_clusters = np.argmax(sil) + 1  # We add one, because the argmax returns zero based index
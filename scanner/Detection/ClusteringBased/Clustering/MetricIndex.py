@@ -0,0 +1,208 @@
+import heapq
+from typing import Any, Callable, Iterable, List, Tuple
+
+from scanner.Utilities.Distance import Distance
+
+
+class _BKTreeNode:
+    __slots__ = ('value', 'item_ids', 'children')
+
+    def __init__(self, value, item_id):
+        self.value = value
+        # Items with the same value (distance 0) share a node
+        self.item_ids = [item_id]
+        # Child nodes mapped by their distance to this node
+        self.children = dict()
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree: a metric index that answers radius and k nearest neighbour queries without comparing the
+    query to every item. Every child subtree of a node holds the items with the same distance to the node, so by the
+    triangle inequality only the subtrees with a distance in [d - radius, d + radius] can contain matches.
+
+    The pruning is exact for metrics (e.g. levenshtein, hamming). The TLSH distance only approximately satisfies the
+    triangle inequality, so a query can miss a few items close to the radius.
+    """
+
+    def __init__(self, distance_function: Callable[[Any, Any], float]):
+        """
+        :param distance_function: The metric of the index
+        :type distance_function: Callable[[Any, Any], float]
+        """
+
+        self._distance_function = distance_function
+        self._root = None
+        self._size = 0
+
+    @staticmethod
+    def for_distance_type(distance_type: str) -> 'BKTree':
+        """
+        :param distance_type: Name of a distance type of :class:`Distance`
+        :type distance_type: str
+
+        :return: An empty index using the distance type as metric
+        :rtype: BKTree
+        """
+
+        return BKTree(Distance.get_distance_function(distance_type))
+
+    @staticmethod
+    def from_placements(distance_function: Callable[[Any, Any], float],
+                        placements: Iterable[Tuple[Any, Any, Any, float]]) -> 'BKTree':
+        """
+        Restores an index without calculating any distance
+
+        :param distance_function: The metric of the index
+        :type distance_function: Callable[[Any, Any], float]
+
+        :param placements: (item id, value, parent item id, distance) of every item in insertion order, as returned by
+                           :meth:`insert`
+        :type placements: Iterable[Tuple[Any, Any, Any, float]]
+
+        :return: The restored index
+        :rtype: BKTree
+        """
+
+        index = BKTree(distance_function)
+        # Nodes mapped by the id of their first item
+        nodes = dict()
+        for item_id, value, parent_item_id, distance in placements:
+            index._size += 1
+            if parent_item_id is None:
+                index._root = nodes[item_id] = _BKTreeNode(value, item_id)
+            elif distance == 0:
+                nodes[parent_item_id].item_ids.append(item_id)
+            else:
+                nodes[parent_item_id].children[distance] = nodes[item_id] = _BKTreeNode(value, item_id)
+        return index
+
+    def __len__(self):
+        return self._size
+
+    def insert(self, item_id, value) -> Tuple[Any, float]:
+        """
+        :param item_id: Id of the item (returned by the queries)
+        :type item_id: Any
+
+        :param value: The value compared with the metric
+        :type value: Any
+
+        :return: The first item id of the node the item was added to or below (None for the root) and the distance to
+                 it (see :meth:`from_placements`)
+        :rtype: Tuple[Any, float]
+        """
+
+        self._size += 1
+        if self._root is None:
+            self._root = _BKTreeNode(value, item_id)
+            return None, 0
+
+        node = self._root
+        while True:
+            distance = self._distance_function(value, node.value)
+            if distance == 0:
+                node.item_ids.append(item_id)
+                return node.item_ids[0], 0
+
+            child = node.children.get(distance)
+            if child is None:
+                node.children[distance] = _BKTreeNode(value, item_id)
+                return node.item_ids[0], distance
+            node = child
+
+    def radius_query(self, value, radius: float) -> List[Tuple[Any, float]]:
+        """
+        :param value: The queried value
+        :type value: Any
+
+        :param radius: Maximal distance of the returned items
+        :type radius: float
+
+        :return: All items within the radius as (item id, distance) pairs
+        :rtype: List[Tuple[Any, float]]
+        """
+
+        matches = []
+        if self._root is None:
+            return matches
+
+        nodes_to_check = [self._root]
+        while len(nodes_to_check) > 0:
+            node = nodes_to_check.pop()
+            distance = self._distance_function(value, node.value)
+            if distance <= radius:
+                matches.extend((item_id, distance) for item_id in node.item_ids)
+
+            for child_distance, child in node.children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes_to_check.append(child)
+
+        return matches
+
+    def has_neighbour(self, value, radius: float) -> bool:
+        """
+        :param value: The queried value
+        :type value: Any
+
+        :param radius: Maximal distance of a neighbour
+        :type radius: float
+
+        :return: True if any item is within the radius (stops at the first found item)
+        :rtype: bool
+        """
+
+        if self._root is None:
+            return False
+
+        nodes_to_check = [self._root]
+        while len(nodes_to_check) > 0:
+            node = nodes_to_check.pop()
+            distance = self._distance_function(value, node.value)
+            if distance <= radius:
+                return True
+
+            for child_distance, child in node.children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes_to_check.append(child)
+
+        return False
+
+    def knn(self, value, k: int) -> List[Tuple[Any, float]]:
+        """
+        :param value: The queried value
+        :type value: Any
+
+        :param k: Count of returned neighbours
+        :type k: int
+
+        :return: The k nearest items as (item id, distance) pairs, sorted by distance
+        :rtype: List[Tuple[Any, float]]
+        """
+
+        if self._root is None or k <= 0:
+            return []
+
+        # Max heap (negated distances) of the best k items found so far
+        best = []
+        counter = 0
+
+        nodes_to_check = [self._root]
+        while len(nodes_to_check) > 0:
+            node = nodes_to_check.pop()
+            distance = self._distance_function(value, node.value)
+
+            for item_id in node.item_ids:
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, counter, item_id))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, counter, item_id))
+                counter += 1
+
+            # The search radius shrinks to the k-th best distance once k items are found
+            radius = -best[0][0] if len(best) == k else float('inf')
+            for child_distance, child in node.children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    nodes_to_check.append(child)
+
+        return [(item_id, -negated_distance) for negated_distance, _, item_id in sorted(best, reverse=True)]
@@ -2,6 +2,7 @@ from bson import ObjectId
 
 from scanner.Base.BaseDetector import BaseDetector
 from scanner.Dataclasses.Endpoint import Endpoint, EndpointClusteringInfo
+from scanner.Detection.ClusteringBased.Clustering.ClusteringCache import ClusteringCache
 from scanner.Detection.ClusteringBased.Clustering.DBSCANClustering import DBSCANClustering
 from scanner.Utilities.Logging import get_logger
 from scanner.Utilities.MongoHelper import MongoHelper
@@ -18,9 +19,11 @@ class EndpointDetector(BaseDetector):
                  distance_type: str = 'tlsh',
                  dbscan_additional_metric: str = None,
                  delete_dirty: bool = False,
+                 n_jobs: int = None,
+                 parallel_min_samples: int = 100,
                  config=None):
         # MongoDB Stuff
-        self._mongo_helper = MongoHelper(for_batch=for_batch)
+        self._mongo_helper = MongoHelper(for_batch=for_batch, for_module='Endpoint Detector')
         self._interactions_collection = self._mongo_helper.get_interactions_collection()
         self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
         self._endpoint_clustering_collection = self._mongo_helper.get_endpoint_clustering_collection()
@@ -28,7 +31,7 @@ class EndpointDetector(BaseDetector):
         self._logger = get_logger("Endpoint Detector")
 
         # Detector Parameters
-        self._clustering = DBSCANClustering()
+        self._clustering = ClusteringCache.wrap(DBSCANClustering())
 
         if config:
             ec_section = config['endpoint_detector']
@@ -45,10 +48,19 @@ class EndpointDetector(BaseDetector):
             self._dbscan_additional_metric = ec_section['dbscan_additional_metric']
             if self._dbscan_additional_metric == '' or self._dbscan_additional_metric == 'None':
                 self._dbscan_additional_metric = None
+
+            self._n_jobs = ec_section.get('n_jobs', n_jobs)
+            self._parallel_min_samples = ec_section.get('parallel_min_samples', parallel_min_samples)
         else:
             self._distance_type = distance_type
             self._delete_dirty = delete_dirty
+            self._field_for_distance = 'hash'
             self._dbscan_additional_metric = dbscan_additional_metric
+            self._n_jobs = n_jobs
+            self._parallel_min_samples = parallel_min_samples
+
+        # Load only the fields needed for the clustering of the similar endpoints
+        self._similar_endpoints_projection = self._mongo_helper.get_distance_projection(self._field_for_distance)
 
         self._logger.info('Ready')
         self._logger.info('Clustering: DBSCAN')
@@ -56,18 +68,24 @@ class EndpointDetector(BaseDetector):
         self._logger.info(f'Delete dirty endpoints: {delete_dirty}')
 
     def detect(self):
+        # Write barrier: make sure the buffered writes of the other modules are visible
+        self._mongo_helper.flush_writes()
+
         endpoints_query = self._endpoints_collection.find({'clustering_processed': False})
 
         for endpoint_query in endpoints_query:
             endpoint_id = str(endpoint_query['_id'])
             endpoint = Endpoint.from_dict(endpoint_query)
-            similar_endpoints = self._mongo_helper.get_similar_endpoints(endpoint)
+            similar_endpoints = self._mongo_helper.get_similar_endpoints(endpoint,
+                                                                         projection=self._similar_endpoints_projection)
 
             # Calculate the cluster count of the similar endpoints
             cluster_count, labels = self._clustering.cluster(data=similar_endpoints,
                                                              distance_type=self._distance_type,
                                                              dbscan_additional_metric=self._dbscan_additional_metric,
-                                                             field_for_distance=self._field_for_distance)
+                                                             field_for_distance=self._field_for_distance,
+                                                             n_jobs=self._n_jobs,
+                                                             parallel_min_samples=self._parallel_min_samples)
 
             # Check if the cluster count has changed
             cluster_count_changed = self._cluster_count_changed(endpoint, cluster_count)
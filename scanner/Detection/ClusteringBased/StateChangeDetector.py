@@ -2,10 +2,14 @@ from omegaconf import OmegaConf
 
 from scanner.Base.BaseDetector import BaseDetector
 from scanner.Dataclasses.Endpoint import Endpoint
+from scanner.Detection.ClusteringBased.Clustering.ClusteringCache import ClusteringCache
 from scanner.Detection.ClusteringBased.Clustering.DBSCANClustering import DBSCANClustering
 from scanner.Dataclasses.Interaction import InteractionClusteringInfo
 from scanner.Dataclasses.State import State
 from scanner.Detection.ClusteringBased.Clustering.DummyClustering import DummyClustering
+from scanner.Detection.ClusteringBased.Clustering.IncrementalDBSCAN import IncrementalDBSCAN
+from scanner.Detection.ClusteringBased.Clustering.MetricIndex import BKTree
+from scanner.Utilities.Distance import Distance
 from scanner.Utilities.Logging import get_logger
 from scanner.Utilities.MongoHelper import MongoHelper
 
@@ -21,19 +25,25 @@ class StateChangeDetector(BaseDetector):
                  filed_for_distance: str = 'hash',
                  dbscan_additional_metric: str = None,
                  only_interactions_from_fuzzer: bool = False,
+                 clustering_mode: str = 'dbscan',
+                 metric_index_radius: float = 30,
+                 incremental_eps: float = 30,
+                 incremental_min_samples: int = 1,
+                 n_jobs: int = None,
+                 parallel_min_samples: int = 100,
                  config=None):
 
         self._logger = get_logger("State Change Detector")
 
         # MongoDB stuff
-        self._mongo_helper = MongoHelper(for_batch)
+        self._mongo_helper = MongoHelper(for_batch, for_module='State Change Detector')
         self._interactions_collection = self._mongo_helper.get_interactions_collection()
         self._states_collection = self._mongo_helper.get_states_collection()
         self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
         self._interaction_clustering_collection = self._mongo_helper.get_interaction_clustering_collection()
 
         # Detector Parameters
-        self._clustering = DBSCANClustering()
+        self._clustering = ClusteringCache.wrap(DBSCANClustering())
 
         if config:
             scd_section = config['state_change_detector']
@@ -51,19 +61,53 @@ class StateChangeDetector(BaseDetector):
             self._dbscan_additional_metric = scd_section['dbscan_additional_metric']
             if self._dbscan_additional_metric == '' or self._dbscan_additional_metric == 'None':
                 self._dbscan_additional_metric = None
+
+            self._clustering_mode = scd_section.get('clustering') or 'dbscan'
+            self._metric_index_radius = scd_section.get('metric_index_radius', metric_index_radius)
+            self._incremental_eps = scd_section.get('incremental_eps', incremental_eps)
+            self._incremental_min_samples = scd_section.get('incremental_min_samples', incremental_min_samples)
+            self._n_jobs = scd_section.get('n_jobs', n_jobs)
+            self._parallel_min_samples = scd_section.get('parallel_min_samples', parallel_min_samples)
         else:
             self._distance_type = distance_type
             self._only_interactions_from_fuzzer = only_interactions_from_fuzzer
             self._field_for_distance = filed_for_distance
             self._dbscan_additional_metric = dbscan_additional_metric
+            self._clustering_mode = clustering_mode
+            self._metric_index_radius = metric_index_radius
+            self._incremental_eps = incremental_eps
+            self._incremental_min_samples = incremental_min_samples
+            self._n_jobs = n_jobs
+            self._parallel_min_samples = parallel_min_samples
+
+        if self._clustering_mode not in ('dbscan', 'metric-index', 'incremental-dbscan'):
+            raise ValueError(f'Unknown clustering {self._clustering_mode}. Please select one of the following: dbscan, metric-index, incremental-dbscan')
+
+        # Metric indexes and incremental clusterings of the similarity groups mapped by (state id, host, method, scheme,
+        # path)
+        self._group_indexes = dict()
+        self._group_clusterings = dict()
+        if self._clustering_mode in ('metric-index', 'incremental-dbscan'):
+            # Fail early if the distance type is not a metric on the field (e.g. hash2vec)
+            Distance.get_distance_function(self._distance_type)
+
+        # Load only the fields needed for the clustering (i.e. skip the response bodies if they are not compared)
+        self._distance_on_response_body = self._mongo_helper.is_response_body_field(self._field_for_distance)
+        self._similar_interactions_projection = self._mongo_helper.get_distance_projection(self._field_for_distance)
+        self._interactions_projection = self._mongo_helper.get_distance_projection(self._field_for_distance,
+                                                                                   extra_fields=('request', 'state_id'))
 
         self._logger.info('Ready')
         self._logger.info('Detection: Clustering with DBSCAN')
         self._logger.info(f'Field for distance {str(self._field_for_distance)}')
         self._logger.info(f'Distance type {str(self._distance_type)}')
         self._logger.info(f'Only on fuzzy interactions: {self._only_interactions_from_fuzzer}')
+        self._logger.info(f'Clustering: {self._clustering_mode}')
 
     def detect(self):
+        # Write barrier: make sure the buffered writes of the other modules are visible
+        self._mongo_helper.flush_writes()
+
         states_query = self._states_collection.find({'explored': True,
                                                      'collapsed': False})
 
@@ -84,17 +128,12 @@ class StateChangeDetector(BaseDetector):
                 self._logger.info(f"State {state_id} has no interaction that fit the search criterion")
                 continue
 
-            interactions_query = self._interactions_collection.find(interactions_query_input)
+            interactions_query = self._interactions_collection.find(interactions_query_input,
+                                                                    self._interactions_projection)
             for interaction_query in interactions_query:
                 self._logger.info(f'Checking interaction {str(interaction_query["_id"])}')
 
-                # Find similar interactions in the current state
                 interaction_endpoint: Endpoint = Endpoint.from_dict(interaction_query['request']['endpoint'])
-                similar_interactions_array = self._mongo_helper.get_similar_interactions(endpoint=interaction_endpoint,
-                                                                                         state_id=state_id)
-
-                # Append the current interaction at the last place of the array
-                similar_interactions_array.append(interaction_query)
 
                 current_cluster_info = self._mongo_helper.get_interaction_cluster_info(interaction_query)
                 if current_cluster_info is None:
@@ -103,10 +142,33 @@ class StateChangeDetector(BaseDetector):
                     current_cluster_info: InteractionClusteringInfo = InteractionClusteringInfo.from_dict(current_cluster_info)
                     old_cluster_count = current_cluster_info.cluster_count
 
-                cluster_count, labels = self._clustering.cluster(data=similar_interactions_array,
-                                                                 dbscan_additional_metric=self._dbscan_additional_metric,
-                                                                 distance_type=self._distance_type,
-                                                                 field_for_distance=self._field_for_distance)
+                if self._clustering_mode == 'metric-index':
+                    # A new cluster is formed if the interaction is not within the radius of any group member
+                    cluster_count = old_cluster_count + self._count_new_clusters(interaction_endpoint,
+                                                                                 state_id,
+                                                                                 interaction_query)
+                elif self._clustering_mode == 'incremental-dbscan':
+                    # The interaction joins, merges or starts clusters of the stored clustering of its group
+                    cluster_count = self._add_to_group_clustering(interaction_endpoint, state_id, interaction_query)
+                else:
+                    # Find similar interactions in the current state
+                    similar_interactions_array = self._mongo_helper.get_similar_interactions(endpoint=interaction_endpoint,
+                                                                                             state_id=state_id,
+                                                                                             projection=self._similar_interactions_projection)
+
+                    # Append the current interaction at the last place of the array
+                    similar_interactions_array.append(interaction_query)
+
+                    # Load the response bodies from the body store (if they are referenced by digest)
+                    if self._distance_on_response_body:
+                        self._mongo_helper.resolve_response_bodies(similar_interactions_array)
+
+                    cluster_count, labels = self._clustering.cluster(data=similar_interactions_array,
+                                                                     dbscan_additional_metric=self._dbscan_additional_metric,
+                                                                     distance_type=self._distance_type,
+                                                                     field_for_distance=self._field_for_distance,
+                                                                     n_jobs=self._n_jobs,
+                                                                     parallel_min_samples=self._parallel_min_samples)
 
                 self._logger.info(f'Cluster delta {cluster_count - old_cluster_count} for interaction {str(interaction_query["_id"])}')
 
@@ -115,8 +177,138 @@ class StateChangeDetector(BaseDetector):
                                         causing_interaction_query=interaction_query)
                     self._mongo_helper.update_interaction_cluster_info(interaction_query, cluster_count)
 
-                self._interactions_collection.find_one_and_update(interaction_query,
-                                                                  {"$set": {"clustering_processed": True}})
+                self._interactions_collection.update_one({'_id': interaction_query['_id']},
+                                                         {"$set": {"clustering_processed": True}})
+
+    def _get_group_index(self, endpoint: Endpoint, state_id: str) -> BKTree:
+        """
+        :return: The metric index of the processed interactions of a similarity group (loaded on first use)
+        :rtype: BKTree
+        """
+
+        group_key = (state_id, endpoint.host, endpoint.method, endpoint.scheme, endpoint.path)
+        group_index = self._group_indexes.get(group_key)
+        if group_index is None:
+            group_index = BKTree.for_distance_type(self._distance_type)
+            processed_interactions = self._mongo_helper.get_similar_interactions(endpoint=endpoint,
+                                                                                 state_id=state_id,
+                                                                                 processed_type='processed',
+                                                                                 projection=self._similar_interactions_projection)
+            if self._distance_on_response_body:
+                self._mongo_helper.resolve_response_bodies(processed_interactions)
+
+            values = Distance.extract_field_values(processed_interactions, self._field_for_distance)
+            for interaction_query, value in zip(processed_interactions, values):
+                group_index.insert(str(interaction_query['_id']), value)
+
+            self._group_indexes[group_key] = group_index
+        return group_index
+
+    def _count_new_clusters(self, endpoint: Endpoint, state_id: str, interaction_query: dict) -> int:
+        """
+        Adds an interaction to the metric index of its similarity group
+
+        :return: 1 if the interaction is not within the radius of any member of a non empty group, otherwise 0
+        :rtype: int
+        """
+
+        group_index = self._get_group_index(endpoint, state_id)
+
+        if self._distance_on_response_body:
+            self._mongo_helper.resolve_response_bodies([interaction_query])
+        value = Distance.extract_field_values([interaction_query], self._field_for_distance)[0]
+
+        is_new_cluster = len(group_index) > 0 and not group_index.has_neighbour(value, self._metric_index_radius)
+        group_index.insert(str(interaction_query['_id']), value)
+        return int(is_new_cluster)
+
+    def _get_group_clustering(self, endpoint: Endpoint, state_id: str) -> IncrementalDBSCAN:
+        """
+        :return: The incremental clustering of the processed interactions of a similarity group (restored from the DB on
+                 first use, or rebuilt and stored if the group has no matching stored clustering)
+        :rtype: IncrementalDBSCAN
+        """
+
+        group_key = (state_id, endpoint.host, endpoint.method, endpoint.scheme, endpoint.path)
+        group_clustering = self._group_clusterings.get(group_key)
+        if group_clustering is None:
+            processed_interactions = self._mongo_helper.get_similar_interactions(endpoint=endpoint,
+                                                                                 state_id=state_id,
+                                                                                 processed_type='processed',
+                                                                                 projection=self._similar_interactions_projection)
+            if self._distance_on_response_body:
+                self._mongo_helper.resolve_response_bodies(processed_interactions)
+
+            values = Distance.extract_field_values(processed_interactions, self._field_for_distance)
+            values = {str(interaction_query['_id']): value
+                      for interaction_query, value in zip(processed_interactions, values)}
+
+            stored_state = self._mongo_helper.get_incremental_clustering_state(endpoint, state_id)
+            if self._is_valid_clustering_state(stored_state, values):
+                # The stored places of the points restore the metric index without calculating distances
+                group_clustering = IncrementalDBSCAN.from_dict(stored_state, values,
+                                                               Distance.get_distance_function(self._distance_type))
+            else:
+                group_clustering = IncrementalDBSCAN.for_distance_type(self._distance_type,
+                                                                       eps=self._incremental_eps,
+                                                                       min_samples=self._incremental_min_samples)
+                for interaction_id, value in values.items():
+                    group_clustering.add(interaction_id, value)
+                self._save_group_clustering(endpoint, state_id, group_clustering, replace=True)
+
+            self._group_clusterings[group_key] = group_clustering
+        return group_clustering
+
+    def _is_valid_clustering_state(self, stored_state: dict, values: dict) -> bool:
+        """
+        :return: True if the stored clustering uses the current parameters and holds exactly the given interactions
+                 (e.g. not if interactions were moved to other states in the meantime)
+        :rtype: bool
+        """
+
+        if stored_state is None:
+            return False
+
+        return (stored_state.get('distance_type') == self._distance_type
+                and stored_state.get('field_for_distance') == str(self._field_for_distance)
+                and stored_state.get('eps') == self._incremental_eps
+                and stored_state.get('min_samples') == self._incremental_min_samples
+                and len(stored_state.get('points', [])) == len(values)
+                and set(point['item_id'] for point in stored_state['points']) == set(values))
+
+    def _add_to_group_clustering(self, endpoint: Endpoint, state_id: str, interaction_query: dict) -> int:
+        """
+        Adds an interaction to the incremental clustering of its similarity group and stores the changed points
+
+        :return: The cluster count of the group including the interaction
+        :rtype: int
+        """
+
+        group_clustering = self._get_group_clustering(endpoint, state_id)
+
+        if self._distance_on_response_body:
+            self._mongo_helper.resolve_response_bodies([interaction_query])
+        value = Distance.extract_field_values([interaction_query], self._field_for_distance)[0]
+
+        cluster_count = group_clustering.add(str(interaction_query['_id']), value)
+        self._save_group_clustering(endpoint, state_id, group_clustering)
+
+        return cluster_count
+
+    def _save_group_clustering(self, endpoint: Endpoint, state_id: str, group_clustering: IncrementalDBSCAN,
+                               replace: bool = False):
+        """
+        Stores the points added or changed since the last save (all points of the group if replace is set)
+        """
+
+        new_points, changed_points = group_clustering.pop_changed_points()
+        group_fields = {'eps': group_clustering.eps,
+                        'min_samples': group_clustering.min_samples,
+                        'cluster_count': group_clustering.cluster_count,
+                        'distance_type': self._distance_type,
+                        'field_for_distance': str(self._field_for_distance)}
+        self._mongo_helper.save_incremental_clustering_state(endpoint, state_id, group_fields, new_points,
+                                                             changed_points, replace=replace)
 
     def _add_new_state(self, old_state_id: str, causing_interaction_query):
         new_state = State(previous_state_id=old_state_id,
@@ -127,10 +319,22 @@ class StateChangeDetector(BaseDetector):
 
         # Update all endpoints and interactions that happened after the state changing request
         state_changing_interaction_ts = causing_interaction_query['created_at']
-        self._mongo_helper.update_endpoints(after_timestamp=state_changing_interaction_ts,
-                                            for_state_id=old_state_id,
-                                            new_state_id=next_state_id)
+        updated_endpoints_count = self._mongo_helper.update_endpoints(after_timestamp=state_changing_interaction_ts,
+                                                                     for_state_id=old_state_id,
+                                                                     new_state_id=next_state_id)
+
+        updated_interactions_count = self._mongo_helper.update_interactions(after_timestamp=state_changing_interaction_ts,
+                                                                            for_state_id=old_state_id,
+                                                                            new_state_id=next_state_id)
+
+        self._logger.info(f"Moved {updated_endpoints_count} endpoints and {updated_interactions_count} interactions "
+                          f"to state {next_state_id}")
 
-        self._mongo_helper.update_interactions(after_timestamp=state_changing_interaction_ts,
-                                               for_state_id=old_state_id,
-                                               new_state_id=next_state_id)
+        # The moved interactions invalidate the metric indexes and incremental clusterings of both states
+        self._group_indexes = {group_key: group_index for group_key, group_index in self._group_indexes.items()
+                               if group_key[0] not in (old_state_id, next_state_id)}
+        self._group_clusterings = {group_key: group_clustering
+                                   for group_key, group_clustering in self._group_clusterings.items()
+                                   if group_key[0] not in (old_state_id, next_state_id)}
+        if self._clustering_mode == 'incremental-dbscan':
+            self._mongo_helper.delete_incremental_clustering_states([old_state_id, next_state_id])
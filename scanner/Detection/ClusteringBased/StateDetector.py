@@ -10,7 +10,10 @@ from scanner.Dataclasses.Endpoint import Endpoint
 from scanner.Dataclasses.Request import Request
 from scanner.Dataclasses.Response import Response
 from scanner.Dataclasses.State import State, StateReachabilityInfo
+from scanner.Detection.ClusteringBased.Clustering.ClusteringCache import ClusteringCache
 from scanner.Detection.ClusteringBased.Clustering.DBSCANClustering import DBSCANClustering
+from scanner.Detection.ClusteringBased.Clustering.MetricIndex import BKTree
+from scanner.Utilities.Distance import Distance
 from scanner.Utilities.Logging import get_logger
 from scanner.Utilities.MongoHelper import MongoHelper
 
@@ -26,18 +29,22 @@ class StateDetector(BaseDetector):
                  distance_type: str = 'tlsh',
                  dbscan_additional_metric: str = None,
                  delete_collapsed: bool = False,
+                 clustering_mode: str = 'dbscan',
+                 metric_index_radius: float = 30,
+                 n_jobs: int = None,
+                 parallel_min_samples: int = 100,
                  config=None):
 
         self._logger = get_logger("State Detector")
 
         # MongoDB stuff
-        self._mongo_helper = MongoHelper(for_batch)
+        self._mongo_helper = MongoHelper(for_batch, for_module='State Detector')
         self._states_collection = self._mongo_helper.get_states_collection()
         self._interaction_collection = self._mongo_helper.get_interactions_collection()
         self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
 
         # Detector Parameters
-        self._clustering = DBSCANClustering()
+        self._clustering = ClusteringCache.wrap(DBSCANClustering())
 
         if config:
             sc_section = config['state_detector']
@@ -56,19 +63,44 @@ class StateDetector(BaseDetector):
             self._dbscan_additional_metric = sc_section['dbscan_additional_metric']
             if self._dbscan_additional_metric == '' or self._dbscan_additional_metric == 'None':
                 self._dbscan_additional_metric = None
+
+            self._clustering_mode = sc_section.get('clustering') or 'dbscan'
+            self._metric_index_radius = sc_section.get('metric_index_radius', metric_index_radius)
+            self._n_jobs = sc_section.get('n_jobs', n_jobs)
+            self._parallel_min_samples = sc_section.get('parallel_min_samples', parallel_min_samples)
         else:
             self._distance_type = distance_type
             self._delete_collapsed = delete_collapsed
             self._dbscan_additional_metric = dbscan_additional_metric
+            self._clustering_mode = clustering_mode
+            self._metric_index_radius = metric_index_radius
+            self._n_jobs = n_jobs
+            self._parallel_min_samples = parallel_min_samples
+
+        if self._clustering_mode not in ('dbscan', 'metric-index'):
+            raise ValueError(f'Unknown clustering {self._clustering_mode}. Please select one of the following: dbscan, metric-index')
+        if self._clustering_mode == 'metric-index':
+            # Fail early if the distance type is not a metric on the field (e.g. hash2vec)
+            Distance.get_distance_function(self._distance_type)
+
+        # Metric index of the states kept between the calls and the state values it holds, mapped by the state ids
+        self._state_index = None
+        self._indexed_state_values = dict()
 
         self._logger.info('Ready')
-        self._logger.info('Clustering: DBSCAN')
+        self._logger.info(f'Clustering: {self._clustering_mode}')
         self._logger.info(f'Distance type: {distance_type}')
         self._logger.info(f'Delete collapsed states: {delete_collapsed}')
 
     def detect(self):
+        # Write barrier: make sure the buffered writes of the other modules are visible
+        self._mongo_helper.flush_writes()
+
         self._recalculate_state_hashes()
-        self._collapse_identical_states()
+        if self._clustering_mode == 'metric-index':
+            self._collapse_identical_states_with_index()
+        else:
+            self._collapse_identical_states()
 
     def load_states_locally(self):
         states_query = self._states_collection.find({"explored": True, "collapsed": False})
@@ -101,7 +133,9 @@ class StateDetector(BaseDetector):
             cluster_count, labels = self._clustering.cluster(data=states_query_array,
                                                              distance_type=self._distance_type,
                                                              dbscan_additional_metric=self._dbscan_additional_metric,
-                                                             field_for_distance=self._field_for_distance)
+                                                             field_for_distance=self._field_for_distance,
+                                                             n_jobs=self._n_jobs,
+                                                             parallel_min_samples=self._parallel_min_samples)
 
             current_state_label = labels[current_state_query_ind]
             states_in_cluster = 0
@@ -116,38 +150,118 @@ class StateDetector(BaseDetector):
             # If more than one state (i.e. the current state) is in the same cluster then we have 2 identical states
             # And we have to collapse them into one
             if states_in_cluster > 1:
-                # Find the first state
-                earliest_timestamp = inf
-                for entry_id in entry_ids:
-                    state_query = self._states_collection.find_one({'_id': ObjectId(entry_id)})
-                    state_timestamp = state_query['created_at']
-                    if state_timestamp < earliest_timestamp:
-                        earliest_timestamp = state_timestamp
-
-                earliest_identical_state_query = self._states_collection.find_one({'created_at': earliest_timestamp})
-                earliest_identical_state_id = str(earliest_identical_state_query['_id'])
-
-                # Let the scanner know that it is actually in a previous state
-                self._mongo_helper.update_current_state(earliest_identical_state_id)
-
-                earliest_state_reachability: List[StateReachabilityInfo] = []
-
-                # Merge all identical states and update their endpoints and interactions
-                entry_ids.remove(earliest_identical_state_id)
-                for entry_id in entry_ids:
-                    entry_data = self._states_collection.find_one({'_id': ObjectId(entry_id)})
-                    previous_state = self._states_collection.find_one({'_id': ObjectId(entry_data['previous_state_id'])})
-                    reachability_info = StateReachabilityInfo(from_state_id=str(previous_state['_id']),
-                                                              caused_by_interaction_id=entry_data['caused_by_interaction_id'])
-                    earliest_state_reachability.append(reachability_info)
-                    if self._delete_collapsed:
-                        self._mongo_helper.delete_states_recursively(entry_id)
-                    else:
-                        self._mongo_helper.mark_states_as_collapsed_recursively(entry_id)
-                    self._logger.info(f'Collapsed state: {entry_id}')
-
-                self._mongo_helper.extend_state_reachability(state_id=earliest_identical_state_id,
-                                                             reachability_info_list=earliest_state_reachability)
+                self._merge_identical_states(entry_ids)
+
+    def _collapse_identical_states_with_index(self):
+        """
+        Collapses the states within the metric index radius of each other. The index is kept on the detector between
+        the calls, and only the states that are new or whose hash changed since the last call are inserted. Only these
+        states and their neighbours are queried in the order of the states, as the neighbourhoods of the other states
+        hold the pairs of unchanged states that were already checked. The entries of collapsed states and of outdated
+        hashes are skipped by the queries, and the index is rebuilt once they outnumber the valid entries.
+
+        Note: Unlike DBSCAN, only the direct neighbours of a state are merged (no transitive chains).
+        """
+
+        states_query_array = self.load_states_locally()
+        values = Distance.extract_field_values(states_query_array, self._field_for_distance)
+        state_values = {str(state_query['_id']): value for state_query, value in zip(states_query_array, values)}
+
+        # Forget the states that were collapsed or deleted since the last call (also by other modules)
+        self._indexed_state_values = {state_id: value for state_id, value in self._indexed_state_values.items()
+                                      if state_id in state_values}
+        valid_entry_count = sum(1 for state_id, value in self._indexed_state_values.items()
+                                if state_values[state_id] == value)
+        if self._state_index is None or len(self._state_index) - valid_entry_count > valid_entry_count:
+            self._state_index = BKTree.for_distance_type(self._distance_type)
+            self._indexed_state_values = dict()
+
+        # The entries are (state id, value) pairs, so that an entry of an outdated hash of a state can be recognized
+        changed_state_ids = [state_id for state_id, value in state_values.items()
+                             if state_id not in self._indexed_state_values
+                             or self._indexed_state_values[state_id] != value]
+        for state_id in changed_state_ids:
+            self._state_index.insert((state_id, state_values[state_id]), state_values[state_id])
+            self._indexed_state_values[state_id] = state_values[state_id]
+
+        neighbourhoods = {state_id: self._query_state_index(state_values[state_id]) for state_id in changed_state_ids}
+        queried_state_ids = set(neighbourhoods)
+        for neighbourhood in list(neighbourhoods.values()):
+            queried_state_ids.update(neighbourhood)
+
+        collapsed_state_ids = set()
+        for state_id in state_values:
+            if state_id not in queried_state_ids or state_id in collapsed_state_ids:
+                continue
+
+            neighbourhood = neighbourhoods.get(state_id)
+            if neighbourhood is None:
+                neighbourhood = self._query_state_index(state_values[state_id])
+            entry_ids = [entry_id for entry_id in neighbourhood if entry_id not in collapsed_state_ids]
+
+            if len(entry_ids) > 1:
+                collapsed_state_ids.update(self._merge_identical_states(entry_ids))
+
+        for state_id in collapsed_state_ids:
+            self._indexed_state_values.pop(state_id, None)
+
+    def _query_state_index(self, value) -> List[str]:
+        """
+        :return: The ids of the states within the radius of the value (without the entries of outdated hashes)
+        :rtype: List[str]
+        """
+
+        neighbour_state_ids = [neighbour_state_id for (neighbour_state_id, neighbour_value), _
+                               in self._state_index.radius_query(value, self._metric_index_radius)
+                               if self._indexed_state_values.get(neighbour_state_id) == neighbour_value]
+        return list(dict.fromkeys(neighbour_state_ids))
+
+    def _merge_identical_states(self, entry_ids: List[str]) -> List[str]:
+        """
+        Keeps the earliest of the identical states and collapses the other ones (and their descendants)
+
+        :param entry_ids: Ids of the identical states
+        :type entry_ids: List[str]
+
+        :return: Ids of the collapsed states, including their descendants
+        :rtype: List[str]
+        """
+
+        # Find the first state
+        earliest_timestamp = inf
+        for entry_id in entry_ids:
+            state_query = self._states_collection.find_one({'_id': ObjectId(entry_id)})
+            state_timestamp = state_query['created_at']
+            if state_timestamp < earliest_timestamp:
+                earliest_timestamp = state_timestamp
+
+        earliest_identical_state_query = self._states_collection.find_one({'created_at': earliest_timestamp})
+        earliest_identical_state_id = str(earliest_identical_state_query['_id'])
+
+        # Let the scanner know that it is actually in a previous state
+        self._mongo_helper.update_current_state(earliest_identical_state_id)
+
+        earliest_state_reachability: List[StateReachabilityInfo] = []
+        collapsed_state_ids = []
+
+        # Merge all identical states and update their endpoints and interactions
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id != earliest_identical_state_id]
+        for entry_id in entry_ids:
+            entry_data = self._states_collection.find_one({'_id': ObjectId(entry_id)})
+            previous_state = self._states_collection.find_one({'_id': ObjectId(entry_data['previous_state_id'])})
+            reachability_info = StateReachabilityInfo(from_state_id=str(previous_state['_id']),
+                                                      caused_by_interaction_id=entry_data['caused_by_interaction_id'])
+            earliest_state_reachability.append(reachability_info)
+
+            if self._delete_collapsed:
+                collapsed_state_ids.extend(self._mongo_helper.delete_states_recursively(entry_id))
+            else:
+                collapsed_state_ids.extend(self._mongo_helper.mark_states_as_collapsed_recursively(entry_id))
+            self._logger.info(f'Collapsed state: {entry_id}')
+
+        self._mongo_helper.extend_state_reachability(state_id=earliest_identical_state_id,
+                                                     reachability_info_list=earliest_state_reachability)
+        return collapsed_state_ids
 
     def _recalculate_state_hashes(self):
         states_query = self._states_collection.find({"explored": True})
@@ -167,7 +281,8 @@ class StateDetector(BaseDetector):
                 state_hash = State.generate_random_hash()
 
             # Update state hash
-            self._states_collection.find_one_and_update(state_query, {'$set': {'hash': state_hash}})
+            self._states_collection.find_one_and_update(state_query,
+                                                        {'$set': self._mongo_helper.with_hash2vec({'hash': state_hash})})
 
     def _generate_endpoint_based_string(self, state_id):
         # Get the interactions of the state
@@ -211,6 +326,7 @@ class StateDetector(BaseDetector):
         interactions_string = ''
         for interaction_hash in distinct_interactions_hashes:
             distinct_interaction_query = self._interaction_collection.find_one({'hash': interaction_hash})
+            self._mongo_helper.resolve_response_bodies([distinct_interaction_query])
             request = Request.from_dict(distinct_interaction_query['request'])
             response = Response.from_dict(distinct_interaction_query['response'])
 
@@ -20,11 +20,12 @@ class EvaluationFrameworkDummyFuzzer(BaseModule):
 
     def __init__(self, for_batch: str, app_address: str):
         self._for_batch = for_batch
-        self._mongo_helper = MongoHelper(self._for_batch)
+        self._mongo_helper = MongoHelper(self._for_batch, for_module='Dummy Fuzzer')
         self._states_collection = self._mongo_helper.get_states_collection()
         self._state_fuzz_history = {}
         self._logger = get_logger("Dummy Fuzzer")
-        self._local_ih = SimpleInteractionHandler(self._for_batch, name="Fuzzer's Interaction Handler")
+        self._local_ih = SimpleInteractionHandler(self._for_batch, name="Fuzzer's Interaction Handler",
+                                                  bulk_ingest=True)
         self._logger.info("Ready")
 
         parsed_url = urlparse(app_address)
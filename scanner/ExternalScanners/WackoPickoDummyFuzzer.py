@@ -19,12 +19,13 @@ class WackoPickoDummyFuzzer(BaseModule):
 
     def __init__(self, for_batch: str):
         self._for_batch = for_batch
-        self._mongo_helper = MongoHelper(self._for_batch)
+        self._mongo_helper = MongoHelper(self._for_batch, for_module='Wacko Picko Dummy Fuzzer')
         self._states_collection = self._mongo_helper.get_states_collection()
         self._state_fuzz_history = {}
         self._logger = get_logger("Wacko Picko Dummy Fuzzer")
         self._local_ih = SimpleInteractionHandler(for_batch=self._for_batch,
-                                                  name="Fuzzer's Interaction Handler")
+                                                  name="Fuzzer's Interaction Handler",
+                                                  bulk_ingest=True)
         self._logger.info("Ready")
 
     def run(self):
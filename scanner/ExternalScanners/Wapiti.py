@@ -39,7 +39,7 @@ class Wapiti(BaseModule):
     _logger: Logger
 
     def __init__(self, for_batch: str):
-        mongo_helper = MongoHelper(for_batch=for_batch)
+        self._mongo_helper = MongoHelper(for_batch=for_batch, for_module='Wapiti', bulk_ingest=True)
 
         self._wapiti = WapitiWrapper()
         self._batch_name = for_batch
@@ -63,16 +63,13 @@ class Wapiti(BaseModule):
 
         self._proxy_port = str(proxy_port)
         self._proxy_url = proxy_scheme + "://" + proxy_host + ":" + proxy_port
-        self._endpoints_collection = mongo_helper.get_endpoints_collection()
-        self._states_collection = mongo_helper.get_states_collection()
+        self._endpoints_collection = self._mongo_helper.get_endpoints_collection()
+        self._states_collection = self._mongo_helper.get_states_collection()
         self._max_scans_per_iteration = 1
         self._auto_start_proxy = proxy_auto_start
 
         self._logger = get_logger("Wapiti")
 
-        # Create a thread with a socket listener
-        self._mongo_helper = MongoHelper(for_batch)
-
         pool = redis.ConnectionPool(host=redis_host, port=redis_port, db=redis_db)
         self._redis = redis.Redis(connection_pool=pool)
         self.clear_redis_data()
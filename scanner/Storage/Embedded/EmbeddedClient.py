@@ -0,0 +1,583 @@
+import sqlite3
+from copy import deepcopy
+from threading import RLock
+from typing import List
+
+from bson import ObjectId, json_util
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import BulkWriteResult, InsertOneResult, InsertManyResult, UpdateResult, DeleteResult
+from pymongo.write_concern import WriteConcern
+
+from scanner.Storage.Embedded.QueryEngine import apply_projection, apply_update, equality_conditions, freeze, \
+    matches, normalize, resolve_path, run_pipeline, sort_documents, upsert_document, MISSING, UnsupportedOperation
+
+
+class _HashIndex:
+    """
+    A secondary index mapping the values of its fields to document ids. Documents with array values in the indexed
+    fields are kept in a separate set which is always scanned, so the index never hides a match.
+    """
+
+    def __init__(self, fields: List[str]):
+        self.fields = fields
+        self._entries = dict()
+        self._unindexed = set()
+
+    def _key(self, document: dict):
+        key = []
+        for field in self.fields:
+            values = resolve_path(document, field)
+            if len(values) != 1 or isinstance(values[0], list):
+                return None
+            value = None if values[0] is MISSING else values[0]
+            key.append(freeze(value))
+        return tuple(key)
+
+    def add(self, document_id, document: dict):
+        key = self._key(document)
+        if key is None:
+            self._unindexed.add(document_id)
+        else:
+            self._entries.setdefault(key, set()).add(document_id)
+
+    def remove(self, document_id, document: dict):
+        key = self._key(document)
+        if key is None:
+            self._unindexed.discard(document_id)
+        else:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.discard(document_id)
+                if len(entry) == 0:
+                    del self._entries[key]
+
+    def candidates(self, conditions: dict) -> set:
+        key = tuple(freeze(conditions[field]) for field in self.fields)
+        return self._entries.get(key, set()) | self._unindexed
+
+
+class _CollectionData:
+    """
+    The documents and indexes of an embedded collection
+    """
+
+    def __init__(self):
+        self.documents = dict()
+        self.positions = dict()
+        self.next_position = 0
+        self.index_specs = {'_id_': {'v': 2, 'key': [('_id', 1)]}}
+        self.indexes = dict()
+
+    def contains(self, document: dict) -> bool:
+        return freeze(document['_id']) in self.documents
+
+    def add(self, document: dict):
+        document_id = freeze(document['_id'])
+        self.documents[document_id] = document
+        self.positions[document_id] = self.next_position
+        self.next_position += 1
+        for index in self.indexes.values():
+            index.add(document_id, document)
+
+    def remove(self, document_id):
+        document = self.documents.pop(document_id)
+        self.positions.pop(document_id)
+        for index in self.indexes.values():
+            index.remove(document_id, document)
+
+    def reindex(self, document_id, old_document: dict, new_document: dict):
+        for index in self.indexes.values():
+            index.remove(document_id, old_document)
+            index.add(document_id, new_document)
+
+    def create_index(self, name: str, keys: List, options: dict):
+        self.index_specs[name] = dict({'v': 2, 'key': list(keys)}, **options)
+        index = _HashIndex([field for field, _ in keys])
+        for document_id, document in self.documents.items():
+            index.add(document_id, document)
+        self.indexes[name] = index
+
+    def find_ids(self, query: dict) -> List:
+        """
+        Selects the candidate documents using the _id or the most selective usable secondary index, and filters them
+        """
+
+        conditions = equality_conditions(query)
+        candidate_ids = None
+
+        id_condition = (query or dict()).get('_id')
+        if '_id' in conditions:
+            candidate_ids = {freeze(conditions['_id'])}
+        elif isinstance(id_condition, dict) and set(id_condition) == {'$in'}:
+            candidate_ids = {freeze(normalize(entry)) for entry in id_condition['$in']}
+        else:
+            usable_indexes = [index for index in self.indexes.values()
+                              if all(field in conditions for field in index.fields)]
+            if len(usable_indexes) > 0:
+                index = max(usable_indexes, key=lambda usable_index: len(usable_index.fields))
+                candidate_ids = index.candidates(conditions)
+
+        if candidate_ids is None:
+            candidate_ids = self.documents.keys()
+        else:
+            candidate_ids = sorted((document_id for document_id in candidate_ids if document_id in self.documents),
+                                   key=lambda document_id: self.positions[document_id])
+
+        return [document_id for document_id in candidate_ids if matches(self.documents[document_id], query)]
+
+
+class _SqlitePersistence:
+    """
+    Write-through persistence of the embedded storage in a SQLite file
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS documents '
+                                 '(db TEXT, collection TEXT, id TEXT, document TEXT, '
+                                 'PRIMARY KEY (db, collection, id))')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS indexes '
+                                 '(db TEXT, collection TEXT, name TEXT, spec TEXT, '
+                                 'PRIMARY KEY (db, collection, name))')
+        self._connection.commit()
+
+    def load(self):
+        documents = self._connection.execute('SELECT db, collection, document FROM documents ORDER BY rowid')
+        for db_name, collection_name, document in documents:
+            yield 'document', db_name, collection_name, json_util.loads(document)
+
+        indexes = self._connection.execute('SELECT db, collection, name, spec FROM indexes ORDER BY rowid')
+        for db_name, collection_name, name, spec in indexes:
+            yield 'index', db_name, collection_name, (name, json_util.loads(spec))
+
+    def save_documents(self, db_name: str, collection_name: str, documents: List[dict]):
+        # Upsert instead of replace keeps the rowid, i.e. the insertion order of the documents when reloading
+        self._connection.executemany('INSERT INTO documents VALUES (?, ?, ?, ?) '
+                                     'ON CONFLICT (db, collection, id) DO UPDATE SET document = excluded.document',
+                                     [(db_name, collection_name, json_util.dumps(document['_id']),
+                                       json_util.dumps(document)) for document in documents])
+        self._connection.commit()
+
+    def delete_documents(self, db_name: str, collection_name: str, documents: List[dict]):
+        self._connection.executemany('DELETE FROM documents WHERE db = ? AND collection = ? AND id = ?',
+                                     [(db_name, collection_name, json_util.dumps(document['_id']))
+                                      for document in documents])
+        self._connection.commit()
+
+    def save_index(self, db_name: str, collection_name: str, name: str, spec: dict):
+        self._connection.execute('INSERT OR REPLACE INTO indexes VALUES (?, ?, ?, ?)',
+                                 (db_name, collection_name, name, json_util.dumps(spec)))
+        self._connection.commit()
+
+    def drop(self, db_name: str, collection_name: str = None):
+        for table in ('documents', 'indexes'):
+            if collection_name is None:
+                self._connection.execute(f'DELETE FROM {table} WHERE db = ?', (db_name,))
+            else:
+                self._connection.execute(f'DELETE FROM {table} WHERE db = ? AND collection = ?',
+                                         (db_name, collection_name))
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+class EmbeddedCursor:
+    """
+    The result of :meth:`EmbeddedCollection.find`. Mirrors the parts of :class:`pymongo.cursor.Cursor` used by the
+    scanner.
+    """
+
+    def __init__(self, documents: List[dict]):
+        self._documents = documents
+
+    def sort(self, key_or_list, direction: int = 1) -> 'EmbeddedCursor':
+        sort_spec = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        self._documents = sort_documents(self._documents, sort_spec)
+        return self
+
+    def skip(self, count: int) -> 'EmbeddedCursor':
+        self._documents = self._documents[count:]
+        return self
+
+    def limit(self, count: int) -> 'EmbeddedCursor':
+        if count > 0:
+            self._documents = self._documents[:count]
+        return self
+
+    def batch_size(self, batch_size: int) -> 'EmbeddedCursor':
+        # The documents are already in memory, so there is nothing to batch
+        return self
+
+    def distinct(self, key: str) -> list:
+        distinct_values = []
+        distinct_keys = set()
+        for document in self._documents:
+            for value in resolve_path(document, key):
+                entries = value if isinstance(value, list) else [value]
+                for entry in entries:
+                    if entry is MISSING or freeze(entry) in distinct_keys:
+                        continue
+                    distinct_keys.add(freeze(entry))
+                    distinct_values.append(entry)
+        return distinct_values
+
+    def __iter__(self):
+        return iter(self._documents)
+
+    def __next__(self):
+        if len(self._documents) == 0:
+            raise StopIteration
+        return self._documents.pop(0)
+
+
+class EmbeddedCollection:
+    """
+    An in-process collection mirroring the parts of :class:`pymongo.collection.Collection` used by the scanner.
+    """
+
+    def __init__(self, client: 'EmbeddedClient', db_name: str, name: str):
+        self._client = client
+        self._db_name = db_name
+        self.name = name
+        self.full_name = f'{db_name}.{name}'
+        self.write_concern = WriteConcern()
+
+    def _data(self, create: bool = False) -> _CollectionData:
+        return self._client._get_collection_data(self._db_name, self.name, create)
+
+    def with_options(self, **kwargs) -> 'EmbeddedCollection':
+        # Writes are always applied synchronously, so the options have no effect
+        return self
+
+    def create_index(self, keys, name: str = None, **options) -> str:
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = [(field, direction) for field, direction in keys]
+        if name is None:
+            name = '_'.join(f'{field}_{direction}' for field, direction in keys)
+
+        with self._client.lock:
+            data = self._data(create=True)
+            if name not in data.index_specs:
+                data.create_index(name, keys, options)
+                self._client._persist('save_index', self._db_name, self.name, name, data.index_specs[name])
+        return name
+
+    def index_information(self) -> dict:
+        with self._client.lock:
+            data = self._data()
+            if data is None:
+                return dict()
+            return deepcopy(data.index_specs)
+
+    def insert_one(self, document: dict) -> InsertOneResult:
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+
+        with self._client.lock:
+            stored_document = normalize(document)
+            data = self._data(create=True)
+            if data.contains(stored_document):
+                raise DuplicateKeyError(f'Duplicate key {document["_id"]} in {self.full_name}')
+            data.add(stored_document)
+            self._client._persist('save_documents', self._db_name, self.name, [stored_document])
+        return InsertOneResult(document['_id'], True)
+
+    def insert_many(self, documents: List[dict], ordered: bool = True) -> InsertManyResult:
+        if len(documents) == 0:
+            raise TypeError('documents must be a non-empty list')
+
+        stored_documents = []
+        write_errors = []
+        with self._client.lock:
+            data = self._data(create=True)
+            for idx, document in enumerate(documents):
+                if '_id' not in document:
+                    document['_id'] = ObjectId()
+                stored_document = normalize(document)
+                if data.contains(stored_document):
+                    write_errors.append({'index': idx, 'code': 11000, 'errmsg': 'duplicate key error'})
+                    if ordered:
+                        break
+                    continue
+                data.add(stored_document)
+                stored_documents.append(stored_document)
+            self._client._persist('save_documents', self._db_name, self.name, stored_documents)
+
+        if len(write_errors) > 0:
+            raise BulkWriteError({'writeErrors': write_errors, 'nInserted': len(stored_documents)})
+        return InsertManyResult([document['_id'] for document in documents], True)
+
+    def find(self, filter: dict = None, projection=None, sort=None, limit: int = 0) -> EmbeddedCursor:
+        with self._client.lock:
+            data = self._data()
+            document_ids = [] if data is None else data.find_ids(filter)
+
+            if sort is None:
+                if limit:
+                    document_ids = document_ids[:limit]
+                return EmbeddedCursor([apply_projection(data.documents[document_id], projection)
+                                       for document_id in document_ids])
+
+            # The projection is applied after sorting, because the sort fields may not be projected
+            documents = sort_documents([data.documents[document_id] for document_id in document_ids], sort)
+            if limit:
+                documents = documents[:limit]
+            return EmbeddedCursor([apply_projection(document, projection) for document in documents])
+
+    def find_one(self, filter: dict = None, projection=None, sort=None):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+
+        for document in self.find(filter, projection, sort=sort, limit=1):
+            return document
+        return None
+
+    def count_documents(self, filter: dict) -> int:
+        with self._client.lock:
+            data = self._data()
+            return 0 if data is None else len(data.find_ids(filter))
+
+    def distinct(self, key: str, filter: dict = None) -> list:
+        return self.find(filter).distinct(key)
+
+    def aggregate(self, pipeline: List[dict]) -> EmbeddedCursor:
+        # A leading $match stage is answered with the indexes, so only the matching documents are copied
+        match_query = None
+        if len(pipeline) > 0 and list(pipeline[0].keys()) == ['$match']:
+            match_query = pipeline[0]['$match']
+            pipeline = pipeline[1:]
+
+        with self._client.lock:
+            data = self._data()
+            document_ids = [] if data is None else data.find_ids(match_query)
+            documents = [deepcopy(data.documents[document_id]) for document_id in document_ids]
+        return EmbeddedCursor(run_pipeline(documents, pipeline))
+
+    def _update(self, filter: dict, update: dict, upsert: bool, many: bool):
+        """
+        :return: The matched count, the modified count, the upserted id and the matched document before the update
+        """
+
+        with self._client.lock:
+            data = self._data(create=upsert)
+            matched_ids = [] if data is None else data.find_ids(filter)
+            if not many:
+                matched_ids = matched_ids[:1]
+
+            if len(matched_ids) == 0:
+                if not upsert:
+                    return 0, 0, None, None
+                document = upsert_document(filter, update)
+                data.add(document)
+                self._client._persist('save_documents', self._db_name, self.name, [document])
+                return 0, 0, document['_id'], None
+
+            modified_documents = []
+            first_document_before = None
+            for document_id in matched_ids:
+                document = data.documents[document_id]
+                document_before = deepcopy(document)
+                if first_document_before is None:
+                    first_document_before = document_before
+                if apply_update(document, update):
+                    data.reindex(document_id, document_before, document)
+                    modified_documents.append(document)
+
+            if len(modified_documents) > 0:
+                self._client._persist('save_documents', self._db_name, self.name, modified_documents)
+            return len(matched_ids), len(modified_documents), None, first_document_before
+
+    @staticmethod
+    def _update_result(matched_count: int, modified_count: int, upserted_id) -> UpdateResult:
+        raw_result = {'n': matched_count + (1 if upserted_id is not None else 0),
+                      'nModified': modified_count,
+                      'ok': 1.0}
+        if upserted_id is not None:
+            raw_result['upserted'] = upserted_id
+        return UpdateResult(raw_result, True)
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        matched_count, modified_count, upserted_id, _ = self._update(filter, update, upsert, many=False)
+        return self._update_result(matched_count, modified_count, upserted_id)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        matched_count, modified_count, upserted_id, _ = self._update(filter, update, upsert, many=True)
+        return self._update_result(matched_count, modified_count, upserted_id)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False) -> UpdateResult:
+        matched_count, modified_count, upserted_id, _ = self._update(filter, replacement, upsert, many=False)
+        return self._update_result(matched_count, modified_count, upserted_id)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection=None, upsert: bool = False,
+                            return_document=ReturnDocument.BEFORE):
+        with self._client.lock:
+            _, _, upserted_id, document_before = self._update(filter, update, upsert, many=False)
+            if return_document == ReturnDocument.BEFORE:
+                return None if document_before is None else apply_projection(document_before, projection)
+
+            document_id = upserted_id if upserted_id is not None else document_before['_id'] \
+                if document_before is not None else None
+            if document_id is None:
+                return None
+            return self.find_one({'_id': document_id}, projection)
+
+    def _delete(self, filter: dict, many: bool) -> DeleteResult:
+        with self._client.lock:
+            data = self._data()
+            matched_ids = [] if data is None else data.find_ids(filter)
+            if not many:
+                matched_ids = matched_ids[:1]
+
+            deleted_documents = [data.documents[document_id] for document_id in matched_ids]
+            for document_id in matched_ids:
+                data.remove(document_id)
+            if len(deleted_documents) > 0:
+                self._client._persist('delete_documents', self._db_name, self.name, deleted_documents)
+        return DeleteResult({'n': len(deleted_documents), 'ok': 1.0}, True)
+
+    def delete_one(self, filter: dict) -> DeleteResult:
+        return self._delete(filter, many=False)
+
+    def delete_many(self, filter: dict) -> DeleteResult:
+        return self._delete(filter, many=True)
+
+    def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        """
+        Runs the write operations of pymongo (InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne and DeleteMany)
+        while holding the storage lock
+        """
+
+        result = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': [],
+                  'writeErrors': [], 'writeConcernErrors': []}
+        with self._client.lock:
+            for idx, request in enumerate(requests):
+                if isinstance(request, InsertOne):
+                    try:
+                        self.insert_one(request._doc)
+                    except DuplicateKeyError as e:
+                        result['writeErrors'].append({'index': idx, 'code': 11000, 'errmsg': str(e)})
+                        if ordered:
+                            break
+                        continue
+                    result['nInserted'] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    matched_count, modified_count, upserted_id, _ = self._update(request._filter, request._doc,
+                                                                                 request._upsert,
+                                                                                 many=isinstance(request, UpdateMany))
+                    result['nMatched'] += matched_count
+                    result['nModified'] += modified_count
+                    if upserted_id is not None:
+                        result['nUpserted'] += 1
+                        result['upserted'].append({'index': idx, '_id': upserted_id})
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    delete_result = self._delete(request._filter, many=isinstance(request, DeleteMany))
+                    result['nRemoved'] += delete_result.deleted_count
+                else:
+                    raise UnsupportedOperation(f'Bulk write operation {type(request).__name__} is not supported by '
+                                               f'the embedded storage')
+
+        if len(result['writeErrors']) > 0:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def drop(self):
+        self._client[self._db_name].drop_collection(self.name)
+
+
+class EmbeddedDatabase:
+    """
+    An in-process database mirroring the parts of :class:`pymongo.database.Database` used by the scanner.
+    """
+
+    def __init__(self, client: 'EmbeddedClient', name: str):
+        self._client = client
+        self.name = name
+
+    def __getitem__(self, collection_name: str) -> EmbeddedCollection:
+        return EmbeddedCollection(self._client, self.name, collection_name)
+
+    def get_collection(self, collection_name: str, **kwargs) -> EmbeddedCollection:
+        return self[collection_name]
+
+    def list_collection_names(self) -> List[str]:
+        with self._client.lock:
+            return list(self._client._databases.get(self.name, dict()).keys())
+
+    def drop_collection(self, collection_name: str):
+        with self._client.lock:
+            self._client._databases.get(self.name, dict()).pop(collection_name, None)
+            self._client._persist('drop', self.name, collection_name)
+
+
+class EmbeddedClient:
+    """
+    An in-process storage mirroring the parts of :class:`pymongo.MongoClient` used by the scanner. The data is kept in
+    dicts with hash based secondary indexes and is optionally persisted to a SQLite file.
+    """
+
+    def __init__(self, sqlite_path: str = None):
+        """
+        :param sqlite_path: Path to the SQLite file where the data is persisted (in-memory only if None)
+        :type sqlite_path: str
+        """
+
+        self.lock = RLock()
+        self._databases = dict()
+        self._persistence = None
+
+        if sqlite_path:
+            persistence = _SqlitePersistence(sqlite_path)
+            for entry_type, db_name, collection_name, entry in persistence.load():
+                data = self._get_collection_data(db_name, collection_name, create=True)
+                if entry_type == 'document':
+                    data.add(entry)
+                else:
+                    name, spec = entry
+                    options = {key: value for key, value in spec.items() if key not in ('v', 'key')}
+                    data.create_index(name, [tuple(key) for key in spec['key']], options)
+            self._persistence = persistence
+
+    def _get_collection_data(self, db_name: str, collection_name: str, create: bool = False) -> _CollectionData:
+        database = self._databases.get(db_name)
+        if database is None:
+            if not create:
+                return None
+            database = self._databases[db_name] = dict()
+
+        data = database.get(collection_name)
+        if data is None and create:
+            data = database[collection_name] = _CollectionData()
+        return data
+
+    def _persist(self, operation: str, *args):
+        if self._persistence is not None:
+            getattr(self._persistence, operation)(*args)
+
+    def __getitem__(self, db_name: str) -> EmbeddedDatabase:
+        return EmbeddedDatabase(self, db_name)
+
+    def get_database(self, db_name: str, **kwargs) -> EmbeddedDatabase:
+        return self[db_name]
+
+    def list_database_names(self) -> List[str]:
+        with self.lock:
+            return [db_name for db_name, collections in self._databases.items() if len(collections) > 0]
+
+    def drop_database(self, db_name: str):
+        with self.lock:
+            self._databases.pop(db_name, None)
+            self._persist('drop', db_name)
+
+    def server_info(self) -> dict:
+        return {'version': 'embedded', 'ok': 1.0}
+
+    def close(self):
+        with self.lock:
+            if self._persistence is not None:
+                self._persistence.close()
+                self._persistence = None
@@ -0,0 +1,21 @@
+from scanner.Base.BaseStorageBackend import BaseStorageBackend
+from scanner.Storage.Embedded.EmbeddedClient import EmbeddedClient
+
+
+class EmbeddedStorageBackend(BaseStorageBackend):
+    """
+    In-process storage backend. The data lives in the memory of the current process and is optionally persisted to a
+    SQLite file. It needs no external services, but only modules running in the same process (i.e. the 'sequential'
+    and 'parallel-threaded' execution types) share the data.
+    """
+
+    def __init__(self, sqlite_path: str = None):
+        """
+        :param sqlite_path: Path to the SQLite file where the data is persisted (in-memory only if None)
+        :type sqlite_path: str
+        """
+        self._sqlite_path = sqlite_path
+
+    def create_client(self, host: str, port: int, username: str = None, password: str = None,
+                      **pool_options) -> EmbeddedClient:
+        return EmbeddedClient(sqlite_path=self._sqlite_path)
@@ -0,0 +1,490 @@
+"""
+Evaluation of the Mongo query, projection, update and aggregation shapes used by the pipeline on plain dicts.
+Only the subset of the Mongo query language which is used by the scanner modules is supported.
+"""
+from collections.abc import Mapping
+from copy import deepcopy
+from typing import Any, List
+
+from bson import ObjectId
+
+
+class UnsupportedOperation(Exception):
+    """
+    Thrown when a query, update or aggregation uses an operator which is not supported by the embedded storage.
+    """
+    pass
+
+
+class _Missing:
+    """
+    Marker for a field that does not exist in a document.
+    """
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+def normalize(value):
+    """
+    Converts a value to the form in which Mongo would return it (i.e. tuples become lists and mappings become dicts)
+    """
+
+    if isinstance(value, Mapping):
+        return {str(key): normalize(sub_value) for key, sub_value in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(sub_value) for sub_value in value]
+    if isinstance(value, (str, bytes, int, float, bool, type(None), ObjectId)):
+        return value
+    # OmegaConf containers and other sequences
+    if hasattr(value, '__iter__') and hasattr(value, '__len__'):
+        return [normalize(sub_value) for sub_value in value]
+    return value
+
+
+def freeze(value):
+    """
+    Converts a value to a hashable key. Booleans are tagged, because Mongo does not consider True equal to 1.
+    """
+
+    if isinstance(value, bool):
+        return '__bool__', value
+    if isinstance(value, dict):
+        return '__dict__', tuple((key, freeze(sub_value)) for key, sub_value in value.items())
+    if isinstance(value, list):
+        return '__list__', tuple(freeze(sub_value) for sub_value in value)
+    return value
+
+
+def resolve_path(document, path: str) -> List[Any]:
+    """
+    Resolves a dotted path in a document. Arrays on the path are traversed element-wise like in Mongo.
+
+    :return: All values found for the path (MISSING if the path does not exist)
+    :rtype: List[Any]
+    """
+
+    values = [document]
+    for key in path.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                next_values.append(value.get(key, MISSING))
+            elif isinstance(value, list):
+                if key.isdigit() and int(key) < len(value):
+                    next_values.append(value[int(key)])
+                else:
+                    for element in value:
+                        if isinstance(element, dict) and key in element:
+                            next_values.append(element[key])
+            else:
+                next_values.append(MISSING)
+        values = next_values
+
+    if len(values) == 0:
+        values = [MISSING]
+    return values
+
+
+def values_equal(first, second) -> bool:
+    if isinstance(first, bool) != isinstance(second, bool):
+        return False
+    if isinstance(first, list) and isinstance(second, list):
+        return len(first) == len(second) and all(values_equal(a, b) for a, b in zip(first, second))
+    if isinstance(first, dict) and isinstance(second, dict):
+        return first.keys() == second.keys() and all(values_equal(first[key], second[key]) for key in first)
+    return first == second
+
+
+def _equals_any(values: List[Any], expected) -> bool:
+    for value in values:
+        if value is MISSING:
+            if expected is None:
+                return True
+            continue
+        if values_equal(value, expected):
+            return True
+        if isinstance(value, list) and any(values_equal(element, expected) for element in value):
+            return True
+    return False
+
+
+def _compare_any(values: List[Any], expected, comparison) -> bool:
+    for value in values:
+        candidates = value if isinstance(value, list) else [value]
+        for candidate in candidates:
+            if candidate is MISSING or candidate is None or isinstance(candidate, bool) != isinstance(expected, bool):
+                continue
+            try:
+                if comparison(candidate, expected):
+                    return True
+            except TypeError:
+                continue
+    return False
+
+
+def _match_operators(values: List[Any], condition: dict) -> bool:
+    for operator, expected in condition.items():
+        if operator == '$eq':
+            matched = _equals_any(values, expected)
+        elif operator == '$ne':
+            matched = not _equals_any(values, expected)
+        elif operator == '$gt':
+            matched = _compare_any(values, expected, lambda a, b: a > b)
+        elif operator == '$gte':
+            matched = _compare_any(values, expected, lambda a, b: a >= b)
+        elif operator == '$lt':
+            matched = _compare_any(values, expected, lambda a, b: a < b)
+        elif operator == '$lte':
+            matched = _compare_any(values, expected, lambda a, b: a <= b)
+        elif operator == '$in':
+            matched = any(_equals_any(values, entry) for entry in expected)
+        elif operator == '$nin':
+            matched = not any(_equals_any(values, entry) for entry in expected)
+        elif operator == '$exists':
+            exists = any(value is not MISSING for value in values)
+            matched = exists == bool(expected)
+        elif operator == '$not':
+            matched = not _match_condition(values, expected)
+        else:
+            raise UnsupportedOperation(f'Query operator {operator} is not supported by the embedded storage')
+
+        if not matched:
+            return False
+    return True
+
+
+def is_operator_condition(condition) -> bool:
+    return isinstance(condition, dict) and len(condition) > 0 and all(key.startswith('$') for key in condition)
+
+
+def _match_condition(values: List[Any], condition) -> bool:
+    if is_operator_condition(condition):
+        return _match_operators(values, condition)
+    return _equals_any(values, condition)
+
+
+def matches(document: dict, query: dict) -> bool:
+    """
+    :param document: The document which will be checked
+    :type document: dict
+
+    :param query: A Mongo query
+    :type query: dict
+
+    :return: True if the document matches the query
+    :rtype: bool
+    """
+
+    if not query:
+        return True
+
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(document, sub_query) for sub_query in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, sub_query) for sub_query in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(document, sub_query) for sub_query in condition):
+                return False
+        elif key.startswith('$'):
+            raise UnsupportedOperation(f'Query operator {key} is not supported by the embedded storage')
+        elif not _match_condition(resolve_path(document, key), normalize(condition)):
+            return False
+    return True
+
+
+def equality_conditions(query: dict) -> dict:
+    """
+    :return: The top-level fields of a query which are constrained to a single hashable value
+    :rtype: dict
+    """
+
+    conditions = dict()
+    for key, condition in (query or dict()).items():
+        if key.startswith('$'):
+            continue
+        if is_operator_condition(condition):
+            if '$eq' in condition:
+                condition = condition['$eq']
+            else:
+                continue
+        if isinstance(condition, (dict, list, tuple)):
+            continue
+        conditions[key] = condition
+    return conditions
+
+
+def _set_path(document: dict, path: str, value):
+    keys = path.split('.')
+    target = document
+    for key in keys[:-1]:
+        if isinstance(target, list):
+            target = target[int(key)]
+            continue
+        if key not in target or not isinstance(target[key], (dict, list)):
+            target[key] = dict()
+        target = target[key]
+
+    if isinstance(target, list):
+        target[int(keys[-1])] = value
+    else:
+        target[keys[-1]] = value
+
+
+def _unset_path(document: dict, path: str):
+    keys = path.split('.')
+    target = document
+    for key in keys[:-1]:
+        if isinstance(target, dict) and key in target:
+            target = target[key]
+        else:
+            return
+    if isinstance(target, dict):
+        target.pop(keys[-1], None)
+
+
+def _get_single(document: dict, path: str):
+    value = resolve_path(document, path)[0]
+    return None if value is MISSING else value
+
+
+def apply_update(document: dict, update: dict, is_insert: bool = False) -> bool:
+    """
+    Applies a Mongo update (or a replacement document) in place
+
+    :param document: The document which will be updated
+    :type document: dict
+
+    :param update: The update or replacement document
+    :type update: dict
+
+    :param is_insert: True if the update is applied to a new document created by an upsert
+    :type is_insert: bool
+
+    :return: True if the document was modified
+    :rtype: bool
+    """
+
+    before = deepcopy(document)
+    update = normalize(update)
+
+    if not any(key.startswith('$') for key in update):
+        document_id = document.get('_id')
+        document.clear()
+        document.update(deepcopy(update))
+        if document_id is not None:
+            document['_id'] = document_id
+        return not values_equal(before, document)
+
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == '$set':
+                _set_path(document, path, deepcopy(value))
+            elif operator == '$setOnInsert':
+                if is_insert:
+                    _set_path(document, path, deepcopy(value))
+            elif operator == '$unset':
+                _unset_path(document, path)
+            elif operator == '$inc':
+                _set_path(document, path, (_get_single(document, path) or 0) + value)
+            elif operator in ('$push', '$addToSet'):
+                current = _get_single(document, path)
+                if current is None:
+                    current = []
+                    _set_path(document, path, current)
+                entries = value['$each'] if isinstance(value, dict) and '$each' in value else [value]
+                for entry in entries:
+                    if operator == '$push' or not any(values_equal(entry, existing) for existing in current):
+                        current.append(deepcopy(entry))
+            else:
+                raise UnsupportedOperation(f'Update operator {operator} is not supported by the embedded storage')
+
+    return not values_equal(before, document)
+
+
+def upsert_document(query: dict, update: dict) -> dict:
+    """
+    Creates the document inserted by an upsert that did not match any document
+    """
+
+    document = dict()
+    for key, value in equality_conditions(query).items():
+        _set_path(document, key, deepcopy(normalize(value)))
+    apply_update(document, update, is_insert=True)
+    if '_id' not in document:
+        document['_id'] = ObjectId()
+    return document
+
+
+def _project_inclusion(source, target: dict, keys: List[str]):
+    head = keys[0]
+    if isinstance(source, dict):
+        if head not in source:
+            return
+        if len(keys) == 1:
+            target[head] = deepcopy(source[head])
+            return
+        sub_source = source[head]
+        if isinstance(sub_source, dict):
+            sub_target = target.setdefault(head, dict())
+            _project_inclusion(sub_source, sub_target, keys[1:])
+        elif isinstance(sub_source, list):
+            projected = target.setdefault(head, [dict() for _ in sub_source])
+            for element, projected_element in zip(sub_source, projected):
+                if isinstance(element, dict):
+                    _project_inclusion(element, projected_element, keys[1:])
+
+
+def apply_projection(document: dict, projection) -> dict:
+    """
+    :param document: The document which will be projected
+    :type document: dict
+
+    :param projection: A Mongo projection (dict or list of field names) or None for the whole document
+    :type projection: dict
+
+    :return: A copy of the document containing only the projected fields
+    :rtype: dict
+    """
+
+    if projection is None:
+        return deepcopy(document)
+
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+
+    include_id = bool(projection.get('_id', 1))
+    fields = {field: bool(value) for field, value in projection.items() if field != '_id'}
+
+    if len(fields) == 0 or not any(fields.values()):
+        # Exclusion projection
+        projected = deepcopy(document)
+        for field in fields:
+            _unset_path(projected, field)
+    else:
+        projected = dict()
+        for field, included in fields.items():
+            if included:
+                _project_inclusion(document, projected, field.split('.'))
+        if '_id' in document:
+            projected['_id'] = document['_id']
+
+    if not include_id:
+        projected.pop('_id', None)
+    return projected
+
+
+def _sort_key(value):
+    # Order of the BSON types when comparing values of different types
+    if value is MISSING or value is None:
+        return 0, 0
+    if isinstance(value, bool):
+        return 4, value
+    if isinstance(value, (int, float)):
+        return 1, value
+    if isinstance(value, str):
+        return 2, value
+    if isinstance(value, ObjectId):
+        return 3, value
+    return 5, str(value)
+
+
+def sort_documents(documents: List[dict], sort_spec) -> List[dict]:
+    """
+    :param sort_spec: List of (field, direction) pairs
+    """
+
+    for field, direction in reversed(list(sort_spec)):
+        documents = sorted(documents,
+                           key=lambda document: _sort_key(resolve_path(document, field)[0]),
+                           reverse=direction < 0)
+    return documents
+
+
+def _evaluate(document: dict, expression):
+    if isinstance(expression, str) and expression.startswith('$'):
+        return _get_single(document, expression[1:])
+    if isinstance(expression, dict):
+        return {key: _evaluate(document, sub_expression) for key, sub_expression in expression.items()}
+    return expression
+
+
+def _group(documents: List[dict], specification: dict) -> List[dict]:
+    groups = dict()
+    for document in documents:
+        group_id = _evaluate(document, specification['_id'])
+        group_key = freeze(group_id)
+        if group_key not in groups:
+            groups[group_key] = {'_id': group_id, '__values__': {field: [] for field in specification if field != '_id'}}
+
+        for field, accumulator in specification.items():
+            if field == '_id':
+                continue
+            (operator, expression), = accumulator.items()
+            groups[group_key]['__values__'][field].append(_evaluate(document, expression))
+
+    results = []
+    for group in groups.values():
+        result = {'_id': group['_id']}
+        for field, accumulator in specification.items():
+            if field == '_id':
+                continue
+            operator = next(iter(accumulator))
+            values = group['__values__'][field]
+            present = [value for value in values if value is not None]
+            if operator == '$sum':
+                result[field] = sum(value for value in present if isinstance(value, (int, float)))
+            elif operator == '$avg':
+                result[field] = sum(present) / len(present) if present else None
+            elif operator == '$min':
+                result[field] = min(present) if present else None
+            elif operator == '$max':
+                result[field] = max(present) if present else None
+            elif operator == '$first':
+                result[field] = values[0] if values else None
+            elif operator == '$last':
+                result[field] = values[-1] if values else None
+            elif operator == '$push':
+                result[field] = values
+            elif operator == '$addToSet':
+                unique_values = []
+                for value in values:
+                    if not any(values_equal(value, existing) for existing in unique_values):
+                        unique_values.append(value)
+                result[field] = unique_values
+            else:
+                raise UnsupportedOperation(f'Accumulator {operator} is not supported by the embedded storage')
+        results.append(result)
+    return results
+
+
+def run_pipeline(documents: List[dict], pipeline: List[dict]) -> List[dict]:
+    """
+    Runs an aggregation pipeline ($match, $group, $project, $sort, $skip, $limit and $count stages)
+    """
+
+    for stage in pipeline:
+        (stage_name, specification), = stage.items()
+        if stage_name == '$match':
+            documents = [document for document in documents if matches(document, specification)]
+        elif stage_name == '$group':
+            documents = _group(documents, specification)
+        elif stage_name == '$project':
+            documents = [apply_projection(document, specification) for document in documents]
+        elif stage_name == '$sort':
+            documents = sort_documents(documents, specification.items())
+        elif stage_name == '$skip':
+            documents = documents[specification:]
+        elif stage_name == '$limit':
+            documents = documents[:specification]
+        elif stage_name == '$count':
+            documents = [{specification: len(documents)}] if documents else []
+        else:
+            raise UnsupportedOperation(f'Aggregation stage {stage_name} is not supported by the embedded storage')
+    return documents
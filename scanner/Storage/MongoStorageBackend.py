@@ -0,0 +1,25 @@
+from pymongo import MongoClient
+
+from scanner.Base.BaseStorageBackend import BaseStorageBackend
+
+
+class MongoStorageBackend(BaseStorageBackend):
+    """
+    Storage backend using a Mongo server.
+    """
+
+    def create_client(self, host: str, port: int, username: str = None, password: str = None,
+                      **pool_options) -> MongoClient:
+        client = MongoClient(host=host,
+                             port=port,
+                             username=username,
+                             password=password,
+                             **pool_options)
+
+        # Check server connection
+        try:
+            client.server_info()
+        except:
+            raise ConnectionError("Something went wrong when trying to connect to mongo host")
+
+        return client
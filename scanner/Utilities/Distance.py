@@ -1,11 +1,115 @@
+import math
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from typing import List
 
 import Levenshtein
+import numpy as np
 import textdistance
 import tlsh
 from omegaconf import ListConfig
 from pandas import DataFrame
-from tqdm import tqdm
+
+from scanner.Utilities.DistanceCache import DistanceCache
+from scanner.Utilities.FixedLengthKernels import (damerau_levenshtein_condensed, hamming_condensed,
+                                                  jaro_winkler_inverted_condensed, mlipns_inverted_condensed)
+from scanner.Utilities.Logging import get_logger
+from scanner.Utilities.MinHash import minhash_condensed, minhash_distance
+from scanner.Utilities.TLSHKernel import tlsh_condensed
+from scanner.Utilities.Util import get_config
+
+
+# Entries of the dense q-gram profiles (inputs x distinct q-grams) of the levenshtein lower bounds
+_MAX_QGRAM_PROFILE_ENTRIES = 20000000
+
+
+class UnknownDistanceType(Exception):
+    """
+    Thrown when a distance type has no implementation.
+    """
+    pass
+
+
+def _condensed_rows(values: list, distance_type: str, row_start: int, row_end: int) -> np.ndarray:
+    """
+    Calculates the condensed upper triangle entries of the rows [row_start, row_end) of a distance matrix
+    (module level, so that it can be sent to the worker processes)
+    """
+
+    distance_function = Distance.get_distance_function(distance_type)
+    n = len(values)
+
+    condensed_rows = np.empty(sum(n - row - 1 for row in range(row_start, row_end)), dtype=np.float64)
+    idx = 0
+    for row in range(row_start, row_end):
+        row_value = values[row]
+        for column in range(row + 1, n):
+            condensed_rows[idx] = distance_function(row_value, values[column])
+            idx += 1
+    return condensed_rows
+
+
+def _pair_distances(values_by_idx: dict, distance_type: str, pairs: List[tuple]) -> List[float]:
+    """
+    Calculates the distances of the given index pairs
+    (module level, so that it can be sent to the worker processes)
+    """
+
+    distance_function = Distance.get_distance_function(distance_type)
+    return [distance_function(values_by_idx[idx1], values_by_idx[idx2]) for idx1, idx2 in pairs]
+
+
+def _bounded_levenshtein_pairs(values_by_idx: dict, pairs: List[tuple], cutoffs: List[int]) -> List[float]:
+    """
+    Calculates the levenshtein distances of the given index pairs, each capped at cutoff + 1
+    (module level, so that it can be sent to the worker processes)
+    """
+
+    return [Levenshtein.distance(values_by_idx[idx1], values_by_idx[idx2], score_cutoff=int(cutoff))
+            for (idx1, idx2), cutoff in zip(pairs, cutoffs)]
+
+
+def _levenshtein_lower_bounds(values: List[str], q: int) -> np.ndarray:
+    """
+    Calculates lower bounds of the condensed levenshtein distances: the length difference (every edit changes the
+    length by at most one) and the q-gram profile difference divided by 2q (every edit changes at most q q-grams in
+    each input, Ukkonen's q-gram lemma). The q-gram bound is skipped if the profiles would take too much memory.
+    """
+
+    n = len(values)
+    lengths = np.array([len(value) for value in values], dtype=np.int64)
+    upper_rows, upper_columns = np.triu_indices(n, 1)
+    lower_bounds = np.abs(lengths[upper_rows] - lengths[upper_columns])
+
+    codes = [np.frombuffer(value.encode('utf-32-le'), dtype=np.uint32) for value in values]
+    windows = [np.lib.stride_tricks.sliding_window_view(value_codes, q) if len(value_codes) >= q
+               else np.empty((0, q), dtype=np.uint32) for value_codes in codes]
+    all_windows = np.concatenate(windows)
+    if len(all_windows) == 0:
+        return lower_bounds
+
+    qgrams, qgram_ids = np.unique(all_windows, axis=0, return_inverse=True)
+    if n * len(qgrams) > _MAX_QGRAM_PROFILE_ENTRIES:
+        return lower_bounds
+
+    profiles = np.zeros((n, len(qgrams)), dtype=np.int32)
+    value_ids = np.repeat(np.arange(n), [len(value_windows) for value_windows in windows])
+    np.add.at(profiles, (value_ids, qgram_ids.reshape(-1)), 1)
+
+    qgram_differences = np.concatenate([np.abs(profiles[row + 1:] - profiles[row]).sum(axis=1)
+                                        for row in range(n - 1)] or [np.empty(0, dtype=np.int64)])
+    return np.maximum(lower_bounds, -(-qgram_differences // (2 * q)))
+
+
+@lru_cache(maxsize=1024)
+def _qgram_profile(value: str, q: int) -> Counter:
+    """
+    Counts the q-grams of an input (cached, as every input is compared with all other inputs of a matrix)
+    """
+
+    return Counter(value[idx:idx + q] for idx in range(len(value) - q + 1))
 
 
 class Distance:
@@ -13,6 +117,17 @@ class Distance:
     A wrapper class for has distance calculation and distance matrix generation
     """
     _distance_implementations = dict()
+    _vectorized_implementations = dict()
+
+    # Matrices with at least this many samples are calculated in a process pool (see the 'distance' config section)
+    parallel_min_samples = 200
+    max_workers = None
+
+    # Options of 'levenshtein-bounded' (see the 'distance' config section)
+    levenshtein_cutoff_ratio = 0.9
+    levenshtein_qgram_size = 2
+
+    _cache_size_warning_logged = False
 
     @classmethod
     def __init__(cls):
@@ -24,7 +139,9 @@ class Distance:
             'jaro-winkler-inverted': cls._jaro_winkler_inverted,
             'hamming': textdistance.hamming,
             'mlipns': cls._mlipns_inverted,
-            'damerau_levenshtein': textdistance.damerau_levenshtein
+            'damerau_levenshtein': textdistance.damerau_levenshtein,
+            'levenshtein-bounded': cls._levenshtein_bounded,
+            'minhash': minhash_distance
 
             # Those under come from bioinformatics and give a weird output
             # TODO: Read more about them and check if they could be used
@@ -33,6 +150,24 @@ class Distance:
             # 'smith-waterman': textdistance.smith_waterman,
         }
 
+        # Implementations calculating all condensed distances of a list of inputs at once with NumPy. They raise a
+        # ValueError for inputs they can not handle (e.g. the string kernels for strings of different lengths), which
+        # are then calculated pair by pair.
+        cls._vectorized_implementations = {
+            'tlsh': tlsh_condensed,
+            'minhash': minhash_condensed,
+            'hamming': hamming_condensed,
+            'jaro-winkler-inverted': jaro_winkler_inverted_condensed,
+            'mlipns': mlipns_inverted_condensed,
+            'damerau_levenshtein': damerau_levenshtein_condensed,
+            'levenshtein-bounded': cls._levenshtein_bounded_condensed
+        }
+
+        config = get_config()
+        distance_section = (config.get('distance') if config is not None else None) or dict()
+        cls.levenshtein_cutoff_ratio = float(distance_section.get('levenshtein_cutoff_ratio') or 0.9)
+        cls.levenshtein_qgram_size = int(distance_section.get('levenshtein_qgram_size') or 2)
+
     @classmethod
     def calculate(cls, input1: str, input2: str, distance_type: str):
         """
@@ -44,13 +179,34 @@ class Distance:
         :param hash2: Second hash string
         :type hash2: str
 
-        :param distance_type: Distance type name ('levenshtein','tlsh','jaro-winkler-inverted','hamming','mlipns' or 'damerau_levenshtein')
+        :param distance_type: Distance type name ('levenshtein','levenshtein-bounded','minhash','tlsh','jaro-winkler-inverted','hamming','mlipns' or 'damerau_levenshtein')
         :type distance_type: str
 
         """
-        distance_function = cls._distance_implementations.get(distance_type)
+        distance_function = cls.get_distance_function(distance_type)
         return distance_function(input1, input2)
 
+    @classmethod
+    def get_distance_function(cls, distance_type: str):
+        """
+        :param distance_type: Distance type name
+        :type distance_type: str
+
+        :return: The implementation of the distance type
+        :rtype: Callable[[str, str], float]
+
+        :raises UnknownDistanceType: If the distance type has no implementation
+        """
+        # The implementations are registered on the first instantiation, which did not happen in a spawned worker
+        if len(cls._distance_implementations) == 0:
+            cls.__init__()
+
+        distance_function = cls._distance_implementations.get(distance_type)
+        if distance_function is None:
+            raise UnknownDistanceType(f'No distance type {distance_type} exists. '
+                                      f'Please select one of the following: {", ".join(cls.get_distance_types())}')
+        return distance_function
+
     @classmethod
     def get_distance_types(cls):
         """
@@ -59,17 +215,286 @@ class Distance:
         """
         return list(cls._distance_implementations.keys())
 
+    @staticmethod
+    def extract_field_values(data_query: List[dict], field_for_distance="hash") -> list:
+        """
+        Extracts the input of the distance calculation from every entry of a data query
+
+        :param data_query: A list of dicts, which contain the field for distance
+        :type data_query: List[dict]
+
+        :param field_for_distance: Name of the key (or list of keys for nested fields) used for the distance calculation
+        :type field_for_distance: str or list
+
+        :return: The values of the field in the order of the data query
+        :rtype: list
+        """
+
+        # OmegaConf parsed case: Cast ListConfig to List
+        if isinstance(field_for_distance, ListConfig):
+            field_for_distance = list(field_for_distance)
+
+        # Parse field for distance if it's nested in the data query
+        if isinstance(field_for_distance, list):
+            values = []
+            for query in data_query:
+                sub_section = query
+                for key in field_for_distance:
+                    sub_section = sub_section[key]
+                values.append(sub_section)
+            return values
+        elif isinstance(field_for_distance, str):
+            return [query[field_for_distance] for query in data_query]
+        else:
+            raise TypeError("field_for_distance must be str or list")
+
+    @classmethod
+    def generate_condensed_distances(cls, values: list, distance_type: str, use_cache: bool = True) -> np.ndarray:
+        """
+        Calculates the pairwise distances of the upper triangle of a distance matrix (i.e. each pair once and no
+        diagonal), in the row-major order of :func:`scipy.spatial.distance.squareform`. Large inputs are split into row
+        ranges with about the same count of pairs, which are calculated in a process pool.
+
+        Distance types with a vectorized implementation (e.g. 'tlsh' or 'hamming' on equal-length hashes) are
+        calculated with NumPy. For the other types, the distance matrix of the most similar earlier input is taken from
+        the :class:`DistanceCache` (if enabled), so that a clustering input that grew by one item only looks up and
+        calculates the distances of the new item. Identical inputs have the distance 0.
+
+        :param values: The inputs of the distance calculation
+        :type values: list
+
+        :param distance_type: Name of the distance type
+        :type distance_type: str
+
+        :param use_cache: Use the distance cache of the process (if enabled in the config)
+        :type use_cache: bool
+
+        :return: The condensed distances (n * (n - 1) / 2 entries)
+        :rtype: numpy.ndarray
+        """
+
+        # Fail before starting the workers
+        cls.get_distance_function(distance_type)
+
+        # Vectorized kernels are faster than the cache lookups
+        vectorized_implementation = cls._vectorized_implementations.get(distance_type)
+        if vectorized_implementation is not None:
+            try:
+                return vectorized_implementation(values)
+            except ValueError:
+                pass
+
+        distance_cache = DistanceCache.get_instance() if use_cache else None
+        if distance_cache is None:
+            return cls._calculate_condensed(values, distance_type)
+
+        n = len(values)
+        digests = [DistanceCache.get_digest(value) for value in values]
+        cache_type = cls._get_cache_type(distance_type)
+
+        # The matrix is calculated for the distinct inputs, identical inputs have the distance 0
+        distinct_rows = dict()
+        for idx, digest in enumerate(digests):
+            distinct_rows.setdefault(digest, idx)
+        distinct_digests = list(distinct_rows)
+        distinct_values = [values[idx] for idx in distinct_rows.values()]
+        m = len(distinct_digests)
+
+        # A matrix which does not fit into the cache would evict itself (and every other entry) on each call
+        if m * (m - 1) // 2 > distance_cache.max_matrix_pairs:
+            if not cls._cache_size_warning_logged:
+                get_logger('Distance').warning(f'The distance cache holds matrices with at most '
+                                               f'{distance_cache.max_matrix_pairs} pairs, inputs with {m} distinct '
+                                               f'values are calculated without the cache '
+                                               f'(see distance_cache.max_matrix_pairs)')
+                cls._cache_size_warning_logged = True
+            return cls._calculate_condensed(values, distance_type)
+
+        matrix = np.zeros((m, m), dtype=np.float64)
+        is_known = np.zeros(m, dtype=bool)
+
+        # Take the distances between the inputs of the most similar earlier matrix
+        cached_matrix = distance_cache.get_matrix(cache_type, distinct_digests)
+        replaced_key = None
+        if cached_matrix is not None:
+            replaced_key, cached_rows, cached_distances = cached_matrix
+            known_rows = [row for row, digest in enumerate(distinct_digests) if digest in cached_rows]
+            cached_known_rows = [cached_rows[distinct_digests[row]] for row in known_rows]
+            matrix[np.ix_(known_rows, known_rows)] = cached_distances[np.ix_(cached_known_rows, cached_known_rows)]
+            is_known[known_rows] = True
+
+        if cached_matrix is None and not distance_cache.has_disk_tier():
+            # Nothing to look up: calculate all pairs directly (in the process pool for large inputs)
+            upper_rows, upper_columns = np.triu_indices(m, 1)
+            matrix[upper_rows, upper_columns] = cls._calculate_condensed(distinct_values, distance_type)
+            matrix[upper_columns, upper_rows] = matrix[upper_rows, upper_columns]
+        else:
+            # Only the pairs with a new input are looked up in the pair tiers and calculated if missing
+            known_rows = np.flatnonzero(is_known)
+            missing_pairs = []
+            for row in np.flatnonzero(~is_known):
+                missing_pairs.extend((int(row), int(column)) for column in known_rows)
+                missing_pairs.extend((int(row), column) for column in range(int(row) + 1, m) if not is_known[column])
+
+            pair_keys = [DistanceCache.get_key(cache_type, distinct_digests[row], distinct_digests[column])
+                         for row, column in missing_pairs]
+            distances_by_key = distance_cache.get_many(pair_keys)
+
+            uncached_pairs = [(pair, key) for pair, key in zip(missing_pairs, pair_keys) if key not in distances_by_key]
+            uncached_distances = cls._calculate_pairs(distinct_values, distance_type,
+                                                      [pair for pair, _ in uncached_pairs])
+            new_distances_by_key = {key: distance for (_, key), distance in zip(uncached_pairs, uncached_distances)}
+            distance_cache.put_many(new_distances_by_key)
+            distances_by_key.update(new_distances_by_key)
+
+            for (row, column), key in zip(missing_pairs, pair_keys):
+                matrix[row, column] = matrix[column, row] = distances_by_key[key]
+
+        distance_cache.put_matrix(cache_type, distinct_digests, matrix, replaced_key=replaced_key)
+
+        # Map the distinct matrix back to the (possibly repeated) inputs
+        distinct_positions = {digest: position for position, digest in enumerate(distinct_digests)}
+        distinct_idx = np.array([distinct_positions[digest] for digest in digests], dtype=np.intp)
+        upper_rows, upper_columns = np.triu_indices(n, 1)
+        return matrix[distinct_idx[upper_rows], distinct_idx[upper_columns]]
+
+    @classmethod
+    def _get_cache_type(cls, distance_type: str) -> str:
+        """
+        :return: The distance type including the options changing its values (part of the distance cache keys)
+        :rtype: str
+        """
+
+        if distance_type == 'levenshtein-bounded':
+            return f'{distance_type}:{cls.levenshtein_cutoff_ratio}:{cls.levenshtein_qgram_size}'
+        return distance_type
+
+    @classmethod
+    def _calculate_condensed(cls, values: list, distance_type: str) -> np.ndarray:
+        """
+        Calculates all pairs of the upper triangle without the cache
+        """
+
+        n = len(values)
+        parallel_min_samples, max_workers = cls._read_parallel_options()
+        worker_count = max_workers or os.cpu_count() or 1
+
+        if n < parallel_min_samples or worker_count < 2:
+            return _condensed_rows(values, distance_type, 0, n)
+
+        row_ranges = cls._split_rows(n, worker_count * 4)
+        with ProcessPoolExecutor(max_workers=worker_count) as executor:
+            futures = [executor.submit(_condensed_rows, values, distance_type, row_start, row_end)
+                       for row_start, row_end in row_ranges]
+            condensed_parts = [future.result() for future in futures]
+
+        if len(condensed_parts) == 0:
+            return np.empty(0, dtype=np.float64)
+        return np.concatenate(condensed_parts)
+
+    @classmethod
+    def _calculate_pairs(cls, values: list, distance_type: str, pairs: List[tuple], cutoffs: List[int] = None) -> List[float]:
+        """
+        Calculates the distances of arbitrary index pairs, in a process pool if there are as many pairs as in the
+        upper triangle of a matrix with the parallel sample threshold. With cutoffs, the levenshtein distance of every
+        pair is capped at its cutoff + 1 (the distance type is ignored).
+        """
+
+        parallel_min_samples, max_workers = cls._read_parallel_options()
+        worker_count = max_workers or os.cpu_count() or 1
+        parallel_min_pairs = parallel_min_samples * (parallel_min_samples - 1) // 2
+
+        if len(pairs) < max(parallel_min_pairs, 1) or worker_count < 2:
+            if cutoffs is not None:
+                return _bounded_levenshtein_pairs(dict(enumerate(values)), pairs, cutoffs)
+            return _pair_distances(dict(enumerate(values)), distance_type, pairs)
+
+        chunk_size = -(-len(pairs) // (worker_count * 4))
+        with ProcessPoolExecutor(max_workers=worker_count) as executor:
+            futures = []
+            for chunk_start in range(0, len(pairs), chunk_size):
+                chunk = pairs[chunk_start:chunk_start + chunk_size]
+                # Send only the inputs needed by the chunk
+                values_by_idx = {idx: values[idx] for pair in chunk for idx in pair}
+                if cutoffs is not None:
+                    futures.append(executor.submit(_bounded_levenshtein_pairs, values_by_idx, chunk,
+                                                   cutoffs[chunk_start:chunk_start + chunk_size]))
+                else:
+                    futures.append(executor.submit(_pair_distances, values_by_idx, distance_type, chunk))
+
+            distances = []
+            for future in futures:
+                distances.extend(future.result())
+        return distances
+
+    @staticmethod
+    def condensed_to_square(condensed_distances: np.ndarray, n: int) -> np.ndarray:
+        """
+        :param condensed_distances: The condensed distances (see :meth:`generate_condensed_distances`)
+        :type condensed_distances: numpy.ndarray
+
+        :param n: The count of samples
+        :type n: int
+
+        :return: The symmetric square distance matrix with a zero diagonal
+        :rtype: numpy.ndarray
+        """
+
+        distance_matrix = np.zeros((n, n), dtype=np.float64)
+        rows, columns = np.triu_indices(n, k=1)
+        distance_matrix[rows, columns] = condensed_distances
+        distance_matrix[columns, rows] = condensed_distances
+        return distance_matrix
+
+    @staticmethod
+    def _split_rows(n: int, chunk_count: int) -> List[tuple]:
+        """
+        Splits the rows of the upper triangle into contiguous ranges with about the same count of pairs
+        """
+
+        total_pairs = n * (n - 1) // 2
+        pairs_per_chunk = max(1, -(-total_pairs // max(chunk_count, 1)))
+
+        row_ranges = []
+        row_start = 0
+        pair_count = 0
+        for row in range(n - 1):
+            pair_count += n - row - 1
+            if pair_count >= pairs_per_chunk:
+                row_ranges.append((row_start, row + 1))
+                row_start = row + 1
+                pair_count = 0
+        if row_start < n - 1:
+            row_ranges.append((row_start, n - 1))
+        return row_ranges
+
+    @classmethod
+    def _read_parallel_options(cls) -> tuple:
+        config = get_config()
+        distance_section = config.get('distance') if config is not None else None
+        if not distance_section:
+            return cls.parallel_min_samples, cls.max_workers
+
+        parallel_min_samples = distance_section.get('parallel_min_samples')
+        max_workers = distance_section.get('max_workers')
+        return (cls.parallel_min_samples if parallel_min_samples is None else int(parallel_min_samples),
+                cls.max_workers if max_workers is None else int(max_workers))
+
     @classmethod
     def generate_distance_matrix(cls,
                                  data_query: List[dict],
                                  distance_type: str,
                                  field_for_index: str = None,
-                                 field_for_distance="hash"):
+                                 field_for_distance="hash",
+                                 output: str = 'dataframe'):
         """
         Generates a distance matrix for a given data query. The query is expected to be a dict and by default is searched
         for a 'hash' key, which is then used as an input for the distance calculation. The field can be changed using the
         field_for_distance parameter.
 
+        The field values are extracted once and only the upper triangle is calculated (all implemented distance types
+        are symmetric and zero for identical inputs).
+
         :param data_query: A list of dicts, which contain a 'hash' attribute
         :type data_query: List[dict]
 
@@ -82,55 +507,27 @@ class Distance:
         :param field_for_distance: Name of the key that will be used as input for the distance calculation
         :type field_for_distance: str or list
 
-        :return: A square matrix containing the pairwise distances.
-        :rtype: pandas.DataFrame
-        """
-        distance_matrix = []
-        interaction_ids = []
+        :param output: 'dataframe' (indexed by field_for_index), 'ndarray' (square matrix) or 'condensed' (upper triangle)
+        :type output: str
 
-        for query in tqdm(data_query):
-            # for query in data_query:
-            if field_for_index is not None:
-                interaction_id = str(query[field_for_index])
-                interaction_ids.append(interaction_id)
-
-            # OmegaConf parsed case: Cast ListConfig to List
-            if isinstance(field_for_distance, ListConfig):
-                field_for_distance = list(field_for_distance)
+        :return: The pairwise distances in the requested output format
+        :rtype: pandas.DataFrame or numpy.ndarray
+        """
 
-            # Parse field for distance if it's nested in the data query
-            if isinstance(field_for_distance, list):
-                keys = field_for_distance
-                sub_section = query
-                for key in keys:
-                    sub_section = sub_section[key]
-                data_for_distance_calculation = sub_section
-            elif isinstance(field_for_distance, str):
-                data_for_distance_calculation = query[field_for_distance]
-            else:
-                raise TypeError("field_for_distance must be str or list")
-
-            current_distance_array = []
-            for secondary_interaction_query in data_query:
-
-                if isinstance(field_for_distance, list):
-                    sub_section = secondary_interaction_query
-                    for key in keys:
-                        sub_section = sub_section[key]
-                    secondary_data_for_distance_calculation = sub_section
-                elif isinstance(field_for_distance, str):
-                    secondary_data_for_distance_calculation = secondary_interaction_query[field_for_distance]
-                else:
-                    raise TypeError("field_for_distance must be str or list")
+        values = cls.extract_field_values(data_query, field_for_distance)
+        condensed_distances = cls.generate_condensed_distances(values, distance_type)
 
-                distance = cls.calculate(input1=data_for_distance_calculation,
-                                         input2=secondary_data_for_distance_calculation,
-                                         distance_type=distance_type)
+        if output == 'condensed':
+            return condensed_distances
 
-                current_distance_array.append(distance)
-            distance_matrix.append(current_distance_array)
+        distance_matrix = cls.condensed_to_square(condensed_distances, len(values))
+        if output == 'ndarray':
+            return distance_matrix
+        elif output != 'dataframe':
+            raise ValueError(f'Unknown output {output}. Please select one of the following: dataframe, ndarray, condensed')
 
         if field_for_index is not None:
+            interaction_ids = [str(query[field_for_index]) for query in data_query]
             distance_matrix = DataFrame(distance_matrix, columns=interaction_ids, index=interaction_ids)
         else:
             distance_matrix = DataFrame(distance_matrix)
@@ -143,6 +540,95 @@ class Distance:
     def _jaro_winkler_inverted(cls, hash1, hash2):
         return 1 - textdistance.jaro_winkler(hash1, hash2)
 
+    # Single pairs of 'levenshtein-bounded' (e.g. the queries of the metric index), which only cap the distance: a
+    # single pair has no column scale, so the cutoff is the share of the longer input. As the levenshtein distance of
+    # similar pages is far below that share, this rarely skips work; the matrices use the tighter cutoffs of
+    # _levenshtein_bounded_condensed. Capped distances are cutoff + 1, which is also what Levenshtein returns when the
+    # score cutoff is exceeded.
+    @classmethod
+    def _levenshtein_bounded(cls, input1, input2):
+        max_length = max(len(input1), len(input2))
+        cutoff = math.ceil(cls.levenshtein_cutoff_ratio * max_length)
+
+        # Every edit changes the length by at most one
+        if abs(len(input1) - len(input2)) > cutoff:
+            return cutoff + 1
+
+        # Every edit changes at most q q-grams in each input (Ukkonen's q-gram lemma)
+        q = cls.levenshtein_qgram_size
+        if min(len(input1), len(input2)) >= q:
+            profile1 = _qgram_profile(input1, q)
+            profile2 = _qgram_profile(input2, q)
+            qgram_difference = sum(((profile1 - profile2) + (profile2 - profile1)).values())
+            if qgram_difference > 2 * q * cutoff:
+                return cutoff + 1
+
+        return Levenshtein.distance(input1, input2, score_cutoff=cutoff)
+
+    @classmethod
+    def _levenshtein_bounded_condensed(cls, values: list) -> np.ndarray:
+        """
+        The condensed 'levenshtein-bounded' distances of a clustering input. The distance matrix is min-max scaled per
+        column before the clustering, and the eps candidates go up to levenshtein_cutoff_ratio (0.9) of the scaled
+        distances, so only the distances up to that share of a column maximum decide whether two inputs are
+        neighbours.
+
+        The column maxima are estimated with a cheap pass: for every input, the exact distance to the input with the
+        largest lower bound (length and q-gram difference) is calculated. The cutoff of a pair is the ratio of the
+        larger estimate of its two columns. Pairs whose lower bound is above the cutoff are not calculated, all other
+        pairs are calculated with the cutoff as score cutoff (so the banded levenshtein stops early). Distances above
+        the cutoff are returned as cutoff + 1. They are exact up to the cutoff; if an estimate is below the real column
+        maximum, capped distances can change the scale of their column.
+
+        :raises ValueError: If the inputs are not strings (they are then calculated with :meth:`_levenshtein_bounded`)
+        """
+
+        if not all(isinstance(value, str) for value in values):
+            raise ValueError('levenshtein-bounded matrices require string inputs')
+
+        n = len(values)
+        if n < 2:
+            return np.empty(0, dtype=np.float64)
+
+        lower_bounds = _levenshtein_lower_bounds(values, cls.levenshtein_qgram_size)
+        square_lower_bounds = cls.condensed_to_square(lower_bounds.astype(np.float64), n)
+        np.fill_diagonal(square_lower_bounds, -1)
+
+        # Exact distance to the input that is probably the farthest of every column
+        farthest = np.argmax(square_lower_bounds, axis=1)
+        anchor_pairs = sorted({(min(row, int(column)), max(row, int(column))) for row, column in enumerate(farthest)})
+        anchor_distances = cls._calculate_pairs(values, 'levenshtein', anchor_pairs)
+
+        column_maxima = np.zeros(n, dtype=np.float64)
+        for (row, column), distance in zip(anchor_pairs, anchor_distances):
+            column_maxima[row] = max(column_maxima[row], distance)
+            column_maxima[column] = max(column_maxima[column], distance)
+
+        upper_rows, upper_columns = np.triu_indices(n, 1)
+        cutoffs = np.ceil(cls.levenshtein_cutoff_ratio * np.maximum(column_maxima[upper_rows],
+                                                                    column_maxima[upper_columns])).astype(np.int64)
+
+        # Capped without calculation where the lower bound already exceeds the cutoff
+        distances = np.where(lower_bounds > cutoffs, cutoffs + 1, 0).astype(np.float64)
+
+        # Condensed position of a pair (row < column), see scipy.spatial.distance.squareform
+        def condensed_position(row, column):
+            return n * row - row * (row + 1) // 2 + column - row - 1
+
+        is_anchor = np.zeros(len(distances), dtype=bool)
+        for (row, column), distance in zip(anchor_pairs, anchor_distances):
+            position = condensed_position(row, column)
+            distances[position] = distance
+            is_anchor[position] = True
+
+        to_calculate = np.flatnonzero((lower_bounds <= cutoffs) & ~is_anchor)
+        calculated = cls._calculate_pairs(values, 'levenshtein',
+                                          list(zip(upper_rows[to_calculate].tolist(),
+                                                   upper_columns[to_calculate].tolist())),
+                                          cutoffs=cutoffs[to_calculate].tolist())
+        distances[to_calculate] = calculated
+        return distances
+
     # MLIPNS seems also to be a similarity metric
     # Paper: https://www.sial.iias.spb.su/files/386-386-1-PB.pdf
     @classmethod
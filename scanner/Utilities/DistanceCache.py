@@ -0,0 +1,275 @@
+import hashlib
+import os
+import sqlite3
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List
+
+import numpy as np
+
+from scanner.Utilities.Util import get_config
+
+
+class DistanceCache:
+    """
+    A cache of pairwise distances keyed by (distance type, digest of the first input, digest of the second input).
+    The pairs are stored in a normalized order (smaller digest first), as the distance types are symmetric.
+
+    The cache has an in-process LRU tier and an optional SQLite tier, which is shared by all processes using the same
+    file (e.g. consecutive runs and experiments on the same app).
+
+    Additionally, the distance matrices of the distinct inputs of recent calls are kept (see :meth:`get_matrix`), so
+    that an input which shares most of its items with an earlier one (e.g. a similarity group that grew by one item)
+    only needs the pairs of its new items. The matrices are bounded separately by their count of pairs, as they take
+    far less memory per pair than the LRU tier.
+    """
+
+    # The SQLite IN clause is split into chunks to stay below the variable limit of older SQLite versions
+    _sqlite_chunk_size = 500
+
+    # Count of the most recently used matrices that are compared with the inputs of a call
+    _matrix_candidates = 16
+
+    _instances = dict()
+    _instances_lock = Lock()
+
+    def __init__(self, max_entries: int = 200000, sqlite_path: str = None, max_matrix_pairs: int = 2000000):
+        """
+        :param max_entries: Maximum count of distances in the in-process tier
+        :type max_entries: int
+
+        :param max_matrix_pairs: Maximum count of pairs of all kept matrices
+        :type max_matrix_pairs: int
+
+        :param sqlite_path: Path of the SQLite file of the on-disk tier (no on-disk tier if None)
+        :type sqlite_path: str
+        """
+
+        self._max_entries = max_entries
+        self._max_matrix_pairs = max_matrix_pairs
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+        # Matrices mapped by a running key: (distance type, row of every digest, square matrix)
+        self._matrices = OrderedDict()
+        self._matrix_pairs = 0
+        self._next_matrix_key = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._connection = None
+        if sqlite_path:
+            self._connection = sqlite3.connect(sqlite_path, check_same_thread=False, timeout=30)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS distances (key TEXT PRIMARY KEY, distance REAL)')
+            self._connection.commit()
+
+    @staticmethod
+    def get_digest(value) -> str:
+        """
+        :param value: An input of the distance calculation
+        :type value: Any
+
+        :return: The blake2b digest of the input
+        :rtype: str
+        """
+
+        if isinstance(value, bytes):
+            data = value
+        else:
+            data = str(value).encode('utf-8')
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    @property
+    def max_matrix_pairs(self) -> int:
+        return self._max_matrix_pairs
+
+    def has_disk_tier(self) -> bool:
+        return self._connection is not None
+
+    @staticmethod
+    def get_key(distance_type: str, digest1: str, digest2: str) -> str:
+        """
+        :return: The order normalized key of a pair
+        :rtype: str
+        """
+
+        if digest2 < digest1:
+            digest1, digest2 = digest2, digest1
+        return f'{distance_type}|{digest1}|{digest2}'
+
+    def get_many(self, keys: List[str]) -> Dict[str, float]:
+        """
+        Looks up distances in the in-process tier and then the missing ones in the on-disk tier
+
+        :param keys: Keys created with :meth:`get_key`
+        :type keys: List[str]
+
+        :return: The cached distances mapped by key (missing keys are skipped)
+        :rtype: Dict[str, float]
+        """
+
+        found = dict()
+        missing_keys = []
+        with self._lock:
+            for key in keys:
+                distance = self._entries.get(key)
+                if distance is None:
+                    missing_keys.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    found[key] = distance
+
+        if self._connection is not None and len(missing_keys) > 0:
+            disk_found = self._get_many_from_disk(missing_keys)
+            found.update(disk_found)
+            self._put_many_in_memory(disk_found)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def put_many(self, distances: Dict[str, float]):
+        """
+        Stores distances in both tiers
+
+        :param distances: The distances mapped by key (see :meth:`get_key`)
+        :type distances: Dict[str, float]
+        """
+
+        if len(distances) == 0:
+            return
+
+        self._put_many_in_memory(distances)
+
+        if self._connection is not None:
+            with self._lock:
+                self._connection.executemany('INSERT OR IGNORE INTO distances (key, distance) VALUES (?, ?)',
+                                             [(key, float(distance)) for key, distance in distances.items()])
+                self._connection.commit()
+
+    def _put_many_in_memory(self, distances: Dict[str, float]):
+        with self._lock:
+            for key, distance in distances.items():
+                self._entries[key] = float(distance)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_many_from_disk(self, keys: List[str]) -> Dict[str, float]:
+        found = dict()
+        with self._lock:
+            for chunk_start in range(0, len(keys), self._sqlite_chunk_size):
+                chunk = keys[chunk_start:chunk_start + self._sqlite_chunk_size]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._connection.execute(f'SELECT key, distance FROM distances WHERE key IN ({placeholders})',
+                                                chunk)
+                for key, distance in rows:
+                    found[key] = distance
+        return found
+
+    def get_matrix(self, distance_type: str, digests: List[str]):
+        """
+        :param distance_type: The distance type (including its options)
+        :type distance_type: str
+
+        :param digests: Digests of distinct inputs
+        :type digests: List[str]
+
+        :return: The key, the row of every digest and the square distance matrix of the recent matrix sharing the most
+                 inputs with the given digests (None if no recent matrix of the distance type shares any input)
+        :rtype: tuple
+        """
+
+        best_entry = None
+        best_overlap = 0
+        with self._lock:
+            recent_keys = list(reversed(self._matrices))[:self._matrix_candidates]
+            for matrix_key in recent_keys:
+                matrix_distance_type, rows, matrix = self._matrices[matrix_key]
+                if matrix_distance_type != distance_type:
+                    continue
+                overlap = sum(1 for digest in digests if digest in rows)
+                if overlap > best_overlap:
+                    best_entry = (matrix_key, rows, matrix)
+                    best_overlap = overlap
+                    if overlap == len(digests):
+                        break
+
+            if best_entry is not None:
+                self._matrices.move_to_end(best_entry[0])
+        return best_entry
+
+    def put_matrix(self, distance_type: str, digests: List[str], matrix: np.ndarray, replaced_key: int = None):
+        """
+        Stores the distance matrix of distinct inputs (the least recently used matrices are dropped if the matrices
+        hold more than the max matrix pairs)
+
+        :param distance_type: The distance type (including its options)
+        :type distance_type: str
+
+        :param digests: Digests of the distinct inputs in the row order of the matrix
+        :type digests: List[str]
+
+        :param matrix: The square distance matrix
+        :type matrix: numpy.ndarray
+
+        :param replaced_key: Key of a matrix which is replaced (e.g. the one the new matrix was extended from)
+        :type replaced_key: int
+        """
+
+        rows = {digest: row for row, digest in enumerate(digests)}
+        with self._lock:
+            if replaced_key is not None and replaced_key in self._matrices:
+                self._matrix_pairs -= self._get_pair_count(self._matrices.pop(replaced_key)[2])
+
+            matrix_key = self._next_matrix_key
+            self._next_matrix_key += 1
+            self._matrices[matrix_key] = (distance_type, rows, matrix)
+            self._matrix_pairs += self._get_pair_count(matrix)
+
+            while self._matrix_pairs > self._max_matrix_pairs and len(self._matrices) > 0:
+                self._matrix_pairs -= self._get_pair_count(self._matrices.popitem(last=False)[1][2])
+
+    @staticmethod
+    def _get_pair_count(matrix: np.ndarray) -> int:
+        return matrix.shape[0] * (matrix.shape[0] - 1) // 2
+
+    def get_stats(self) -> dict:
+        """
+        :return: The hit and miss counters, the size of the in-process tier and the count and pairs of the matrices
+        :rtype: dict
+        """
+
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries),
+                    'matrices': len(self._matrices), 'matrix_pairs': self._matrix_pairs}
+
+    @classmethod
+    def get_instance(cls):
+        """
+        :return: The cache of the current process as configured in the 'distance_cache' config section
+                 (None if the cache is disabled)
+        :rtype: DistanceCache
+        """
+
+        config = get_config()
+        cache_section = (config.get('distance_cache') if config is not None else None) or dict()
+        if not cache_section.get('enabled', True):
+            return None
+
+        max_entries = int(cache_section.get('max_entries') or 200000)
+        max_matrix_pairs = int(cache_section.get('max_matrix_pairs') or 2000000)
+        sqlite_path = cache_section.get('sqlite_path') or None
+
+        # SQLite connections must not be shared across forked processes, so the pid is part of the key
+        key = (os.getpid(), max_entries, max_matrix_pairs, sqlite_path)
+        with cls._instances_lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = DistanceCache(max_entries=max_entries, sqlite_path=sqlite_path,
+                                         max_matrix_pairs=max_matrix_pairs)
+                cls._instances[key] = instance
+        return instance
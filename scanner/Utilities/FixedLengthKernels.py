@@ -0,0 +1,229 @@
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+# Pairs compared at once, which bounds the memory of the (pairs x length) arrays
+_PAIR_BLOCK_SIZE = 4096
+
+# Options of textdistance.mlipns
+MLIPNS_THRESHOLD = 0.25
+MLIPNS_MAX_MISMATCHES = 2
+
+JARO_WINKLER_PREFIX_WEIGHT = 0.1
+JARO_WINKLER_MAX_PREFIX = 4
+
+
+class VariableLengthInputs(ValueError):
+    """
+    Thrown when the inputs of a fixed-length kernel are not all strings of the same length.
+    """
+    pass
+
+
+def to_char_array(values: List) -> np.ndarray:
+    """
+    :param values: Strings of the same length (e.g. TLSH hashes)
+    :type values: List
+
+    :return: One string per row, as uint8 if all strings are ASCII and as uint32 code points otherwise
+    :rtype: numpy.ndarray (shape n x length)
+
+    :raises VariableLengthInputs: If the inputs are not strings of the same length
+    """
+
+    if len(values) == 0:
+        return np.empty((0, 0), dtype=np.uint8)
+
+    if not all(isinstance(value, str) for value in values):
+        raise VariableLengthInputs('The fixed-length kernels only support strings')
+
+    length = len(values[0])
+    if any(len(value) != length for value in values):
+        raise VariableLengthInputs('The inputs do not have the same length')
+
+    joined_values = ''.join(values)
+    try:
+        chars = np.frombuffer(joined_values.encode('ascii'), dtype=np.uint8)
+    except UnicodeEncodeError:
+        chars = np.frombuffer(joined_values.encode('utf-32-le'), dtype=np.uint32)
+    return chars.reshape(len(values), length)
+
+
+def _iterate_pair_blocks(n: int, block_size: int = _PAIR_BLOCK_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Yields the (row, column) index pairs of the upper triangle in the row-major order of
+    :func:`scipy.spatial.distance.squareform`, in blocks of whole rows with about the given count of pairs
+    """
+
+    row_start = 0
+    while row_start < n - 1:
+        row_end = row_start
+        pair_count = 0
+        while row_end < n - 1 and (pair_count == 0 or pair_count + n - row_end - 1 <= block_size):
+            pair_count += n - row_end - 1
+            row_end += 1
+
+        block_rows = np.arange(row_start, row_end)
+        row_lengths = n - block_rows - 1
+        rows = np.repeat(block_rows, row_lengths)
+        # Offset of every pair within its row
+        row_offsets = np.arange(pair_count) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+        yield rows, rows + 1 + row_offsets
+
+        row_start = row_end
+
+
+def _condensed(chars: np.ndarray, block_function) -> np.ndarray:
+    n = chars.shape[0]
+    if n < 2:
+        return np.empty(0, dtype=np.float64)
+
+    return np.concatenate([block_function(chars[rows], chars[columns])
+                           for rows, columns in _iterate_pair_blocks(n)]).astype(np.float64)
+
+
+def _hamming_block(chars1: np.ndarray, chars2: np.ndarray) -> np.ndarray:
+    return (chars1 != chars2).sum(axis=1)
+
+
+def _mlipns_block(chars1: np.ndarray, chars2: np.ndarray) -> np.ndarray:
+    length = chars1.shape[1]
+    hamming = _hamming_block(chars1, chars2)
+
+    # textdistance.mlipns is 1 if the hamming distance is within the threshold after ignoring up to max mismatches.
+    # Every ignored mismatch also shortens the length, and it is 1 as well once no length is left (including after the
+    # last ignored mismatch), so values of at most max mismatches + 1 chars are always similar.
+    if length <= MLIPNS_MAX_MISMATCHES + 1:
+        return np.zeros(len(hamming), dtype=np.float64)
+
+    similarity = np.zeros(len(hamming), dtype=np.float64)
+    for mismatches in range(MLIPNS_MAX_MISMATCHES + 1):
+        similarity[(hamming - mismatches) / (length - mismatches) <= MLIPNS_THRESHOLD] = 1
+
+    similarity[hamming == 0] = 1
+    return 1 - similarity
+
+
+def _jaro_winkler_block(chars1: np.ndarray, chars2: np.ndarray) -> np.ndarray:
+    pair_count, length = chars1.shape
+    if length == 0:
+        return np.zeros(pair_count, dtype=np.float64)
+
+    search_range = max(length // 2 - 1, 0)
+
+    # The char positions are the first axis, so that each position of all pairs is contiguous
+    positions1 = np.ascontiguousarray(chars1.T)
+    positions2 = np.ascontiguousarray(chars2.T)
+
+    # Greedy matching of textdistance: every char of the first input takes the first unmatched equal char of the second
+    # input within the search range
+    flags1 = np.zeros((length, pair_count), dtype=bool)
+    flags2 = np.zeros((length, pair_count), dtype=bool)
+    for idx1 in range(length):
+        unmatched = np.ones(pair_count, dtype=bool)
+        for idx2 in range(max(0, idx1 - search_range), min(idx1 + search_range, length - 1) + 1):
+            matches = unmatched & ~flags2[idx2] & (positions2[idx2] == positions1[idx1])
+            flags2[idx2] |= matches
+            flags1[idx1] |= matches
+            unmatched &= ~matches
+    common_chars = flags1.sum(axis=0)
+
+    # Transpositions: the matched chars of both inputs are compared in their order
+    matched_chars1 = np.take_along_axis(positions1, np.argsort(~flags1, axis=0, kind='stable'), axis=0)
+    matched_chars2 = np.take_along_axis(positions2, np.argsort(~flags2, axis=0, kind='stable'), axis=0)
+    is_matched_position = np.arange(length)[:, None] < common_chars[None, :]
+    transpositions = ((matched_chars1 != matched_chars2) & is_matched_position).sum(axis=0) // 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = (common_chars / length + common_chars / length + (common_chars - transpositions) / common_chars) / 3
+    weight = np.where(common_chars == 0, 0.0, weight)
+
+    # Winkler modification for a common prefix of up to 4 chars (only for similar inputs)
+    prefix_length = np.cumprod(chars1[:, :JARO_WINKLER_MAX_PREFIX] == chars2[:, :JARO_WINKLER_MAX_PREFIX],
+                               axis=1).sum(axis=1)
+    weight = np.where(weight > 0.7, weight + prefix_length * JARO_WINKLER_PREFIX_WEIGHT * (1.0 - weight), weight)
+
+    similarity = np.where((chars1 == chars2).all(axis=1), 1.0, weight)
+    return 1 - similarity
+
+
+def _damerau_levenshtein_block(chars1: np.ndarray, chars2: np.ndarray) -> np.ndarray:
+    pair_count, length = chars1.shape
+    if length == 0:
+        return np.zeros(pair_count, dtype=np.int32)
+
+    positions1 = np.ascontiguousarray(chars1.T)
+    positions2 = np.ascontiguousarray(chars2.T)
+
+    # The optimal string alignment distance of textdistance.damerau_levenshtein. The padded matrix holds d[i][j] of all
+    # pairs at [i + 1, j + 1]; all cells of an anti-diagonal only depend on the previous ones, so a whole anti-diagonal
+    # of all pairs is calculated at once.
+    dtype = np.int16 if length < np.iinfo(np.int16).max else np.int32
+    distances = np.zeros((length + 1, length + 1, pair_count), dtype=dtype)
+    distances[0, :, :] = np.arange(length + 1)[:, None]
+    distances[:, 0, :] = np.arange(length + 1)[:, None]
+
+    for diagonal in range(2 * length - 1):
+        idx1 = np.arange(max(0, diagonal - length + 1), min(diagonal, length - 1) + 1)
+        idx2 = diagonal - idx1
+
+        cost = (positions1[idx1] != positions2[idx2]).astype(dtype)
+        cell = np.minimum(np.minimum(distances[idx1, idx2 + 1] + 1,
+                                     distances[idx1 + 1, idx2] + 1),
+                          distances[idx1, idx2] + cost)
+
+        can_transpose = (idx1 > 0) & (idx2 > 0)
+        if can_transpose.any():
+            t_idx1 = idx1[can_transpose]
+            t_idx2 = idx2[can_transpose]
+            is_transposition = ((positions1[t_idx1] == positions2[t_idx2 - 1]) &
+                                (positions1[t_idx1 - 1] == positions2[t_idx2]))
+            transposed = np.where(is_transposition,
+                                  distances[t_idx1 - 1, t_idx2 - 1] + cost[can_transpose],
+                                  cell[can_transpose])
+            cell[can_transpose] = np.minimum(cell[can_transpose], transposed)
+
+        distances[idx1 + 1, idx2 + 1] = cell
+
+    return distances[length, length]
+
+
+def hamming_condensed(values: List) -> np.ndarray:
+    """
+    The vectorized condensed distances of textdistance.hamming for strings of the same length
+
+    :raises VariableLengthInputs: If the inputs are not strings of the same length
+    """
+
+    return _condensed(to_char_array(values), _hamming_block)
+
+
+def mlipns_inverted_condensed(values: List) -> np.ndarray:
+    """
+    The vectorized condensed distances of 1 - textdistance.mlipns for strings of the same length
+
+    :raises VariableLengthInputs: If the inputs are not strings of the same length
+    """
+
+    return _condensed(to_char_array(values), _mlipns_block)
+
+
+def jaro_winkler_inverted_condensed(values: List) -> np.ndarray:
+    """
+    The vectorized condensed distances of 1 - textdistance.jaro_winkler for strings of the same length
+
+    :raises VariableLengthInputs: If the inputs are not strings of the same length
+    """
+
+    return _condensed(to_char_array(values), _jaro_winkler_block)
+
+
+def damerau_levenshtein_condensed(values: List) -> np.ndarray:
+    """
+    The vectorized condensed distances of textdistance.damerau_levenshtein (optimal string alignment) for strings of
+    the same length
+
+    :raises VariableLengthInputs: If the inputs are not strings of the same length
+    """
+
+    return _condensed(to_char_array(values), _damerau_levenshtein_block)
@@ -0,0 +1,82 @@
+from typing import List
+
+import numpy as np
+
+# Field of the stored vectors on interactions, endpoints and states
+HASH2VEC_FIELD = 'hash2vec'
+
+# The hash chars are '0'-'9' (48-57) and 'A'-'Z' (65-90). The letters are shifted next to the digits, so that the
+# codes span 48-83, which is scaled to [0, 1].
+_FIRST_CODE = 48
+_LETTER_SHIFT = 7
+_CODE_RANGE = 83 - 48
+
+
+def get_hash_codes(hashes: List[str]) -> np.ndarray:
+    """
+    :param hashes: Hashes of the same length
+    :type hashes: List[str]
+
+    :return: The ASCII codes of the hash chars (one hash per row)
+    :rtype: numpy.ndarray (uint8, shape n x length)
+
+    :raises ValueError: If the hashes do not have the same length or contain non ASCII chars
+    """
+
+    if len(hashes) == 0:
+        return np.empty((0, 0), dtype=np.uint8)
+
+    length = len(hashes[0])
+    if any(len(hash_value) != length for hash_value in hashes):
+        raise ValueError('hash2vec requires hashes of the same length')
+
+    return np.frombuffer(''.join(hashes).encode('ascii'), dtype=np.uint8).reshape(len(hashes), length)
+
+
+def hash2vec_matrix(hashes: List[str]) -> np.ndarray:
+    """
+    :param hashes: Hashes of the same length
+    :type hashes: List[str]
+
+    :return: The normalized hash2vec vectors (one hash per row)
+    :rtype: numpy.ndarray (float32, shape n x length)
+
+    :raises ValueError: If the hashes do not have the same length or contain non ASCII chars
+    """
+
+    codes = get_hash_codes(hashes).astype(np.float32)
+    codes = np.where(codes >= _FIRST_CODE + 10, codes - _LETTER_SHIFT, codes)
+    return (codes - _FIRST_CODE) / np.float32(_CODE_RANGE)
+
+
+def pack_hash2vec(hash_value: str) -> bytes:
+    """
+    :param hash_value: A hash
+    :type hash_value: str
+
+    :return: The normalized vector of the hash as little endian float32 entries
+    :rtype: bytes
+    """
+
+    return hash2vec_matrix([hash_value])[0].astype('<f4').tobytes()
+
+
+def hash2vec_rows(data_query: List[dict]) -> np.ndarray:
+    """
+    Loads the stored vectors of a data query. If an entry has no stored vector (e.g. it was stored by an older version),
+    all vectors are calculated from the 'hash' fields.
+
+    :param data_query: A list of dicts with a 'hash' and optionally a 'hash2vec' field
+    :type data_query: List[dict]
+
+    :return: The normalized hash2vec vectors (one entry per row)
+    :rtype: numpy.ndarray (float32, shape n x length)
+    """
+
+    stored_vectors = [query.get(HASH2VEC_FIELD) for query in data_query]
+    if len(data_query) > 0 and all(isinstance(vector, bytes) for vector in stored_vectors):
+        vector_length = len(stored_vectors[0])
+        if all(len(vector) == vector_length for vector in stored_vectors):
+            return np.frombuffer(b''.join(stored_vectors), dtype='<f4').reshape(len(data_query), -1).astype(np.float32)
+
+    return hash2vec_matrix([query['hash'] for query in data_query])
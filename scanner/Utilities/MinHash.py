@@ -0,0 +1,251 @@
+from threading import Lock
+from typing import Iterable, List, Set, Tuple
+
+import numpy as np
+
+from scanner.Utilities.Util import get_config
+
+# Multiplier of the polynomial rolling hash of the shingles (computed with wrapping uint64 arithmetic)
+_SHINGLE_HASH_BASE = np.uint64(1099511628211)
+_MAX_HASH = np.uint32(0xFFFFFFFF)
+
+# Shingle hashes mixed per permutation at once, which bounds the memory used for large bodies
+_SHINGLE_CHUNK_SIZE = 8192
+
+
+class MinHasher:
+    """
+    Creates MinHash signatures of texts: The text is split into overlapping byte shingles, and for each of the k hash
+    permutations the minimal hash of all shingles is kept. The share of unequal signature entries estimates the
+    Jaccard distance of the shingle sets.
+
+    The permutations are derived from a fixed seed, so signatures created by different processes and runs are
+    comparable as long as the permutation count, shingle size and seed are the same.
+    """
+
+    _instances = dict()
+    _instances_lock = Lock()
+
+    def __init__(self, num_permutations: int = 128, shingle_size: int = 5, seed: int = 1):
+        """
+        :param num_permutations: Count of hash permutations (the signature length)
+        :type num_permutations: int
+
+        :param shingle_size: Count of bytes per shingle
+        :type shingle_size: int
+
+        :param seed: Seed of the permutations
+        :type seed: int
+        """
+
+        self.num_permutations = num_permutations
+        self.shingle_size = shingle_size
+
+        random_state = np.random.RandomState(seed)
+        # Odd multipliers keep the permutations bijective on the uint64 hashes
+        self._multipliers = (random_state.randint(1, 2 ** 62, size=num_permutations, dtype=np.int64)
+                             .astype(np.uint64) | np.uint64(1))
+        self._increments = random_state.randint(0, 2 ** 62, size=num_permutations, dtype=np.int64).astype(np.uint64)
+
+    def _hash_shingles(self, text: str) -> np.ndarray:
+        data = np.frombuffer(text.encode('utf-8'), dtype=np.uint8).astype(np.uint64)
+        if len(data) == 0:
+            return np.empty(0, dtype=np.uint64)
+
+        # Texts shorter than a shingle are a single shingle
+        shingle_size = min(self.shingle_size, len(data))
+        shingle_count = len(data) - shingle_size + 1
+
+        hashes = np.zeros(shingle_count, dtype=np.uint64)
+        with np.errstate(over='ignore'):
+            for offset in range(shingle_size):
+                hashes = hashes * _SHINGLE_HASH_BASE + data[offset:offset + shingle_count]
+        return np.unique(hashes)
+
+    def signature(self, text: str) -> bytes:
+        """
+        :param text: The input text (e.g. a response body)
+        :type text: str
+
+        :return: The signature as little endian uint32 entries (all entries are 0xFFFFFFFF for an empty text)
+        :rtype: bytes
+        """
+
+        signature = np.full(self.num_permutations, _MAX_HASH, dtype=np.uint32)
+        shingle_hashes = self._hash_shingles(text)
+
+        with np.errstate(over='ignore'):
+            for chunk_start in range(0, len(shingle_hashes), _SHINGLE_CHUNK_SIZE):
+                chunk = shingle_hashes[chunk_start:chunk_start + _SHINGLE_CHUNK_SIZE]
+                permuted = self._multipliers[:, None] * chunk[None, :] + self._increments[:, None]
+                # The high bits of the multiplicative hash are the well mixed ones
+                chunk_minimum = (permuted >> np.uint64(32)).astype(np.uint32).min(axis=1)
+                np.minimum(signature, chunk_minimum, out=signature)
+
+        return signature.astype('<u4').tobytes()
+
+    def to_signatures(self, values: Iterable) -> np.ndarray:
+        """
+        :param values: Signatures (bytes) or texts, which are hashed
+        :type values: Iterable
+
+        :return: One signature per row
+        :rtype: numpy.ndarray (uint32, shape n x k)
+
+        :raises ValueError: If a signature does not have k entries or a value is neither bytes nor str
+        """
+
+        rows = []
+        for value in values:
+            if isinstance(value, str):
+                value = self.signature(value)
+            if not isinstance(value, (bytes, bytearray)):
+                raise ValueError(f'Can not use {type(value)} as MinHash input')
+            if len(value) != self.num_permutations * 4:
+                raise ValueError(f'A MinHash signature must have {self.num_permutations} entries')
+            rows.append(np.frombuffer(bytes(value), dtype='<u4'))
+
+        if len(rows) == 0:
+            return np.empty((0, self.num_permutations), dtype=np.uint32)
+        return np.vstack(rows).astype(np.uint32)
+
+    @classmethod
+    def get_instance(cls, minhash_section=None) -> 'MinHasher':
+        """
+        :param minhash_section: The 'minhash' config section (the section of the global config if None)
+        :type minhash_section: dict
+
+        :return: The hasher configured in the 'minhash' config section
+        :rtype: MinHasher
+        """
+
+        if minhash_section is None:
+            minhash_section = get_minhash_section()
+        num_permutations = int(minhash_section.get('num_permutations') or 128)
+        shingle_size = int(minhash_section.get('shingle_size') or 5)
+        seed = int(minhash_section.get('seed') or 1)
+
+        key = (num_permutations, shingle_size, seed)
+        with cls._instances_lock:
+            instance = cls._instances.get(key)
+            if instance is None:
+                instance = MinHasher(num_permutations=num_permutations, shingle_size=shingle_size, seed=seed)
+                cls._instances[key] = instance
+        return instance
+
+
+class MinHashLSHIndex:
+    """
+    A banding index of MinHash signatures: The signature is split into bands and items sharing all entries of at least
+    one band are candidate neighbours. Pairs with an estimated Jaccard similarity s become candidates with a
+    probability of 1 - (1 - s^r)^b (b bands of r rows), so similar pairs are found without comparing all pairs.
+    """
+
+    def __init__(self, bands: int = 32):
+        """
+        :param bands: Count of bands (must divide the signature length)
+        :type bands: int
+        """
+
+        self._bands = bands
+        self._buckets = [dict() for _ in range(bands)]
+
+    def _get_band_keys(self, signature: np.ndarray) -> List[bytes]:
+        if len(signature) % self._bands != 0:
+            raise ValueError(f'The signature length {len(signature)} is not divisible by {self._bands} bands')
+        return [band.tobytes() for band in np.split(signature, self._bands)]
+
+    def insert(self, item_id, signature: np.ndarray):
+        """
+        :param item_id: Id of the item (returned by the queries)
+        :type item_id: Any
+
+        :param signature: A signature row (see :meth:`MinHasher.to_signatures`)
+        :type signature: numpy.ndarray
+        """
+
+        for buckets, band_key in zip(self._buckets, self._get_band_keys(signature)):
+            buckets.setdefault(band_key, []).append(item_id)
+
+    def query(self, signature: np.ndarray) -> Set:
+        """
+        :param signature: A signature row
+        :type signature: numpy.ndarray
+
+        :return: Ids of the items sharing at least one band with the signature
+        :rtype: Set
+        """
+
+        candidates = set()
+        for buckets, band_key in zip(self._buckets, self._get_band_keys(signature)):
+            candidates.update(buckets.get(band_key, ()))
+        return candidates
+
+    def candidate_pairs(self) -> Set[Tuple]:
+        """
+        :return: All pairs of items sharing at least one band, as (smaller id, larger id)
+        :rtype: Set[Tuple]
+        """
+
+        pairs = set()
+        for buckets in self._buckets:
+            for item_ids in buckets.values():
+                for idx, item_id1 in enumerate(item_ids):
+                    for item_id2 in item_ids[idx + 1:]:
+                        pairs.add((min(item_id1, item_id2), max(item_id1, item_id2)))
+        return pairs
+
+
+def get_minhash_section() -> dict:
+    config = get_config()
+    return (config.get('minhash') if config is not None else None) or dict()
+
+
+def minhash_distance(input1, input2) -> float:
+    """
+    :param input1: A signature (bytes) or text
+    :param input2: A signature (bytes) or text
+
+    :return: The estimated Jaccard distance
+    :rtype: float
+    """
+
+    signatures = MinHasher.get_instance().to_signatures([input1, input2])
+    return float(np.mean(signatures[0] != signatures[1]))
+
+
+def minhash_condensed(values: List) -> np.ndarray:
+    """
+    The vectorized condensed estimated Jaccard distances of signatures or texts. Inputs with at least
+    'minhash.lsh_min_samples' entries only calculate the pairs found by an LSH banding index, all other pairs get the
+    maximal distance 1.
+
+    :raises ValueError: If one of the inputs is not a valid signature or text
+    """
+
+    signatures = MinHasher.get_instance().to_signatures(values)
+    n = signatures.shape[0]
+    if n < 2:
+        return np.empty(0, dtype=np.float64)
+
+    minhash_section = get_minhash_section()
+    lsh_min_samples = int(minhash_section.get('lsh_min_samples') or 5000)
+
+    if n < lsh_min_samples:
+        return np.concatenate([(signatures[row] != signatures[row + 1:]).mean(axis=1)
+                               for row in range(n - 1)]).astype(np.float64)
+
+    lsh_index = MinHashLSHIndex(bands=int(minhash_section.get('lsh_bands') or 32))
+    for idx in range(n):
+        lsh_index.insert(idx, signatures[idx])
+
+    condensed_distances = np.ones(n * (n - 1) // 2, dtype=np.float64)
+    candidate_pairs = lsh_index.candidate_pairs()
+    if len(candidate_pairs) == 0:
+        return condensed_distances
+
+    rows, columns = np.array(sorted(candidate_pairs)).T
+    # Position of (row, column) in the row-major upper triangle
+    condensed_idx = n * rows - rows * (rows + 1) // 2 + (columns - rows - 1)
+    condensed_distances[condensed_idx] = (signatures[rows] != signatures[columns]).mean(axis=1)
+    return condensed_distances
@@ -0,0 +1,156 @@
+import os
+from collections import Counter
+from threading import Lock
+
+from omegaconf import OmegaConf
+from pymongo import MongoClient
+
+from scanner.Storage.Embedded.EmbeddedStorageBackend import EmbeddedStorageBackend
+from scanner.Storage.MongoStorageBackend import MongoStorageBackend
+from scanner.Utilities.Logging import get_logger
+from scanner.Utilities.Util import get_config
+
+
+class MongoConnectionRegistry:
+    """
+    A process-wide registry of Mongo clients. Every :class:`MongoHelper` connecting with the same host and credentials
+    shares one pooled :class:`MongoClient`, so that the connection handshake and the server ping are done only once
+    per process. The registry also keeps a count of how many times each module acquired a client.
+
+    The client is created by the storage backend selected in the 'storage' config section ('mongo' or 'embedded').
+    """
+
+    _clients = dict()
+    _usage_counts = Counter()
+    _config = None
+    _lock = Lock()
+    _logger = get_logger("Mongo Connection Registry")
+
+    @classmethod
+    def get_config(cls):
+        """
+        :return: The configuration set by the main process or the parsed `config.yaml` (loaded once per process)
+        """
+
+        # Prefer the configuration of the main process, as it contains the command line overrides
+        config = get_config()
+        if config is not None and 'mongo_db_credentials' in config:
+            return config
+
+        with cls._lock:
+            if cls._config is None:
+                cls._config = OmegaConf.load('config.yaml')
+            return cls._config
+
+    @classmethod
+    def acquire(cls, host: str, port: int, username: str = None, password: str = None,
+                for_module: str = None) -> MongoClient:
+        """
+        Hands out the shared client for the given host and credentials, creating it on first use
+
+        :param host: Mongo host
+        :type host: str
+
+        :param port: Mongo port
+        :type port: int
+
+        :param username: Mongo username
+        :type username: str
+
+        :param password: Mongo password
+        :type password: str
+
+        :param for_module: Name of the module acquiring the client (used for the usage counters)
+        :type for_module: str
+
+        :return: The shared client
+        :rtype: MongoClient
+
+        :raises ConnectionError: When the connection fails because of bad credentials or host setup
+        """
+
+        backend_name, sqlite_path = cls._read_storage_options()
+
+        # Clients must not be shared across forked processes (e.g. RQ workers), so the pid is part of the key
+        if backend_name == 'embedded':
+            key = (os.getpid(), backend_name, sqlite_path)
+        else:
+            key = (os.getpid(), backend_name, host, port, username, password)
+
+        with cls._lock:
+            cls._usage_counts[for_module] += 1
+
+            client = cls._clients.get(key)
+            if client is None:
+                if backend_name == 'embedded':
+                    backend = EmbeddedStorageBackend(sqlite_path=sqlite_path)
+                    pool_options = dict()
+                else:
+                    backend = MongoStorageBackend()
+                    pool_options = cls._read_pool_options()
+
+                client = backend.create_client(host=host,
+                                               port=port,
+                                               username=username,
+                                               password=password,
+                                               **pool_options)
+
+                cls._clients[key] = client
+                if backend_name == 'embedded':
+                    cls._logger.info(f'Using embedded storage (persisted to: {sqlite_path})')
+                else:
+                    cls._logger.info(f'Connected to {host}:{port} with pool options {pool_options}')
+
+        return client
+
+    @classmethod
+    def get_usage_counts(cls) -> dict:
+        """
+        :return: How many times each module acquired a client in the current process
+        :rtype: dict
+        """
+
+        with cls._lock:
+            return dict(cls._usage_counts)
+
+    @classmethod
+    def close_all(cls):
+        """
+        Closes all clients created by the current process and clears the registry
+        """
+
+        with cls._lock:
+            for key, client in list(cls._clients.items()):
+                if key[0] == os.getpid():
+                    client.close()
+            cls._clients.clear()
+            cls._usage_counts.clear()
+
+    @classmethod
+    def _read_storage_options(cls):
+        config = cls.get_config()
+        storage_section = config.get('storage') or dict()
+
+        backend_name = storage_section.get('backend') or 'mongo'
+        if backend_name not in ('mongo', 'embedded'):
+            raise ValueError(f'Unknown storage backend {backend_name}. Please select one of the following: mongo, embedded')
+
+        sqlite_path = storage_section.get('embedded_sqlite_path') or None
+        return backend_name, sqlite_path
+
+    @classmethod
+    def _read_pool_options(cls) -> dict:
+        config = cls.get_config()
+        pool_section = config.get('mongo_db_connection_pool') or dict()
+
+        pool_options = dict()
+        if pool_section.get('max_pool_size') is not None:
+            pool_options['maxPoolSize'] = int(pool_section['max_pool_size'])
+        if pool_section.get('min_pool_size') is not None:
+            pool_options['minPoolSize'] = int(pool_section['min_pool_size'])
+        if pool_section.get('max_idle_time_ms') is not None:
+            pool_options['maxIdleTimeMS'] = int(pool_section['max_idle_time_ms'])
+        if pool_section.get('wait_queue_timeout_ms') is not None:
+            pool_options['waitQueueTimeoutMS'] = int(pool_section['wait_queue_timeout_ms'])
+
+        return pool_options
@@ -1,18 +1,105 @@
 import json
+import os
 from copy import deepcopy
 from logging import Logger
 from math import inf
+from threading import Lock
 from typing import List
 
-from bson import ObjectId
-from omegaconf import OmegaConf
-from pymongo import MongoClient
+from bson import Binary, ObjectId
+from omegaconf import ListConfig
+from pymongo import MongoClient, ASCENDING, InsertOne, ReturnDocument, UpdateOne
 from pymongo.collection import Collection
+from pymongo.write_concern import WriteConcern
 
 from scanner.Dataclasses.Endpoint import Endpoint
 from scanner.Dataclasses.Interaction import Interaction, InteractionClusteringInfo
+from scanner.Dataclasses.Request import Request
 from scanner.Dataclasses.State import State, NoStateMarkedAsCurrent, StateReachabilityInfo
+from scanner.Dataclasses.Views import HashView, RequestView
+from scanner.Utilities.Hash2Vec import HASH2VEC_FIELD, pack_hash2vec
 from scanner.Utilities.Logging import get_logger
+from scanner.Utilities.MinHash import MinHasher
+from scanner.Utilities.MongoConnectionRegistry import MongoConnectionRegistry
+from scanner.Utilities.MongoWriteBuffer import MongoWriteBufferRegistry
+from scanner.Utilities.ResponseBodyStore import ResponseBodyStore
+
+
+# Indexes backing the hot queries of the pipeline. The keys of the outer dict are the collection types of a batch and
+# every index is declared by name, key list and additional index options (e.g. a partial filter), so that missing
+# indexes can be detected by name in batches created before the declaration was extended.
+BATCH_INDEXES = {
+    'endpoints': {
+        'unprocessed_endpoints': ([('clustering_processed', ASCENDING)],
+                                  {'partialFilterExpression': {'clustering_processed': False}}),
+        'unexplored_endpoints': ([('state_id', ASCENDING),
+                                  ('allow_visit', ASCENDING),
+                                  ('visited', ASCENDING),
+                                  ('clean', ASCENDING)], {}),
+        'endpoints_by_state_and_time': ([('state_id', ASCENDING),
+                                         ('created_at', ASCENDING)], {}),
+        'similar_endpoints': ([('state_id', ASCENDING),
+                               ('path', ASCENDING),
+                               ('method', ASCENDING),
+                               ('host', ASCENDING),
+                               ('scheme', ASCENDING)], {}),
+        'reset_endpoint': ([('is_reset', ASCENDING)],
+                           {'partialFilterExpression': {'is_reset': True}}),
+    },
+    'interactions': {
+        'unprocessed_interactions': ([('state_id', ASCENDING),
+                                      ('made_by_fuzzer', ASCENDING),
+                                      ('clustering_processed', ASCENDING)], {}),
+        'endpoints_unprocessed_interactions': ([('endpoints_processed', ASCENDING)],
+                                               {'partialFilterExpression': {'endpoints_processed': False}}),
+        'interactions_by_state_and_time': ([('state_id', ASCENDING),
+                                            ('created_at', ASCENDING)], {}),
+        'similar_interactions': ([('state_id', ASCENDING),
+                                  ('request.endpoint.path', ASCENDING),
+                                  ('request.endpoint.method', ASCENDING),
+                                  ('request.endpoint.host', ASCENDING),
+                                  ('request.endpoint.scheme', ASCENDING)], {}),
+        'interactions_by_hash': ([('hash', ASCENDING)], {}),
+    },
+    'states': {
+        'current_state': ([('current', ASCENDING)],
+                          {'partialFilterExpression': {'current': True}}),
+        'initial_state': ([('initial', ASCENDING)],
+                          {'partialFilterExpression': {'initial': True}}),
+        'explored_states': ([('explored', ASCENDING),
+                             ('collapsed', ASCENDING)], {}),
+        'fuzzed_states': ([('fuzzed', ASCENDING),
+                           ('collapsed', ASCENDING)], {}),
+        'child_states': ([('previous_state_id', ASCENDING)], {}),
+        'states_by_time': ([('created_at', ASCENDING)], {}),
+    },
+    'endpoint_clustering': {
+        'endpoint_cluster_info': ([('state_id', ASCENDING),
+                                   ('path', ASCENDING),
+                                   ('method', ASCENDING),
+                                   ('host', ASCENDING),
+                                   ('scheme', ASCENDING)], {}),
+    },
+    'interaction_clustering': {
+        'interaction_cluster_info': ([('state_id', ASCENDING),
+                                      ('request_endpoint_path', ASCENDING),
+                                      ('request_endpoint_method', ASCENDING),
+                                      ('request_endpoint_host', ASCENDING),
+                                      ('request_endpoint_scheme', ASCENDING)], {}),
+    },
+    'incremental_clustering': {
+        'incremental_clustering_group': ([('state_id', ASCENDING),
+                                          ('request_endpoint_path', ASCENDING),
+                                          ('request_endpoint_method', ASCENDING),
+                                          ('request_endpoint_host', ASCENDING),
+                                          ('request_endpoint_scheme', ASCENDING),
+                                          ('type', ASCENDING),
+                                          ('position', ASCENDING)], {}),
+    },
+}
+
+# Id of the cursor document (in the cursors DB) that holds the current state id of a batch
+CURRENT_STATE_CURSOR_ID = 'current_state'
 
 
 class MongoHelper:
@@ -20,8 +107,18 @@ class MongoHelper:
     A helper class for communication with Mongo implementing often reaping methods.
     """
 
+    # Process-wide write-through cache of the current state ids, mapped by (pid, full name of the cursors collection).
+    # Every write of the cursor through a MongoHelper updates or invalidates its entry.
+    _current_state_cache = dict()
+    _current_state_cache_lock = Lock()
+
+    # Process-wide parent to children index of the state trees, mapped by (pid, full name of the states collection).
+    # It is loaded once and kept up to date by the state inserts and deletes of the MongoHelpers of the process.
+    _state_children_cache = dict()
+    _state_children_cache_lock = Lock()
+
     def _read_config(self):
-        config = OmegaConf.load('config.yaml')
+        config = MongoConnectionRegistry.get_config()
 
         mongo_credentials_section = config['mongo_db_credentials']
         self._username = mongo_credentials_section['username']
@@ -35,12 +132,55 @@ class MongoHelper:
         self._states_db_name = mongo_db_names_section['states']
         self._endpoint_clustering_db_name = mongo_db_names_section['endpoint_clustering']
         self._interaction_clustering_db_name = mongo_db_names_section['interaction_clustering']
+        # Configurations of older batches do not declare the cursors DB
+        self._cursors_db_name = mongo_db_names_section.get('cursors') or 'cursors'
+        self._response_bodies_db_name = mongo_db_names_section.get('response_bodies') or 'response_bodies'
+        self._incremental_clustering_db_name = (mongo_db_names_section.get('incremental_clustering')
+                                                or 'incremental_clustering')
+
+        response_body_store_section = config.get('response_body_store') or dict()
+        self._response_body_store_enabled = bool(response_body_store_section.get('enabled', False))
+        self._response_body_compression_level = int(response_body_store_section.get('compression_level') or 6)
+
+        self._minhash_section = config.get('minhash') or dict()
+        self._minhash_enabled = bool(self._minhash_section.get('enabled', False))
+
+        # RQ workers are separate processes that would not see the cache invalidations of each other
+        workers_section = config.get('workers') or dict()
+        parallel_rq = workers_section.get('execution_type') == 'parallel-rq'
+        self._current_state_cache_enabled = not parallel_rq
+        self._state_children_cache_enabled = not parallel_rq
+
+        # RQ work horses exit without running the exit handlers that flush the buffers, and the barrier of a worker can
+        # not flush the buffers of the other workers, so the buffer is not used with RQ
+        write_buffer_section = config.get('mongo_write_buffer') or dict()
+        self._write_buffer_enabled = bool(write_buffer_section.get('enabled', False)) and not parallel_rq
+        self._write_buffer_max_size = int(write_buffer_section.get('max_size') or 100)
+        self._write_buffer_max_age_ms = int(write_buffer_section.get('max_age_ms') or 500)
+        self._write_concern = self._parse_write_concern(write_buffer_section.get('write_concern'),
+                                                        write_buffer_section.get('journal'))
+        self._bulk_ingest_write_concern = self._parse_write_concern(write_buffer_section.get('bulk_ingest_write_concern'),
+                                                                    write_buffer_section.get('bulk_ingest_journal'))
+
+    @staticmethod
+    def _parse_write_concern(w, journal) -> WriteConcern:
+        if w is None or w == '':
+            return None
+        if isinstance(w, str) and w.isdigit():
+            w = int(w)
+        return WriteConcern(w=w, j=journal)
 
-    def __init__(self, for_batch: str):
+    def __init__(self, for_batch: str, for_module: str = None, bulk_ingest: bool = False):
         """
         :param for_batch: Name of new collections in the Mongo DB sections
         :type for_batch: str
 
+        :param for_module: Name of the module using the helper (used for the connection usage counters)
+        :type for_module: str
+
+        :param bulk_ingest: Use the bulk ingest write concern for buffered writes (used by fuzzers and external scanners)
+        :type bulk_ingest: bool
+
         :return: Instance of MongoHelper that holds a connection to the DB
         :rtype: MongoHelper
 
@@ -51,16 +191,15 @@ class MongoHelper:
         self._for_batch = for_batch
         self._read_config()
 
-        self._client = MongoClient(host=self._host,
-                                   port=self._port,
-                                   username=self._username,
-                                   password=self._password)
+        if bulk_ingest and self._bulk_ingest_write_concern is not None:
+            self._write_concern = self._bulk_ingest_write_concern
 
-        # Check server connection
-        try:
-            self._client.server_info()
-        except:
-            raise ConnectionError("Something went wrong when trying to connect to mongo host")
+        # The client is shared by all helpers of the process that connect to the same host with the same credentials
+        self._client = MongoConnectionRegistry.acquire(host=self._host,
+                                                       port=self._port,
+                                                       username=self._username,
+                                                       password=self._password,
+                                                       for_module=for_module)
 
     def add_params(self, config):
         config_copy = deepcopy(config)
@@ -83,8 +222,21 @@ class MongoHelper:
         """
 
         endpoints_collection = self.get_endpoints_collection()
-        result = endpoints_collection.insert_one(endpoint.to_dict())
-        return str(result.inserted_id)
+        return self._insert(endpoints_collection, self.with_hash2vec(endpoint.to_dict()))
+
+    def add_endpoints(self, endpoints: List[dict]) -> List[str]:
+        """
+        Add multiple endpoints to the DB
+
+        :param endpoints: The endpoints to be added
+        :type endpoints: List[dict] (dict contains the data of a non cast :class:`Endpoint`)
+
+        :return: Created :class:`Endpoint` ids
+        :rtype: List[str]
+        """
+
+        endpoints_collection = self.get_endpoints_collection()
+        return self._insert_many(endpoints_collection, [self.with_hash2vec(endpoint) for endpoint in endpoints])
 
     def add_state(self, state: State) -> str:
         """
@@ -98,8 +250,20 @@ class MongoHelper:
         """
 
         states_collection = self.get_states_collection()
-        result = states_collection.insert_one(state.to_dict())
-        return str(result.inserted_id)
+        result = states_collection.insert_one(self.with_hash2vec(state.to_dict()))
+        state_id = str(result.inserted_id)
+
+        if self._state_children_cache_enabled:
+            with self._state_children_cache_lock:
+                state_tree = self._state_children_cache.get(self._get_state_children_cache_key())
+                if state_tree is not None:
+                    state_tree['children'].setdefault(state.previous_state_id, []).append(state_id)
+                    state_tree['parents'][state_id] = state.previous_state_id
+
+        if state.current:
+            self._set_current_state_cursor(state_id)
+
+        return state_id
 
     def add_interaction(self, interaction: Interaction) -> str:
         """
@@ -113,22 +277,132 @@ class MongoHelper:
         """
 
         interactions_collection = self.get_interactions_collection()
-        result = interactions_collection.insert_one(interaction.to_dict())
+        interaction_dict = self.with_hash2vec(interaction.to_dict())
+
+        response_dict = interaction_dict['response']
+
+        # The signature for the 'minhash' distance type is created once, while the body is still at hand
+        if self._minhash_enabled and isinstance(response_dict.get('data'), str):
+            minhasher = MinHasher.get_instance(self._minhash_section)
+            response_dict['minhash'] = Binary(minhasher.signature(response_dict['data']))
+
+        # Move the response body to the body store (before the interaction is written, so that it is never dangling)
+        if self._response_body_store_enabled and isinstance(response_dict.get('data'), str):
+            response_dict['body_digest'] = self.get_response_body_store().put(response_dict['data'])
+            response_dict['data'] = None
+
+        return self._insert(interactions_collection, interaction_dict)
+
+    @staticmethod
+    def with_hash2vec(document: dict) -> dict:
+        """
+        Adds the normalized hash2vec vector of the hash to a document, so that the hash2vec clustering does not have to
+        calculate it on every call
+
+        :param document: An interaction, endpoint or state dict
+        :type document: dict
+
+        :return: The document (modified in place)
+        :rtype: dict
+        """
+
+        hash_value = document.get('hash')
+        if isinstance(hash_value, str):
+            document[HASH2VEC_FIELD] = Binary(pack_hash2vec(hash_value))
+        return document
+
+    def _insert(self, collection: Collection, document: dict) -> str:
+        """
+        Insert a document directly or through the write buffer of the collection (if enabled)
+        """
+
+        if self._write_buffer_enabled:
+            return self._get_write_buffer(collection).add(document)
+
+        result = self._with_write_concern(collection).insert_one(document)
         return str(result.inserted_id)
 
+    def _insert_many(self, collection: Collection, documents: List[dict]) -> List[str]:
+        """
+        Insert multiple documents directly or through the write buffer of the collection (if enabled)
+        """
+
+        if len(documents) == 0:
+            return []
+
+        if self._write_buffer_enabled:
+            return self._get_write_buffer(collection).add_many(documents)
+
+        result = self._with_write_concern(collection).insert_many(documents, ordered=False)
+        return [str(inserted_id) for inserted_id in result.inserted_ids]
+
+    def _with_write_concern(self, collection: Collection) -> Collection:
+        if self._write_concern is None:
+            return collection
+        return collection.with_options(write_concern=self._write_concern)
+
+    def _get_write_buffer(self, collection: Collection):
+        return MongoWriteBufferRegistry.get_buffer(self._with_write_concern(collection),
+                                                   max_size=self._write_buffer_max_size,
+                                                   max_age_ms=self._write_buffer_max_age_ms)
+
+    def flush_writes(self) -> int:
+        """
+        Write barrier: Writes all buffered documents of the current batch in this process to the DB.
+        Modules reading data written by other modules should call this before reading. It only covers the writes of
+        this process, the buffers of other processes are flushed by their own size and age limits.
+
+        :return: The count of written documents
+        :rtype: int
+        """
+
+        if not self._write_buffer_enabled:
+            return 0
+
+        batch_collections = self._get_batch_collections(self._for_batch).values()
+        return MongoWriteBufferRegistry.flush([collection.full_name for collection in batch_collections])
+
     def get_current_state_id(self) -> str:
         """
+        The current state id is read from the cursor document of the batch and cached in the process
+        (batches without a cursor fall back to the state marked as current, which is then written to the cursor)
+
         :return: Current :class:`State` id
         :rtype: str
         """
 
-        states_collection = self.get_states_collection()
-        state_query = states_collection.find_one({'current': True})
-        if state_query is None:
-            current_state_id = None
-            # raise NoStateMarkedAsCurrent("There is no current state in mongo")
+        cache_key = self._get_current_state_cache_key()
+        if self._current_state_cache_enabled:
+            current_state_id = self._current_state_cache.get(cache_key)
+            if current_state_id is not None:
+                return current_state_id
+
+        cursors_collection = self.get_cursors_collection()
+        cursor_query = cursors_collection.find_one({'_id': CURRENT_STATE_CURSOR_ID}, {'state_id': 1})
+        if cursor_query is not None:
+            current_state_id = cursor_query.get('state_id')
         else:
-            current_state_id = str(state_query['_id'])
+            states_collection = self.get_states_collection()
+            state_query = states_collection.find_one({'current': True}, {'_id': 1})
+            if state_query is None:
+                current_state_id = None
+                # raise NoStateMarkedAsCurrent("There is no current state in mongo")
+            else:
+                # Batches created before the cursor are upgraded once. A cursor written in the meantime by another
+                # process is kept, as it is newer than the flag.
+                cursor_query = cursors_collection.find_one_and_update({'_id': CURRENT_STATE_CURSOR_ID},
+                                                                      {'$setOnInsert': {'state_id':
+                                                                                        str(state_query['_id'])}},
+                                                                      projection={'state_id': 1},
+                                                                      upsert=True,
+                                                                      return_document=ReturnDocument.AFTER)
+                current_state_id = cursor_query.get('state_id')
+
+        # Missing current states are not cached, as the state can be added by a process not using a MongoHelper
+        if self._current_state_cache_enabled and current_state_id is not None:
+            with self._current_state_cache_lock:
+                self._current_state_cache[cache_key] = current_state_id
+
         return current_state_id
 
     def get_current_state(self) -> State:
@@ -136,8 +410,12 @@ class MongoHelper:
         :return: Current :class:`State`
         :rtype: State
         """
+        current_state_id = self.get_current_state_id()
+        if current_state_id is None:
+            return None
+
         states_collection = self.get_states_collection()
-        state_query = states_collection.find_one({'current': True})
+        state_query = states_collection.find_one({'_id': ObjectId(current_state_id)})
         if state_query is None:
             current_state = None
         else:
@@ -162,10 +440,134 @@ class MongoHelper:
 
         :param state_id: Target state id
         :type state_id: str
+
+        Note: Only the cursor document of the batch is written. The 'current' flag of the states is only read once by
+        :meth:`get_current_state_id` to create the cursor of batches that do not have one yet.
         """
-        states_collection = self.get_states_collection()
-        states_collection.find_one_and_update({'current': True}, {'$set': {'current': False}})
-        states_collection.find_one_and_update({'_id': ObjectId(state_id)}, {'$set': {'current': True}})
+        self._set_current_state_cursor(state_id)
+
+    def _set_current_state_cursor(self, state_id: str):
+        """
+        Writes the current state id to the cursor document with a single upsert and updates the process cache
+        """
+
+        cursors_collection = self.get_cursors_collection()
+        cache_key = self._get_current_state_cache_key()
+
+        # The lock keeps the DB write and the cache update in the same order for concurrent threads
+        with self._current_state_cache_lock:
+            cursors_collection.update_one({'_id': CURRENT_STATE_CURSOR_ID},
+                                          {'$set': {'state_id': state_id}},
+                                          upsert=True)
+            if state_id is None:
+                self._current_state_cache.pop(cache_key, None)
+            else:
+                self._current_state_cache[cache_key] = state_id
+
+    def _get_current_state_cache_key(self) -> tuple:
+        return os.getpid(), f'{self._cursors_db_name}.{self._for_batch}'
+
+    def invalidate_current_state_cache(self, all_batches: bool = False):
+        """
+        Drops the cached current state id of the batch, so that the next read goes to the DB
+
+        :param all_batches: Drop the cached ids of all batches
+        :type all_batches: bool
+        """
+
+        with self._current_state_cache_lock:
+            if all_batches:
+                self._current_state_cache.clear()
+            else:
+                self._current_state_cache.pop(self._get_current_state_cache_key(), None)
+
+    def _get_state_children_cache_key(self) -> tuple:
+        return os.getpid(), f'{self._states_db_name}.{self._for_batch}'
+
+    def invalidate_state_children_cache(self, all_batches: bool = False):
+        """
+        Drops the cached state tree of the batch, so that the next subtree resolution loads it again from the DB (needed
+        after states were added or deleted without a MongoHelper)
+
+        :param all_batches: Drop the cached trees of all batches
+        :type all_batches: bool
+        """
+
+        with self._state_children_cache_lock:
+            if all_batches:
+                self._state_children_cache.clear()
+            else:
+                self._state_children_cache.pop(self._get_state_children_cache_key(), None)
+
+    def _get_batch_collections(self, batch_name: str) -> dict:
+        """
+        :param batch_name: Name of the batch
+        :type batch_name: str
+
+        :return: The indexed collections of a batch mapped by their collection type (see :data:`BATCH_INDEXES`)
+        :rtype: dict
+        """
+
+        client = self.get_client()
+        return {'endpoints': client[self._endpoints_db_name][batch_name],
+                'interactions': client[self._interactions_db_name][batch_name],
+                'states': client[self._states_db_name][batch_name],
+                'endpoint_clustering': client[self._endpoint_clustering_db_name][batch_name],
+                'interaction_clustering': client[self._interaction_clustering_db_name][batch_name],
+                'incremental_clustering': client[self._incremental_clustering_db_name][batch_name]}
+
+    def ensure_indexes(self):
+        """
+        Creates the indexes declared in :data:`BATCH_INDEXES` for all collections of the current batch.
+        Creating an already existing index is a no-op in Mongo, so this can be called on existing batches as well.
+        """
+
+        for collection_type, collection in self._get_batch_collections(self._for_batch).items():
+            for index_name, (keys, options) in BATCH_INDEXES[collection_type].items():
+                collection.create_index(keys, name=index_name, **options)
+
+        self._logger.info(f'Indexes ensured for batch {self._for_batch}')
+
+    def get_missing_indexes(self, batch_name: str = None) -> List[str]:
+        """
+        Finds the indexes declared in :data:`BATCH_INDEXES` that do not exist in a batch
+
+        :param batch_name: Name of the batch that will be checked (the current batch if None)
+        :type batch_name: str
+
+        :return: The missing indexes in the format '<collection type>.<index name>'
+        :rtype: List[str]
+        """
+
+        if batch_name is None:
+            batch_name = self._for_batch
+
+        missing_indexes = []
+        for collection_type, collection in self._get_batch_collections(batch_name).items():
+            existing_indexes = collection.index_information()
+            for index_name in BATCH_INDEXES[collection_type]:
+                if index_name not in existing_indexes:
+                    missing_indexes.append(f'{collection_type}.{index_name}')
+
+        return missing_indexes
+
+    def report_missing_indexes(self) -> dict:
+        """
+        Checks all existing batches (as listed in the experiments DB) for missing indexes and logs them
+
+        :return: The missing indexes mapped by batch name (batches without missing indexes are skipped)
+        :rtype: dict
+        """
+
+        client = self.get_client()
+        missing_indexes_per_batch = dict()
+        for batch_name in client['experiments'].list_collection_names():
+            missing_indexes = self.get_missing_indexes(batch_name)
+            if len(missing_indexes) > 0:
+                missing_indexes_per_batch[batch_name] = missing_indexes
+                self._logger.warning(f'Batch {batch_name} is missing the indexes: {", ".join(missing_indexes)}')
+
+        return missing_indexes_per_batch
 
     def get_client(self) -> MongoClient:
         """
@@ -206,6 +608,79 @@ class MongoHelper:
         states_collection = client[self._states_db_name][self._for_batch]
         return states_collection
 
+    def get_cursors_collection(self) -> Collection:
+        """
+        :return: The cursors collection of the current batch (e.g. holding the current state id)
+        :rtype: Collection
+        """
+
+        client = self.get_client()
+        cursors_collection = client[self._cursors_db_name][self._for_batch]
+        return cursors_collection
+
+    def get_response_bodies_collection(self) -> Collection:
+        """
+        :return: The response bodies collection of the current batch
+        :rtype: Collection
+        """
+
+        client = self.get_client()
+        response_bodies_collection = client[self._response_bodies_db_name][self._for_batch]
+        return response_bodies_collection
+
+    def get_response_body_store(self) -> ResponseBodyStore:
+        """
+        :return: The response body store of the current batch
+        :rtype: ResponseBodyStore
+        """
+
+        return ResponseBodyStore(self.get_response_bodies_collection(),
+                                 compression_level=self._response_body_compression_level)
+
+    def resolve_response_bodies(self, interaction_queries: List[dict]) -> List[dict]:
+        """
+        Loads the response bodies referenced by digest into the given interaction queries (with a single query).
+        Interactions storing their body inline are left unchanged.
+
+        :param interaction_queries: DB query results of interactions (including 'response.body_digest')
+        :type interaction_queries: List[dict]
+
+        :return: The same interaction queries with their 'response.data' filled in
+        :rtype: List[dict]
+        """
+
+        unresolved_responses = [interaction_query['response'] for interaction_query in interaction_queries
+                                if interaction_query.get('response', dict()).get('body_digest') is not None
+                                and interaction_query['response'].get('data') is None]
+        if len(unresolved_responses) == 0:
+            return interaction_queries
+
+        bodies = self.get_response_body_store().get_many([response['body_digest'] for response in unresolved_responses])
+        for response in unresolved_responses:
+            body = bodies.get(response['body_digest'])
+            if body is None:
+                self._logger.warning(f'Response body {response["body_digest"]} is missing in the body store')
+                body = ''
+            response['data'] = body
+
+        return interaction_queries
+
+    @staticmethod
+    def is_response_body_field(field_for_distance) -> bool:
+        """
+        :param field_for_distance: Name of the key (or list of keys for nested fields) used for the distance calculation
+        :type field_for_distance: str or list
+
+        :return: True if the field is the response body (i.e. it must be resolved from the body store)
+        :rtype: bool
+        """
+
+        if isinstance(field_for_distance, ListConfig):
+            field_for_distance = list(field_for_distance)
+        if isinstance(field_for_distance, list):
+            field_for_distance = '.'.join(field_for_distance)
+        return field_for_distance == 'response.data'
+
     def get_endpoint_clustering_collection(self) -> Collection:
         """
         :return: The endpoints clustering collection of the current batch
@@ -226,6 +701,17 @@ class MongoHelper:
         interaction_clustering_collection = client[self._interaction_clustering_db_name][self._for_batch]
         return interaction_clustering_collection
 
+    def get_incremental_clustering_collection(self) -> Collection:
+        """
+        :return: The incremental clustering collection of the current batch (one document per similarity group of the
+                 interactions and one per clustered point, see :class:`IncrementalDBSCAN`)
+        :rtype: Collection
+        """
+
+        client = self.get_client()
+        incremental_clustering_collection = client[self._incremental_clustering_db_name][self._for_batch]
+        return incremental_clustering_collection
+
     def clear_whole_db(self):
         """
         Deletes all data in the DB
@@ -233,10 +719,15 @@ class MongoHelper:
 
         client = self.get_client()
         dbs = client.list_database_names()
-        dbs.remove('admin')
+        if 'admin' in dbs:
+            dbs.remove('admin')
         for db in dbs:
             client.drop_database(db)
 
+        self.invalidate_current_state_cache(all_batches=True)
+        self.invalidate_state_children_cache(all_batches=True)
+        ResponseBodyStore.forget()
+
     def clear_current_batch(self):
         """
         Deletes the current batch data in the DB
@@ -249,7 +740,63 @@ class MongoHelper:
         for db in dbs:
             client[db].drop_collection(batch_name)
 
-    def get_similar_interactions(self, endpoint: Endpoint, state_id: str, processed_type: str = '', fuzzed_type: str = '') -> List[dict]:
+        self.invalidate_current_state_cache()
+        self.invalidate_state_children_cache()
+        ResponseBodyStore.forget(self.get_response_bodies_collection().full_name)
+
+    @staticmethod
+    def get_distance_projection(field_for_distance='hash', extra_fields=()) -> dict:
+        """
+        Creates a projection that loads only the fields needed for clustering on a given distance field
+
+        :param field_for_distance: Name of the key (or list of keys for nested fields) used for the distance calculation
+        :type field_for_distance: str or list
+
+        :param extra_fields: Additional (dotted) field names which will be included in the projection
+        :type extra_fields: Iterable[str]
+
+        :return: A projection for the Mongo read methods
+        :rtype: dict
+        """
+
+        projection = dict(HashView.PROJECTION)
+
+        if isinstance(field_for_distance, ListConfig):
+            field_for_distance = list(field_for_distance)
+
+        if isinstance(field_for_distance, list):
+            projection['.'.join(field_for_distance)] = 1
+        elif isinstance(field_for_distance, str):
+            projection[field_for_distance] = 1
+
+        # Response bodies can be referenced by digest (see resolve_response_bodies)
+        if MongoHelper.is_response_body_field(field_for_distance):
+            projection['response.body_digest'] = 1
+
+        for extra_field in extra_fields:
+            projection[extra_field] = 1
+
+        return projection
+
+    def get_interaction_request(self, interaction_id: str) -> Request:
+        """
+        Loads only the request of an interaction (i.e. without the response body)
+
+        :param interaction_id: Id of the interaction
+        :type interaction_id: str
+
+        :return: The request of the interaction or None if the interaction does not exist
+        :rtype: Request
+        """
+
+        interactions_collection = self.get_interactions_collection()
+        interaction_query = interactions_collection.find_one({'_id': ObjectId(interaction_id)}, RequestView.PROJECTION)
+        if interaction_query is None:
+            return None
+        return RequestView.from_query(interaction_query).request
+
+    def get_similar_interactions(self, endpoint: Endpoint, state_id: str, processed_type: str = '', fuzzed_type: str = '',
+                                 projection: dict = None) -> List[dict]:
         """
         Finds similar interactions in the DB by endpoint comparison
         (Note: only the host, method, scheme, path and state_id of the endpoint are compared)
@@ -266,6 +813,9 @@ class MongoHelper:
         :param fuzzed_type: Use this parameter if you want to add fuzzed constraint to the query (valid input 'fuzzed, 'non-fuzzed' or empty string for none)
         :type fuzzed_type: str
 
+        :param projection: Fields which will be loaded (all if None, see :meth:`get_distance_projection`)
+        :type projection: dict
+
         :return: A list of similar interactions
         :rtype: List[dict]  (dict contains the data of a non cast :class:`Interaction`)
         """
@@ -289,7 +839,7 @@ class MongoHelper:
         elif fuzzed_type == 'non-fuzzed':
             interactions_query["made_by_fuzzer"] = False
 
-        similar_interactions_query = interactions_collection.find(interactions_query)
+        similar_interactions_query = interactions_collection.find(interactions_query, projection)
 
         similar_interactions = []
         for interaction_query in similar_interactions_query:
@@ -297,13 +847,16 @@ class MongoHelper:
 
         return similar_interactions
 
-    def get_similar_endpoints(self, endpoint: Endpoint) -> List[dict]:
+    def get_similar_endpoints(self, endpoint: Endpoint, projection: dict = None) -> List[dict]:
         """
         Finds similar endpoints in the DB compared to a target endpoint
 
         :param endpoint: Endpoint used for comparison
         :type endpoint: Endpoint
 
+        :param projection: Fields which will be loaded (all if None, see :meth:`get_distance_projection`)
+        :type projection: dict
+
         :return: A list of similar endpoints
         :rtype: List[dict]  (dict contains the data of a non casted :class:`Endpoint`)
         """
@@ -317,7 +870,7 @@ class MongoHelper:
                  "state_id": endpoint.state_id,
                  "found_at": endpoint.found_at}
 
-        similar_endpoints = endpoints_collection.find(query)
+        similar_endpoints = endpoints_collection.find(query, projection)
 
         # Load locally because the mongo cursor iterates simultaneously
         similar_endpoints_array = []
@@ -326,7 +879,7 @@ class MongoHelper:
 
         return similar_endpoints_array
 
-    def update_endpoints(self, after_timestamp: int, for_state_id: str, new_state_id: str):
+    def update_endpoints(self, after_timestamp: int, for_state_id: str, new_state_id: str) -> int:
         """
         Changes the endpoints owner state id after specific timestamp
 
@@ -338,6 +891,9 @@ class MongoHelper:
 
         :param new_state_id: New state id owner of the endpoints
         :type new_state_id: str
+
+        :return: The count of updated endpoints
+        :rtype: int
         """
 
         endpoints_collection = self.get_endpoints_collection()
@@ -346,14 +902,12 @@ class MongoHelper:
             "created_at": {"$gt": after_timestamp}
         }
 
-        endpoints_query = endpoints_collection.find(query)
-        if endpoints_query is not None:
-            for endpoint_query in endpoints_query:
-                endpoints_collection.find_one_and_update(endpoint_query, {"$set": {"state_id": new_state_id,
-                                                                                   'allow_visit': True,
-                                                                                   'clustering_processed': False}})
+        result = endpoints_collection.update_many(query, {"$set": {"state_id": new_state_id,
+                                                                   'allow_visit': True,
+                                                                   'clustering_processed': False}})
+        return result.modified_count
 
-    def delete_endpoints(self, after_timestamp: int, for_state_id: str):
+    def delete_endpoints(self, after_timestamp: int, for_state_id: str) -> int:
         """
         Delete the endpoints of an owner state id after specific timestamp
 
@@ -362,6 +916,9 @@ class MongoHelper:
 
         :param for_state_id: State id owner of the interactions that will be updated
         :type for_state_id: str
+
+        :return: The count of deleted endpoints
+        :rtype: int
         """
 
         endpoints_collection = self.get_endpoints_collection()
@@ -371,12 +928,10 @@ class MongoHelper:
             "created_at": {"$gt": after_timestamp}
         }
 
-        endpoints_query = endpoints_collection.find(query)
-        if endpoints_query is not None:
-            for endpoint_query in endpoints_query:
-                endpoints_collection.delete_one(endpoint_query)
+        result = endpoints_collection.delete_many(query)
+        return result.deleted_count
 
-    def update_interactions(self, after_timestamp: int, for_state_id: str, new_state_id: str):
+    def update_interactions(self, after_timestamp: int, for_state_id: str, new_state_id: str) -> int:
         """
         Changes the interactions owner state id after specific timestamp
 
@@ -388,6 +943,9 @@ class MongoHelper:
 
         :param new_state_id: New state id owner of the interactions
         :type new_state_id: str
+
+        :return: The count of updated interactions
+        :rtype: int
         """
 
         interactions_collection = self.get_interactions_collection()
@@ -396,12 +954,10 @@ class MongoHelper:
             "created_at": {"$gt": after_timestamp}
         }
 
-        interactions_query = interactions_collection.find(query)
-        if interactions_query is not None:
-            for interaction_query in interactions_query:
-                interactions_collection.find_one_and_update(interaction_query, {"$set": {"state_id": new_state_id}})
+        result = interactions_collection.update_many(query, {"$set": {"state_id": new_state_id}})
+        return result.modified_count
 
-    def delete_interactions(self, after_timestamp: int, for_state_id: str):
+    def delete_interactions(self, after_timestamp: int, for_state_id: str) -> int:
         """
         Delete the endpoints of an owner state id after specific timestamp
 
@@ -410,6 +966,9 @@ class MongoHelper:
 
         :param for_state_id: State id owner of the interactions that will be updated
         :type for_state_id: str
+
+        :return: The count of deleted interactions
+        :rtype: int
         """
 
         interactions_collection = self.get_interactions_collection()
@@ -418,10 +977,8 @@ class MongoHelper:
             "created_at": {"$gt": after_timestamp}
         }
 
-        interactions_query = interactions_collection.find(query)
-        if interactions_query is not None:
-            for interaction_query in interactions_query:
-                interactions_collection.delete_one(interaction_query)
+        result = interactions_collection.delete_many(query)
+        return result.deleted_count
 
     def get_interaction_cluster_info(self, interaction_query: dict) -> InteractionClusteringInfo:
         """
@@ -479,6 +1036,96 @@ class MongoHelper:
                 cluster_count=new_cluster_count)
             interaction_clustering_collection.insert_one(new_cluster_info_entry.to_dict())
 
+    @staticmethod
+    def _get_incremental_clustering_key(endpoint: Endpoint, state_id: str) -> dict:
+        return {'state_id': state_id,
+                'request_endpoint_host': endpoint.host,
+                'request_endpoint_scheme': endpoint.scheme,
+                'request_endpoint_path': endpoint.path,
+                'request_endpoint_method': endpoint.method}
+
+    def get_incremental_clustering_state(self, endpoint: Endpoint, state_id: str) -> dict:
+        """
+        Read the stored incremental clustering of a similarity group of interactions
+        (Note: only the host, method, scheme and path of the endpoint are compared)
+
+        :param endpoint: The endpoint of the similarity group
+        :type endpoint: Endpoint
+
+        :param state_id: Id of the state of the similarity group
+        :type state_id: str
+
+        :return: The stored group fields and points (see :meth:`IncrementalDBSCAN.to_dict`) or None if the group has no
+                 stored state
+        :rtype: dict
+        """
+
+        incremental_clustering_collection = self.get_incremental_clustering_collection()
+        group_key = self._get_incremental_clustering_key(endpoint, state_id)
+
+        clustering_state = incremental_clustering_collection.find_one({**group_key, 'type': 'group'}, {'_id': 0})
+        if clustering_state is None:
+            return None
+
+        clustering_state['points'] = list(incremental_clustering_collection.find({**group_key, 'type': 'point'},
+                                                                                 {'_id': 0}))
+        return clustering_state
+
+    def save_incremental_clustering_state(self, endpoint: Endpoint, state_id: str, group_fields: dict,
+                                          new_points: List[dict], changed_points: List[dict], replace: bool = False):
+        """
+        Store the changes of the incremental clustering of a similarity group of interactions. The group fields and
+        every point are stored in documents of their own, so that adding an interaction only writes the points it
+        changed.
+
+        :param endpoint: The endpoint of the similarity group
+        :type endpoint: Endpoint
+
+        :param state_id: Id of the state of the similarity group
+        :type state_id: str
+
+        :param group_fields: The fields of the whole clustering (e.g. the cluster count and the parameters)
+        :type group_fields: dict
+
+        :param new_points: The added points (see :meth:`IncrementalDBSCAN.pop_changed_points`)
+        :type new_points: List[dict]
+
+        :param changed_points: The changed points (see :meth:`IncrementalDBSCAN.pop_changed_points`)
+        :type changed_points: List[dict]
+
+        :param replace: Delete the stored clustering of the group first (e.g. after a rebuild)
+        :type replace: bool
+        """
+
+        incremental_clustering_collection = self.get_incremental_clustering_collection()
+        group_key = self._get_incremental_clustering_key(endpoint, state_id)
+
+        if replace:
+            incremental_clustering_collection.delete_many(group_key)
+
+        # The points and the group are written with a single unordered bulk write (one round trip per change)
+        requests = [InsertOne({**point, **group_key, 'type': 'point'}) for point in new_points]
+        requests.extend(UpdateOne({**group_key, 'type': 'point', 'position': point['position']},
+                                  {'$set': {'neighbour_count': point['neighbour_count'], 'parent': point['parent']}})
+                        for point in changed_points)
+        requests.append(UpdateOne({**group_key, 'type': 'group'}, {'$set': group_fields}, upsert=True))
+        incremental_clustering_collection.bulk_write(requests, ordered=False)
+
+    def delete_incremental_clustering_states(self, state_ids: List[str]) -> int:
+        """
+        Delete the stored incremental clusterings of all similarity groups of the given states
+
+        :param state_ids: Ids of the states
+        :type state_ids: List[str]
+
+        :return: Count of the deleted clusterings
+        :rtype: int
+        """
+
+        incremental_clustering_collection = self.get_incremental_clustering_collection()
+        result = incremental_clustering_collection.delete_many({'state_id': {'$in': list(state_ids)}})
+        return result.deleted_count
+
     def extend_state_reachability(self, state_id: str, reachability_info_list: List[StateReachabilityInfo]):
         """
         Adds data for the reachability of a state from another state
@@ -495,42 +1142,150 @@ class MongoHelper:
             states_collection.find_one_and_update({'_id': ObjectId(state_id)},
                                                   {'$push': {'reachable_from': reachability_info.to_dict()}})
 
-    def mark_states_as_collapsed_recursively(self, state_id):
+    def get_descendant_state_ids(self, state_id: str) -> List[str]:
         """
-        Mark the given parent states and all descendant states as collapsed
+        Resolves a state and all of its descendant states. The parent to children index of the batch is loaded once per
+        process (only the ids are projected) and kept up to date by :meth:`add_state` and
+        :meth:`delete_states_recursively`, so later resolutions need no query. When the index can not be shared (RQ
+        workers are separate processes), the subtree is resolved level by level with the child states index.
 
-        :param state_id: Id of the parent state which must be marked as collapsed
+        :param state_id: Id of the root state of the subtree
         :type state_id: str
+
+        :return: The id of the given state followed by the ids of all of its descendants
+        :rtype: List[str]
+        """
+
+        if not self._state_children_cache_enabled:
+            return self._query_descendant_state_ids(state_id)
+
+        with self._state_children_cache_lock:
+            cache_key = self._get_state_children_cache_key()
+            state_tree = self._state_children_cache.get(cache_key)
+            if state_tree is None:
+                state_tree = self._load_state_tree()
+                self._state_children_cache[cache_key] = state_tree
+
+            children_by_parent = state_tree['children']
+            subtree_state_ids = [state_id]
+            visited_state_ids = {state_id}
+            idx = 0
+            while idx < len(subtree_state_ids):
+                for child_state_id in children_by_parent.get(subtree_state_ids[idx], []):
+                    # Guard against cycles in malformed state trees
+                    if child_state_id not in visited_state_ids:
+                        visited_state_ids.add(child_state_id)
+                        subtree_state_ids.append(child_state_id)
+                idx += 1
+
+        return subtree_state_ids
+
+    def _load_state_tree(self) -> dict:
+        """
+        :return: The children ids mapped by the parent ids and the parent ids mapped by the state ids
+        :rtype: dict
         """
 
         states_collection = self.get_states_collection()
-        states_query = states_collection.find({"previous_state_id": state_id})
-        if states_query is not None:
+        children_by_parent = dict()
+        parent_by_state = dict()
+        for state_query in states_collection.find({}, {'_id': 1, 'previous_state_id': 1}):
+            state_id = str(state_query['_id'])
+            parent_id = state_query.get('previous_state_id')
+            children_by_parent.setdefault(parent_id, []).append(state_id)
+            parent_by_state[state_id] = parent_id
+        return {'children': children_by_parent, 'parents': parent_by_state}
+
+    def _query_descendant_state_ids(self, state_id: str) -> List[str]:
+        """
+        Resolves a subtree with one query per tree level, loading only the ids of the subtree
+        """
+
+        states_collection = self.get_states_collection()
+        subtree_state_ids = [state_id]
+        visited_state_ids = {state_id}
+        parent_state_ids = [state_id]
+        while len(parent_state_ids) > 0:
+            states_query = states_collection.find({'previous_state_id': {'$in': parent_state_ids}}, {'_id': 1})
+            parent_state_ids = []
             for state_query in states_query:
-                self.mark_states_as_collapsed_recursively(str(state_query['_id']))
+                child_state_id = str(state_query['_id'])
+                # Guard against cycles in malformed state trees
+                if child_state_id not in visited_state_ids:
+                    visited_state_ids.add(child_state_id)
+                    subtree_state_ids.append(child_state_id)
+                    parent_state_ids.append(child_state_id)
+        return subtree_state_ids
+
+    def mark_states_as_collapsed_recursively(self, state_id: str, subtree_state_ids: List[str] = None) -> List[str]:
+        """
+        Mark the given parent states and all descendant states as collapsed
+
+        :param state_id: Id of the parent state which must be marked as collapsed
+        :type state_id: str
 
-        states_collection.update_one({'_id': ObjectId(state_id)}, {'$set': {'collapsed': True}})
+        :param subtree_state_ids: The already resolved subtree of the state (see :meth:`get_descendant_state_ids`)
+        :type subtree_state_ids: List[str]
 
-    def delete_states_recursively(self, state_id: str):
+        :return: The ids of the states marked as collapsed
+        :rtype: List[str]
+        """
+
+        if subtree_state_ids is None:
+            subtree_state_ids = self.get_descendant_state_ids(state_id)
+
+        states_collection = self.get_states_collection()
+        subtree_object_ids = [ObjectId(entry_id) for entry_id in subtree_state_ids]
+        states_collection.update_many({'_id': {'$in': subtree_object_ids}}, {'$set': {'collapsed': True}})
+        self.delete_incremental_clustering_states(subtree_state_ids)
+        self.invalidate_current_state_cache()
+        return subtree_state_ids
+
+    def delete_states_recursively(self, state_id: str, subtree_state_ids: List[str] = None) -> List[str]:
         """
         Delete the given parent states and all descendant states
 
         :param state_id: Id of the parent state which must be deleted
         :type state_id: str
+
+        :param subtree_state_ids: The already resolved subtree of the state (see :meth:`get_descendant_state_ids`)
+        :type subtree_state_ids: List[str]
+
+        :return: The ids of the deleted states
+        :rtype: List[str]
         """
 
+        if subtree_state_ids is None:
+            subtree_state_ids = self.get_descendant_state_ids(state_id)
+
         interactions_collection = self.get_interactions_collection()
         endpoints_collection = self.get_endpoints_collection()
         states_collection = self.get_states_collection()
-
-        states_query = states_collection.find({"previous_state_id": state_id})
-        if states_query is not None:
-            for state_query in states_query:
-                self.delete_states_recursively(str(state_query['_id']))
-
-        interactions_collection.delete_many({'state_id': state_id})
-        endpoints_collection.delete_many({'state_id': state_id})
-        states_collection.delete_one({'_id': ObjectId(state_id)})
+        subtree_object_ids = [ObjectId(entry_id) for entry_id in subtree_state_ids]
+
+        interactions_collection.delete_many({'state_id': {'$in': subtree_state_ids}})
+        endpoints_collection.delete_many({'state_id': {'$in': subtree_state_ids}})
+        states_collection.delete_many({'_id': {'$in': subtree_object_ids}})
+        self.delete_incremental_clustering_states(subtree_state_ids)
+
+        if self._state_children_cache_enabled:
+            with self._state_children_cache_lock:
+                state_tree = self._state_children_cache.get(self._get_state_children_cache_key())
+                if state_tree is not None:
+                    for entry_id in subtree_state_ids:
+                        state_tree['children'].pop(entry_id, None)
+                        parent_id = state_tree['parents'].pop(entry_id, None)
+                        siblings = state_tree['children'].get(parent_id)
+                        if siblings is not None and entry_id in siblings:
+                            siblings.remove(entry_id)
+
+        # A deleted state can not stay current (like a deleted state marked as current)
+        cursors_collection = self.get_cursors_collection()
+        cursors_collection.update_one({'_id': CURRENT_STATE_CURSOR_ID, 'state_id': {'$in': subtree_state_ids}},
+                                      {'$set': {'state_id': None}})
+        self.invalidate_current_state_cache()
+
+        return subtree_state_ids
 
     @staticmethod
     def find_earliest_entry(collection: Collection, entry_ids: List[str]) -> str:
@@ -587,19 +1342,28 @@ class MongoHelper:
     def update_states_explored_status(self):
         """
         Updates the 'explored' status of every state by checking the its endpoints
+        (one aggregation over the endpoints and two bulk updates of the states)
         """
 
+        endpoints_collection = self.get_endpoints_collection()
         states_collection = self.get_states_collection()
-        states_query = states_collection.find({'collapsed': False})
 
-        for state_query in states_query:
-            state_id = str(state_query['_id'])
-            unexplored_endpoints_count = self.get_unexplored_endpoints_count(state_id)
-
-            if unexplored_endpoints_count > 0:
-                states_collection.update_one({'_id': ObjectId(state_id)}, {'$set': {'explored': False}})
-            else:
-                states_collection.update_one({'_id': ObjectId(state_id)}, {'$set': {'explored': True}})
+        # Group the unexplored endpoints by their state
+        unexplored_states_query = endpoints_collection.aggregate([
+            {'$match': {'allow_visit': True,
+                        'visited': False,
+                        'clean': True}},
+            {'$group': {'_id': '$state_id'}}
+        ])
+
+        # Endpoints of user defined entries can have a state id that is not a valid ObjectId
+        unexplored_state_ids = [ObjectId(entry['_id']) for entry in unexplored_states_query
+                                if ObjectId.is_valid(entry['_id'])]
+
+        states_collection.update_many({'_id': {'$in': unexplored_state_ids}, 'collapsed': False},
+                                      {'$set': {'explored': False}})
+        states_collection.update_many({'_id': {'$nin': unexplored_state_ids}, 'collapsed': False},
+                                      {'$set': {'explored': True}})
 
     def get_unexplored_endpoints_count(self, state_id: str) -> int:
         """
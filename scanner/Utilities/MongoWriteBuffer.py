@@ -0,0 +1,219 @@
+import atexit
+import os
+import time
+from threading import Lock, Thread
+from typing import List
+
+from bson import ObjectId
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+from scanner.Utilities.Logging import get_logger
+
+
+class MongoWriteBuffer:
+    """
+    A write-behind sink for a single collection. Documents are buffered locally and written with one unordered
+    `insert_many`, when the buffer reaches its maximum size, when its oldest document reaches the maximum age or when
+    :meth:`flush` is called explicitly (e.g. by a module that is about to read the collection).
+
+    The document ids are assigned locally, so the id of a buffered document is known before it is written.
+    """
+
+    def __init__(self, collection: Collection, max_size: int = 100, max_age_ms: int = 500):
+        """
+        :param collection: The collection the buffered documents are written to (including its write concern)
+        :type collection: Collection
+
+        :param max_size: Number of buffered documents that triggers a flush
+        :type max_size: int
+
+        :param max_age_ms: Age in milliseconds of the oldest buffered document that triggers a flush
+        :type max_age_ms: int
+        """
+
+        self._collection = collection
+        self._max_size = max_size
+        self._max_age_ms = max_age_ms
+        self._documents = []
+        self._oldest_timestamp_ms = None
+        self._lock = Lock()
+        # Serializes the flushes, so that a flush returns only after the documents of a concurrent flush are written
+        self._flush_lock = Lock()
+        self._logger = get_logger("Mongo Write Buffer")
+
+    def add(self, document: dict) -> str:
+        """
+        Add a document to the buffer
+
+        :param document: The document that will be inserted
+        :type document: dict
+
+        :return: The id of the document
+        :rtype: str
+        """
+
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+
+        with self._lock:
+            if len(self._documents) == 0:
+                self._oldest_timestamp_ms = int(round(time.time() * 1000))
+            self._documents.append(document)
+            flush_needed = len(self._documents) >= self._max_size or self._is_old()
+
+        if flush_needed:
+            self.flush()
+
+        return str(document['_id'])
+
+    def add_many(self, documents: List[dict]) -> List[str]:
+        """
+        Add multiple documents to the buffer
+
+        :param documents: The documents that will be inserted
+        :type documents: List[dict]
+
+        :return: The ids of the documents
+        :rtype: List[str]
+        """
+
+        return [self.add(document) for document in documents]
+
+    def flush(self) -> int:
+        """
+        Write all buffered documents to the collection
+
+        :return: The count of written documents
+        :rtype: int
+        """
+
+        # The documents are swapped out under the buffer lock and written outside of it, so that the producers are not
+        # blocked for the round trip
+        with self._flush_lock:
+            with self._lock:
+                documents = self._documents
+                self._documents = []
+                self._oldest_timestamp_ms = None
+
+            if len(documents) == 0:
+                return 0
+
+            try:
+                self._collection.insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate ids can occur if a document was added twice. The rest of the batch is still written,
+                # because the insert is unordered.
+                self._logger.warning(f'Bulk insert into {self._collection.full_name} partially failed: '
+                                     f'{len(e.details.get("writeErrors", []))} errors')
+
+        return len(documents)
+
+    def flush_if_old(self) -> int:
+        """
+        Write all buffered documents, if the oldest one reached the maximum age
+
+        :return: The count of written documents
+        :rtype: int
+        """
+
+        with self._lock:
+            flush_needed = self._is_old()
+
+        if flush_needed:
+            return self.flush()
+        return 0
+
+    def _is_old(self) -> bool:
+        if self._oldest_timestamp_ms is None:
+            return False
+        return int(round(time.time() * 1000)) - self._oldest_timestamp_ms >= self._max_age_ms
+
+
+class MongoWriteBufferRegistry:
+    """
+    A process-wide registry of :class:`MongoWriteBuffer` instances, so that all modules of a process writing to the
+    same collection with the same write concern share one buffer, and a read barrier in one module also flushes the
+    writes of the other modules of the process (not of other processes). A daemon thread flushes buffers that reached their maximum age and all buffers are
+    flushed when the process exits.
+    """
+
+    _buffers = dict()
+    _lock = Lock()
+    _flusher_thread = None
+    _flush_interval_ms = None
+
+    @classmethod
+    def get_buffer(cls, collection: Collection, max_size: int, max_age_ms: int) -> MongoWriteBuffer:
+        """
+        :param collection: The collection the buffered documents are written to (including its write concern)
+        :type collection: Collection
+
+        :param max_size: Number of buffered documents that triggers a flush
+        :type max_size: int
+
+        :param max_age_ms: Age in milliseconds of the oldest buffered document that triggers a flush
+        :type max_age_ms: int
+
+        :return: The shared buffer of the collection
+        :rtype: MongoWriteBuffer
+        """
+
+        key = (os.getpid(), collection.full_name, str(collection.write_concern.document))
+
+        with cls._lock:
+            write_buffer = cls._buffers.get(key)
+            if write_buffer is None:
+                write_buffer = MongoWriteBuffer(collection, max_size=max_size, max_age_ms=max_age_ms)
+                cls._buffers[key] = write_buffer
+                cls._start_flusher(max_age_ms)
+
+        return write_buffer
+
+    @classmethod
+    def flush(cls, full_names: List[str] = None) -> int:
+        """
+        Flush the buffers of the current process
+
+        :param full_names: Full names ('<db>.<collection>') of the collections whose buffers are flushed (all if None)
+        :type full_names: List[str]
+
+        :return: The count of written documents
+        :rtype: int
+        """
+
+        with cls._lock:
+            buffers = [write_buffer for key, write_buffer in cls._buffers.items()
+                       if key[0] == os.getpid() and (full_names is None or key[1] in full_names)]
+
+        written_count = 0
+        for write_buffer in buffers:
+            written_count += write_buffer.flush()
+        return written_count
+
+    @classmethod
+    def _flush_old(cls):
+        with cls._lock:
+            buffers = [write_buffer for key, write_buffer in cls._buffers.items() if key[0] == os.getpid()]
+
+        for write_buffer in buffers:
+            write_buffer.flush_if_old()
+
+    @classmethod
+    def _run_flusher(cls):
+        while True:
+            time.sleep(cls._flush_interval_ms / 1000)
+            cls._flush_old()
+
+    @classmethod
+    def _start_flusher(cls, max_age_ms: int):
+        if cls._flush_interval_ms is None or max_age_ms < cls._flush_interval_ms:
+            cls._flush_interval_ms = max(max_age_ms, 1)
+
+        # Threads do not survive a fork, so a forked process starts its own flusher
+        if cls._flusher_thread is None or not cls._flusher_thread.is_alive():
+            cls._flusher_thread = Thread(name='mongo_write_buffer_flusher', target=cls._run_flusher, daemon=True)
+            cls._flusher_thread.start()
+
+
+atexit.register(MongoWriteBufferRegistry.flush)
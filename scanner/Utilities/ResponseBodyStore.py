@@ -0,0 +1,119 @@
+import hashlib
+import os
+import zlib
+from threading import Lock
+from typing import List
+
+from bson import Binary
+from pymongo.collection import Collection
+
+
+class ResponseBodyStore:
+    """
+    A content-addressed store of response bodies. Every body is stored once per batch, compressed with zlib, under the
+    sha256 digest of its UTF-8 encoding, so that interactions with identical responses (revisits, navigation requests,
+    fuzzing) reference the same document.
+
+    The digests known to be stored are remembered per process, so that storing a known body costs no round trip.
+    """
+
+    _known_digests = dict()
+    _lock = Lock()
+
+    def __init__(self, collection: Collection, compression_level: int = 6):
+        """
+        :param collection: The response bodies collection of a batch
+        :type collection: Collection
+
+        :param compression_level: The zlib compression level (0-9)
+        :type compression_level: int
+        """
+
+        self._collection = collection
+        self._compression_level = compression_level
+
+    @staticmethod
+    def get_digest(data: str) -> str:
+        """
+        :param data: A response body
+        :type data: str
+
+        :return: The hex sha256 digest of the UTF-8 encoded body
+        :rtype: str
+        """
+
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def put(self, data: str) -> str:
+        """
+        Stores a response body (if it is not stored already)
+
+        :param data: A response body
+        :type data: str
+
+        :return: The digest referencing the body
+        :rtype: str
+        """
+
+        digest = self.get_digest(data)
+        key = self._get_key()
+
+        with self._lock:
+            if digest in self._known_digests.get(key, ()):
+                return digest
+
+        # The upsert keeps concurrent writers of the same body from creating duplicates
+        encoded_data = data.encode('utf-8')
+        self._collection.update_one({'_id': digest},
+                                    {'$setOnInsert': {'data': Binary(zlib.compress(encoded_data, self._compression_level)),
+                                                      'size': len(encoded_data)}},
+                                    upsert=True)
+
+        with self._lock:
+            self._known_digests.setdefault(key, set()).add(digest)
+
+        return digest
+
+    def get_many(self, digests: List[str]) -> dict:
+        """
+        Loads multiple response bodies with a single query
+
+        :param digests: Digests of the bodies
+        :type digests: List[str]
+
+        :return: The bodies mapped by their digest (missing digests are skipped)
+        :rtype: dict
+        """
+
+        bodies = dict()
+        for body_query in self._collection.find({'_id': {'$in': list(set(digests))}}, {'data': 1}):
+            bodies[body_query['_id']] = zlib.decompress(bytes(body_query['data'])).decode('utf-8')
+        return bodies
+
+    def get(self, digest: str) -> str:
+        """
+        :param digest: Digest of the body
+        :type digest: str
+
+        :return: The response body or None if it is missing
+        :rtype: str
+        """
+
+        return self.get_many([digest]).get(digest)
+
+    def _get_key(self) -> tuple:
+        return os.getpid(), self._collection.full_name
+
+    @classmethod
+    def forget(cls, full_name: str = None):
+        """
+        Drops the known digests of the current process, e.g. after the store collection was dropped
+
+        :param full_name: Full name ('<db>.<collection>') of the store collection (all if None)
+        :type full_name: str
+        """
+
+        with cls._lock:
+            for key in list(cls._known_digests):
+                if full_name is None or key[1] == full_name:
+                    del cls._known_digests[key]
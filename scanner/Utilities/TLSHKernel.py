@@ -0,0 +1,196 @@
+from typing import List
+
+import numpy as np
+
+# Layout of a decoded digest: checksum, L-value, Q-ratios (both nibbles) and the 32 bytes of bucket codes
+TLSH_HEADER_SIZE = 3
+TLSH_BODY_SIZE = 32
+TLSH_PACKED_SIZE = TLSH_HEADER_SIZE + TLSH_BODY_SIZE
+TLSH_VERSION_PREFIX = 'T1'
+
+_CHECKSUM = 0
+_LVALUE = 1
+_QRATIOS = 2
+
+
+class InvalidTLSHDigest(ValueError):
+    """
+    Thrown when a string can not be decoded as a TLSH digest (e.g. 'TNULL').
+    """
+    pass
+
+
+def _swap_nibbles(value: int) -> int:
+    return ((value & 0x0F) << 4) | ((value & 0xF0) >> 4)
+
+
+def _generate_byte_pair_diffs() -> np.ndarray:
+    """
+    Creates the table of the body distance of two code bytes. Every byte holds four 2-bit bucket codes, whose
+    difference is counted as is, except the maximal difference of 3, which is counted as 6 (as in tlsh.diff).
+    """
+
+    byte_values = np.arange(256, dtype=np.int16)
+    table = np.zeros((256, 256), dtype=np.int16)
+    for shift in (0, 2, 4, 6):
+        codes = (byte_values >> shift) & 0b11
+        code_diffs = np.abs(codes[:, None] - codes[None, :])
+        table += np.where(code_diffs == 3, 6, code_diffs)
+    return table
+
+
+_BYTE_PAIR_DIFFS = _generate_byte_pair_diffs()
+
+
+def unpack_digest(digest) -> np.ndarray:
+    """
+    Decodes a TLSH digest into its compact form
+
+    :param digest: A hex digest (with or without the 'T1' version prefix) or a digest packed with :func:`pack_digest`
+    :type digest: str or bytes
+
+    :return: The header (checksum, L-value, Q-ratios) and the body bytes
+    :rtype: numpy.ndarray (uint8, 35 entries)
+
+    :raises InvalidTLSHDigest: If the input is not a TLSH digest
+    """
+
+    if isinstance(digest, (bytes, bytearray)):
+        if len(digest) != TLSH_PACKED_SIZE:
+            raise InvalidTLSHDigest(f'A packed TLSH digest must have {TLSH_PACKED_SIZE} bytes')
+        return np.frombuffer(bytes(digest), dtype=np.uint8).copy()
+
+    if not isinstance(digest, str):
+        raise InvalidTLSHDigest(f'Can not decode {type(digest)} as TLSH digest')
+
+    if digest.startswith(TLSH_VERSION_PREFIX):
+        digest = digest[len(TLSH_VERSION_PREFIX):]
+
+    try:
+        raw_bytes = bytes.fromhex(digest)
+    except ValueError:
+        raise InvalidTLSHDigest(f'{digest} is not a TLSH digest')
+
+    if len(raw_bytes) != TLSH_PACKED_SIZE:
+        raise InvalidTLSHDigest(f'{digest} is not a TLSH digest')
+
+    unpacked = np.frombuffer(raw_bytes, dtype=np.uint8).copy()
+
+    # The header bytes are written with swapped nibbles in the hex digest (the body bytes are only written in reverse
+    # order, which does not change the distance)
+    for idx in (_CHECKSUM, _LVALUE, _QRATIOS):
+        unpacked[idx] = _swap_nibbles(int(unpacked[idx]))
+    return unpacked
+
+
+def unpack_digests(digests: list) -> np.ndarray:
+    """
+    :param digests: Hex or packed TLSH digests
+    :type digests: list
+
+    :return: The decoded digests (one row per digest)
+    :rtype: numpy.ndarray (uint8, shape n x 35)
+
+    :raises InvalidTLSHDigest: If one of the inputs is not a TLSH digest
+    """
+
+    unpacked = np.empty((len(digests), TLSH_PACKED_SIZE), dtype=np.uint8)
+    for idx, digest in enumerate(digests):
+        unpacked[idx] = unpack_digest(digest)
+    return unpacked
+
+
+def pack_digest(digest: str) -> bytes:
+    """
+    :param digest: A hex TLSH digest
+    :type digest: str
+
+    :return: The digest as 35 bytes (e.g. for storing it as binary instead of a 72 character string)
+    :rtype: bytes
+    """
+
+    return unpack_digest(digest).tobytes()
+
+
+def to_hex_digest(packed_digest: bytes) -> str:
+    """
+    :param packed_digest: A digest packed with :func:`pack_digest`
+    :type packed_digest: bytes
+
+    :return: The hex digest with the 'T1' version prefix (as returned by tlsh.hash)
+    :rtype: str
+    """
+
+    unpacked = unpack_digest(packed_digest)
+    for idx in (_CHECKSUM, _LVALUE, _QRATIOS):
+        unpacked[idx] = _swap_nibbles(int(unpacked[idx]))
+    return TLSH_VERSION_PREFIX + unpacked.tobytes().hex().upper()
+
+
+def _mod_diff(values1: np.ndarray, values2: np.ndarray, modulus: int) -> np.ndarray:
+    diffs = np.abs(values1.astype(np.int32) - values2.astype(np.int32))
+    return np.minimum(diffs, modulus - diffs)
+
+
+def diff_row(unpacked_digest: np.ndarray, unpacked_digests: np.ndarray) -> np.ndarray:
+    """
+    Calculates the distance of one digest to many digests with the scoring of tlsh.diff (including the length
+    difference)
+
+    :param unpacked_digest: A decoded digest (see :func:`unpack_digest`)
+    :type unpacked_digest: numpy.ndarray
+
+    :param unpacked_digests: Decoded digests (see :func:`unpack_digests`)
+    :type unpacked_digests: numpy.ndarray
+
+    :return: The distances
+    :rtype: numpy.ndarray (int32)
+    """
+
+    # L-value: a difference of 0 or 1 is counted as is, otherwise it is weighted with 12
+    lvalue_diffs = _mod_diff(unpacked_digests[:, _LVALUE], unpacked_digest[_LVALUE], 256)
+    distances = np.where(lvalue_diffs <= 1, lvalue_diffs, lvalue_diffs * 12)
+
+    # Q-ratios: a difference of 0 or 1 is counted as is, otherwise the difference exceeding 1 is weighted with 12
+    for shift in (0, 4):
+        q_diffs = _mod_diff((unpacked_digests[:, _QRATIOS] >> shift) & 0x0F,
+                            (unpacked_digest[_QRATIOS] >> shift) & 0x0F,
+                            16)
+        distances += np.where(q_diffs <= 1, q_diffs, (q_diffs - 1) * 12)
+
+    distances += (unpacked_digests[:, _CHECKSUM] != unpacked_digest[_CHECKSUM]).astype(np.int32)
+
+    body_diffs = _BYTE_PAIR_DIFFS[unpacked_digests[:, TLSH_HEADER_SIZE:], unpacked_digest[TLSH_HEADER_SIZE:]]
+    distances += body_diffs.sum(axis=1, dtype=np.int32)
+
+    return distances.astype(np.int32)
+
+
+def diff_condensed(unpacked_digests: np.ndarray) -> np.ndarray:
+    """
+    Calculates the pairwise distances of the upper triangle (in the row-major order of
+    :func:`scipy.spatial.distance.squareform`), one vectorized row at a time
+
+    :param unpacked_digests: Decoded digests (see :func:`unpack_digests`)
+    :type unpacked_digests: numpy.ndarray
+
+    :return: The condensed distances
+    :rtype: numpy.ndarray (float64)
+    """
+
+    n = unpacked_digests.shape[0]
+    if n < 2:
+        return np.empty(0, dtype=np.float64)
+
+    return np.concatenate([diff_row(unpacked_digests[row], unpacked_digests[row + 1:])
+                           for row in range(n - 1)]).astype(np.float64)
+
+
+def tlsh_condensed(values: List) -> np.ndarray:
+    """
+    The vectorized condensed TLSH distances of hex or packed digests
+
+    :raises InvalidTLSHDigest: If one of the inputs is not a TLSH digest
+    """
+
+    return diff_condensed(unpack_digests(values))
@@ -4,6 +4,8 @@ from typing import List
 
 from pandas import DataFrame
 
+from scanner.Utilities.Hash2Vec import get_hash_codes
+
 
 def random_string(character_count: int = 200):
     """
@@ -50,17 +52,8 @@ def generate_hash2vec_dataset(hashes: List[str]):
     :return: A numerical dataset created from the hashes
     :rtype: pandas.DataFrame
     """
-    # Split hashes by character
-    split_hashes = []
-    for entry in hashes:
-        split_hash = [char for char in entry]
-        split_hashes.append(split_hash)
-
-    # Create dataframe from hashes
-    hash2vec_df = DataFrame(split_hashes)
-    hash2vec_df = hash2vec_df.applymap(ord)
-
-    return hash2vec_df
+    # The ASCII codes of all hashes at once (see Hash2Vec.hash2vec_matrix for the normalized vectors)
+    return DataFrame(get_hash_codes(hashes))
 
 
 local_config = None